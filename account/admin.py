@@ -1,3 +1,15 @@
 from django.contrib import admin
 
-# Register your models here.
+from account.models import OutboxEmail, RevokedToken
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ("subject", "to", "status", "attempts", "send_after", "sent_at")
+    list_filter = ("status",)
+
+
+@admin.register(RevokedToken)
+class RevokedTokenAdmin(admin.ModelAdmin):
+    list_display = ("jti", "revoked_at", "expires_at")
+    search_fields = ("jti",)
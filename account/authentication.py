@@ -0,0 +1,93 @@
+import copy
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+from account.claims import delete_profile_versions
+from account.revocation import revoked_tokens
+from utils.cache import LRUCache
+
+# user id -> (auth version, user), raw token -> (expiry, validated token)
+user_cache = LRUCache(settings.AUTH_USER_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL)
+token_cache = LRUCache(settings.AUTH_TOKEN_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL)
+
+
+def _auth_version_key(user_id):
+    return f"auth_version:{user_id}"
+
+
+def _new_auth_version():
+    # versions never repeat, a user cached under a version the cache lost cannot match again
+    return uuid.uuid4().hex
+
+
+def get_auth_version(user_id):
+    """The user's auth version, a new one when it is missing from the default cache."""
+    key = _auth_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_auth_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _bump_auth_versions(user_ids):
+    cache.set_many({_auth_version_key(user_id): _new_auth_version() for user_id in user_ids}, timeout=None)
+    for user_id in user_ids:
+        user_cache.delete(user_id)
+    # the profile claims of their tokens are outdated as well
+    delete_profile_versions(user_ids)
+
+
+def invalidate_users(user_ids):
+    """
+    Bump the auth version of the given users, so every process resolves them
+    from the database again.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    _bump_auth_versions(user_ids)
+    if not transaction.get_autocommit():
+        # again once committed, a request may have cached the old row in between
+        transaction.on_commit(lambda: _bump_auth_versions(user_ids))
+
+
+def get_auth_cache_stats():
+    return {"users": user_cache.stats(), "tokens": token_cache.stats(), "revoked_tokens": revoked_tokens.stats()}
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    `JWTAuthentication` that keeps recently verified tokens and resolved users
+    in in-process LRU caches, so most requests neither check a signature nor
+    query the user table.
+
+    Users are cached with their auth version, which is bumped whenever the user
+    is saved or deleted, when `AUTH_USER_CACHE` is on. Every request gets its
+    own copy of the cached user.
+    """
+
+    def get_validated_token(self, raw_token):
+        entry = token_cache.get(raw_token)
+        if entry is not None and entry[0] > time.time():
+            return entry[1]
+        validated_token = super().get_validated_token(raw_token)
+        token_cache.set(raw_token, (validated_token["exp"], validated_token))
+        return validated_token
+
+    def get_user(self, validated_token):
+        if not settings.AUTH_USER_CACHE:
+            return super().get_user(validated_token)
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        version = get_auth_version(user_id)
+        entry = user_cache.get(user_id)
+        if entry is None or version is None or entry[0] != version:
+            entry = (version, super().get_user(validated_token))
+            user_cache.set(user_id, entry)
+        return copy.copy(entry[1])
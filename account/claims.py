@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework_simplejwt.settings import api_settings
+
+from users.models import Profile
+
+# user fields copied into the tokens as they are
+USER_CLAIMS = ("username", "email", "first_name", "last_name", "is_staff")
+
+
+def _profile_version_key(user_id):
+    return f"profile_version:{user_id}"
+
+
+def get_profile_version(user_id):
+    """
+    The `updated_at` of the user's profile as an ISO string, or None without a
+    profile. It is read from the default cache and kept there for
+    `AUTH_CACHE_TTL` seconds, until the user or their avatar changes.
+    """
+    key = _profile_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        updated_at = Profile.objects.filter(user_id=user_id).values_list("updated_at", flat=True).first()
+        if updated_at is None:
+            return None
+        version = updated_at.isoformat()
+        cache.set(key, version, timeout=settings.AUTH_CACHE_TTL)
+    return version
+
+
+def delete_profile_versions(user_ids):
+    cache.delete_many([_profile_version_key(user_id) for user_id in user_ids])
+
+
+def forget_profile_versions(user_ids):
+    """Drop the cached profile versions of the given users after a change of their claims."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    delete_profile_versions(user_ids)
+    if not transaction.get_autocommit():
+        # again once committed, a request may have cached the old version in between
+        transaction.on_commit(lambda: delete_profile_versions(user_ids))
+
+
+def add_profile_claims(token, user):
+    """Copy the user's account fields and profile version into `token` when `JWT_PROFILE_CLAIMS` is on."""
+    if not settings.JWT_PROFILE_CLAIMS:
+        return token
+    profile = user.profile
+    for field in USER_CLAIMS:
+        token[field] = getattr(user, field)
+    token["avatar"] = profile.avatar.name or ""
+    token["avatar_status"] = profile.avatar_status
+    token["profile_version"] = profile.updated_at.isoformat()
+    return token
+
+
+def get_claims_user(token):
+    """
+    An unsaved user and profile rebuilt from the claims of `token`, or None when
+    it has none or they are older than the current profile version.
+    """
+    version = token.get("profile_version")
+    user_id = token.get(api_settings.USER_ID_CLAIM)
+    if version is None or version != get_profile_version(user_id):
+        return None
+    user = User(id=user_id, **{field: token[field] for field in USER_CLAIMS})
+    user.profile = Profile(user=user, avatar=token["avatar"], avatar_status=token["avatar_status"])
+    return user
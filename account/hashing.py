@@ -0,0 +1,94 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+_executor = None
+_executor_lock = threading.Lock()
+_queue_slots = None
+
+
+class HashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Too many password checks in progress, try again later."
+    default_code = "hashing_busy"
+
+    def __init__(self, detail=None, code=None):
+        super().__init__(detail, code)
+        # picked up by DRF's exception handler as the Retry-After header
+        self.wait = settings.PASSWORD_HASHING_RETRY_AFTER
+
+
+def get_executor():
+    global _executor, _queue_slots
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.PASSWORD_HASHING_WORKERS, thread_name_prefix="password-hashing"
+            )
+            _queue_slots = threading.BoundedSemaphore(
+                settings.PASSWORD_HASHING_WORKERS + settings.PASSWORD_HASHING_QUEUE_SIZE
+            )
+    return _executor
+
+
+def _run_in_worker(fn, *args):
+    try:
+        return fn(*args)
+    finally:
+        _queue_slots.release()
+
+
+def run_hashing(fn, *args):
+    """
+    Run the password hashing function `fn` on the hashing pool and return its
+    result.
+
+    At most `PASSWORD_HASHING_WORKERS` hashes run at once, whatever the number of
+    request threads, and up to `PASSWORD_HASHING_QUEUE_SIZE` more wait for a
+    worker. Beyond that `HashingBusy` is raised, so a login burst is answered
+    with 503s instead of occupying every worker. With no workers `fn` runs inline.
+    """
+    if not settings.PASSWORD_HASHING_WORKERS:
+        return fn(*args)
+
+    executor = get_executor()
+    if not _queue_slots.acquire(blocking=False):
+        raise HashingBusy
+    try:
+        future = executor.submit(_run_in_worker, fn, *args)
+    except BaseException:
+        _queue_slots.release()
+        raise
+    return future.result()
+
+
+def hash_password(raw_password):
+    return run_hashing(make_password, raw_password)
+
+
+def _verify(raw_password, encoded):
+    # the upgrade is only recorded here, the user is saved on the request thread
+    outdated = []
+    return check_password(raw_password, encoded, setter=outdated.append), bool(outdated)
+
+
+def verify_password(user, raw_password):
+    """
+    `user.check_password()` with the hash verified on the hashing pool. Hashes
+    made with an outdated hasher or iteration count are upgraded like Django does.
+    """
+    is_correct, must_update = run_hashing(_verify, raw_password, user.password)
+    if is_correct and must_update:
+        user.password = hash_password(raw_password)
+        user.save(update_fields=["password"])
+    return is_correct
+
+
+def set_password(user, raw_password):
+    """`user.set_password()` with the hash computed on the hashing pool."""
+    user.password = hash_password(raw_password)
+    user._password = raw_password
@@ -0,0 +1,98 @@
+import json
+import logging
+import statistics
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken
+
+
+USERNAME = "benchmark_login_storm"
+PASSWORD = "benchmark-password"
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the latency of /users/<pk>/ while a burst of logins hits a server with a fixed number of "
+        "request threads, hashing passwords inline and on the password hashing pool"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8, help="Request threads of the simulated server")
+        parser.add_argument("--logins", type=int, default=100, help="Logins sent at once")
+        parser.add_argument("--requests", type=int, default=50, help="/users/<pk>/ requests sent during the storm")
+        parser.add_argument("--interval", type=float, default=0.02, help="Seconds between /users/<pk>/ requests")
+        parser.add_argument("--hashing-workers", type=int, default=settings.PASSWORD_HASHING_WORKERS or 1)
+        parser.add_argument("--hashing-queue-size", type=int, default=settings.PASSWORD_HASHING_QUEUE_SIZE)
+
+    def handle(self, *args, **options):
+        user = User(username=USERNAME, is_staff=True)
+        user.password = make_password(PASSWORD)
+        user.save()
+        # every shed login would be logged as a server error
+        logging.getLogger("django.request").setLevel(logging.CRITICAL)
+        try:
+            factory = RequestFactory()
+            login_body = json.dumps({"username": USERNAME, "password": PASSWORD})
+            authorization = f"Bearer {AccessToken.for_user(user)}"
+
+            # every request needs its own environ, the body is read from a stream
+            def login_environ():
+                return factory.post(reverse("login"), login_body, content_type="application/json").environ
+
+            def detail_environ():
+                return factory.get(
+                    reverse("user-detail", kwargs={"pk": user.pk}), HTTP_AUTHORIZATION=authorization
+                ).environ
+
+            with override_settings(ALLOWED_HOSTS=["*"], PASSWORD_HASHING_WORKERS=0):
+                self.run("inline hashing", login_environ, detail_environ, options)
+            with override_settings(
+                ALLOWED_HOSTS=["*"],
+                PASSWORD_HASHING_WORKERS=options["hashing_workers"],
+                PASSWORD_HASHING_QUEUE_SIZE=options["hashing_queue_size"],
+            ):
+                self.run(
+                    f"hashing pool ({options['hashing_workers']}+{options['hashing_queue_size']})",
+                    login_environ,
+                    detail_environ,
+                    options,
+                )
+        finally:
+            user.delete()
+
+    def run(self, name, login_environ, detail_environ, options):
+        handler = WSGIHandler()
+
+        def timed(make_environ, queued_at):
+            statuses = []
+            response = handler(make_environ(), lambda status, headers, exc_info=None: statuses.append(status))
+            b"".join(response)
+            response.close()
+            # the latency a client sees, including the wait for a free request thread
+            return statuses[0].split()[0], time.perf_counter() - queued_at
+
+        with ThreadPoolExecutor(max_workers=options["threads"]) as server:
+            logins = [server.submit(timed, login_environ, time.perf_counter()) for _ in range(options["logins"])]
+            details = []
+            for _ in range(options["requests"]):
+                details.append(server.submit(timed, detail_environ, time.perf_counter()))
+                time.sleep(options["interval"])
+            login_results = [future.result() for future in logins]
+            detail_results = [future.result() for future in details]
+
+        latencies = sorted(elapsed * 1000 for _code, elapsed in detail_results)
+        self.stdout.write(
+            f"{name:<22} /users/<pk>/ p50 {statistics.median(latencies):>8.1f} ms "
+            f"p95 {latencies[int(len(latencies) * 0.95) - 1]:>8.1f} ms max {latencies[-1]:>8.1f} ms | "
+            f"detail {dict(Counter(code for code, _elapsed in detail_results))} "
+            f"logins {dict(Counter(code for code, _elapsed in login_results))}"
+        )
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from account.outbox import send_outbox
+
+
+class Command(BaseCommand):
+    help = "Send the emails waiting in the outbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None, help="Emails sent over one connection")
+        parser.add_argument("--loop", action="store_true", help="Keep polling the outbox instead of exiting")
+        parser.add_argument("--interval", type=float, default=5, help="Seconds between polls with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            count = send_outbox(options["batch_size"])
+            if count:
+                self.stdout.write(f"Attempted {count} emails")
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,148 @@
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connections, transaction
+from django.utils import timezone
+
+from account.models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_MODES = ("sync", "thread", "command")
+
+_worker = None
+_worker_lock = threading.Lock()
+_worker_wakeup = threading.Event()
+
+
+def queue_emails(messages):
+    """
+    Write `EmailMessage`s to the outbox in the current transaction.
+
+    They are delivered once it commits, according to `EMAIL_OUTBOX_DELIVERY`:
+    right away on the committing thread (`sync`), by a worker thread of this
+    process (`thread`) or only by `manage.py send_outbox` (`command`).
+    """
+    emails = OutboxEmail.objects.bulk_create(
+        [
+            OutboxEmail(
+                subject=message.subject,
+                body=message.body,
+                content_subtype=message.content_subtype,
+                from_email=message.from_email,
+                to=list(message.to),
+            )
+            for message in messages
+        ]
+    )
+    if emails:
+        transaction.on_commit(deliver_outbox)
+    return emails
+
+
+def deliver_outbox():
+    delivery = settings.EMAIL_OUTBOX_DELIVERY
+    if delivery == "sync":
+        send_outbox()
+    elif delivery == "thread":
+        wake_outbox_worker()
+
+
+def get_retry_delay(attempts):
+    """Seconds to wait after the `attempts`th failed attempt, doubling every time."""
+    return min(settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (attempts - 1), settings.EMAIL_OUTBOX_MAX_RETRY_DELAY)
+
+
+def claim_outbox_batch(batch_size):
+    """Take up to `batch_size` due emails, hiding them from other senders for `EMAIL_OUTBOX_LEASE` seconds."""
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboxEmail.Status.PENDING, send_after__lte=now)
+            .order_by("send_after", "id")[:batch_size]
+        )
+        OutboxEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+            send_after=now + timedelta(seconds=settings.EMAIL_OUTBOX_LEASE)
+        )
+    return emails
+
+
+def _record_failure(email, error):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = OutboxEmail.Status.FAILED
+        logger.error("Giving up on outbox email %s after %s attempts: %s", email.pk, email.attempts, error)
+    else:
+        email.send_after = timezone.now() + timedelta(seconds=get_retry_delay(email.attempts))
+
+
+def send_outbox_batch(batch_size=None):
+    """Send one batch of due emails over a single connection and return how many were attempted."""
+    emails = claim_outbox_batch(batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE)
+    if not emails:
+        return 0
+
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        logger.warning("Could not connect to the mail server: %s", e)
+        for email in emails:
+            _record_failure(email, e)
+    else:
+        try:
+            for email in emails:
+                message = EmailMessage(email.subject, email.body, email.from_email, email.to, connection=connection)
+                message.content_subtype = email.content_subtype
+                try:
+                    connection.send_messages([message])
+                except Exception as e:
+                    _record_failure(email, e)
+                else:
+                    email.status = OutboxEmail.Status.SENT
+                    email.attempts += 1
+                    email.sent_at = timezone.now()
+        finally:
+            connection.close()
+
+    OutboxEmail.objects.bulk_update(emails, ["status", "attempts", "last_error", "send_after", "sent_at"])
+    return len(emails)
+
+
+def send_outbox(batch_size=None):
+    """Drain every due email from the outbox and return how many were attempted."""
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    total = 0
+    while True:
+        count = send_outbox_batch(batch_size)
+        total += count
+        if count < batch_size:
+            return total
+
+
+def _run_outbox_worker():
+    while True:
+        # emails waiting for a retry are picked up on the next wake up or timeout
+        _worker_wakeup.wait(timeout=settings.EMAIL_OUTBOX_RETRY_DELAY)
+        _worker_wakeup.clear()
+        try:
+            send_outbox()
+        except Exception:
+            logger.exception("Sending the outbox failed")
+        finally:
+            connections.close_all()
+
+
+def wake_outbox_worker():
+    """Start the outbox worker thread of this process if needed and have it drain the outbox."""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_run_outbox_worker, name="outbox", daemon=True)
+            _worker.start()
+    _worker_wakeup.set()
@@ -0,0 +1,139 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+
+from account.models import RevokedToken
+from utils.bloom import BloomFilter
+
+# rows revoked this long before the previous sync are read again, in case their
+# transaction committed after it
+SYNC_MARGIN = timedelta(seconds=60)
+
+
+class RevocationStore:
+    """
+    In-memory copy of the `RevokedToken` table.
+
+    Lookups go through a Bloom filter first, so the usual answer (not revoked)
+    costs a few hashes, and positives are confirmed against the exact set of
+    ids. The copy is refreshed from the table at most every `sync_interval`
+    seconds, reading only the rows revoked since the previous sync. Tokens drop
+    out of both, and of the table, once they would have expired anyway.
+    """
+
+    def __init__(self, capacity, error_rate, sync_interval):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self.clear()
+
+    def __len__(self):
+        return len(self._expiry)
+
+    def clear(self):
+        with self._lock:
+            # jti -> expiry timestamp
+            self._expiry = {}
+            self._bloom = BloomFilter(self.capacity, self.error_rate)
+            self._synced_at = None
+            self._synced_until = None
+
+    def _add(self, jti, expires):
+        if jti in self._expiry:
+            return
+        self._expiry[jti] = expires
+        if len(self._bloom) >= self._bloom.capacity:
+            self._rebuild()
+        else:
+            self._bloom.add(jti)
+
+    def _rebuild(self):
+        bloom = BloomFilter(max(self.capacity, len(self._expiry) * 2), self.error_rate)
+        for jti in self._expiry:
+            bloom.add(jti)
+        self._bloom = bloom
+
+    def add(self, jti, expires):
+        with self._lock:
+            self._add(jti, expires)
+
+    def contains(self, jti):
+        if self._synced_at is None or time.monotonic() - self._synced_at >= self.sync_interval:
+            self.sync()
+        with self._lock:
+            return jti in self._bloom and jti in self._expiry
+
+    def _purge(self):
+        now = time.time()
+        expired = [jti for jti, expires in self._expiry.items() if expires <= now]
+        for jti in expired:
+            del self._expiry[jti]
+        if expired:
+            self._rebuild()
+        return len(expired)
+
+    def sync(self):
+        """Read the tokens revoked since the last sync, one thread at a time."""
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            now = timezone.now()
+            rows = RevokedToken.objects.filter(expires_at__gt=now)
+            if self._synced_until is not None:
+                rows = rows.filter(revoked_at__gte=self._synced_until - SYNC_MARGIN)
+            rows = list(rows.values_list("jti", "expires_at"))
+            with self._lock:
+                for jti, expires_at in rows:
+                    self._add(jti, expires_at.timestamp())
+                purged = self._purge()
+                self._synced_until = now
+                self._synced_at = time.monotonic()
+            if purged:
+                # when this copy had expired tokens, so has the table
+                RevokedToken.objects.filter(expires_at__lte=now).delete()
+        finally:
+            self._sync_lock.release()
+
+    def stats(self):
+        return {
+            "tokens": len(self._expiry),
+            "bloom_bytes": len(self._bloom.bits),
+            "bloom_hashes": self._bloom.hash_count,
+        }
+
+
+revoked_tokens = RevocationStore(
+    settings.REFRESH_REVOCATION_CAPACITY,
+    settings.REFRESH_REVOCATION_ERROR_RATE,
+    settings.REFRESH_REVOCATION_SYNC_INTERVAL,
+)
+
+
+def is_revoked(token):
+    return revoked_tokens.contains(token[api_settings.JTI_CLAIM])
+
+
+def revoke_token(token):
+    """
+    Revoke `token` in every process. Returns False when it already was, which
+    makes this the single point where a refresh token is used up: of two
+    requests racing with the same token only one gets True.
+    """
+    jti = token[api_settings.JTI_CLAIM]
+    expires = token["exp"]
+    try:
+        with transaction.atomic():
+            RevokedToken.objects.create(jti=jti, expires_at=datetime.fromtimestamp(expires, tz=dt_timezone.utc))
+    except IntegrityError:
+        revoked = False
+    else:
+        revoked = True
+    revoked_tokens.add(jti, expires)
+    return revoked
@@ -1,25 +1,45 @@
-from django.contrib.auth.models import User
-from rest_framework import serializers
+from django.conf import settings
+from django.contrib.auth.models import User, update_last_login
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from rest_framework import exceptions, serializers
 
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.serializers import (
     TokenObtainPairSerializer,
     TokenRefreshSerializer,
 )
 
-from users.models import Profile
+from account.backends import PooledModelBackend
+from account.claims import add_profile_claims
+from account.revocation import is_revoked, revoke_token
+
+from users.avatars import get_avatar_srcset
+from utils.serializers import SparseFieldsMixin
 
 
 class LoginSerializer(TokenObtainPairSerializer):
     default_error_messages = {"no_active_account": "Invalid credentials!"}
+    # only logins through the API check passwords on the hashing pool, DRF answers its `HashingBusy` with a 503
+    backend = PooledModelBackend()
+
+    @classmethod
+    def get_token(cls, user):
+        return add_profile_claims(super().get_token(user), user)
 
     def validate(self, attrs):
-        data = super().validate(attrs)
+        self.user = self.backend.authenticate(
+            self.context.get("request"),
+            **{self.username_field: attrs[self.username_field], "password": attrs["password"]},
+        )
+        if not api_settings.USER_AUTHENTICATION_RULE(self.user):
+            raise exceptions.AuthenticationFailed(self.error_messages["no_active_account"], "no_active_account")
 
-        #         rename refresh to refresh_token
-        data["refresh_token"] = data.pop("refresh")
-        data["access_token"] = data.pop("access")
+        refresh = self.get_token(self.user)
+        if api_settings.UPDATE_LAST_LOGIN:
+            update_last_login(None, self.user)
 
-        return data
+        return {"refresh_token": str(refresh), "access_token": str(refresh.access_token)}
 
 
 class RefreshTokenSerializer(TokenRefreshSerializer):
@@ -27,9 +47,25 @@ class RefreshTokenSerializer(TokenRefreshSerializer):
         fields = ("refresh_token",)
 
     def validate(self, attrs):
-        data = super().validate(attrs)
-
-        data["access_token"] = data.pop("access")
+        refresh = self.token_class(attrs["refresh"])
+
+        # refresh tokens are single use, each refresh revokes the token and returns a new one; the rotation is
+        # done here instead of by simplejwt's ROTATE_REFRESH_TOKENS, which this validate never reads
+        if is_revoked(refresh) or not revoke_token(refresh):
+            raise TokenError("Token is revoked")
+
+        if settings.JWT_PROFILE_CLAIMS:
+            # the claims are read again, the new tokens carry the current profile
+            user = User.objects.select_related("profile").filter(pk=refresh[api_settings.USER_ID_CLAIM]).first()
+            if user is None or not user.is_active:
+                raise TokenError("User not found")
+            add_profile_claims(refresh, user)
+
+        data = {"access_token": str(refresh.access_token)}
+        refresh.set_jti()
+        refresh.set_exp()
+        refresh.set_iat()
+        data["refresh_token"] = str(refresh)
 
         return data
 
@@ -38,19 +74,24 @@ class RegisterSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ("id", "username", "email", "first_name", "last_name", "password")
-        extra_kwargs = {"password": {"write_only": True}}
+        # a taken username is answered with 409 by the view, from the unique constraint
+        extra_kwargs = {"password": {"write_only": True}, "username": {"validators": [UnicodeUsernameValidator()]}}
+
 
+class AccountSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    avatar = serializers.SerializerMethodField()
+    avatar_srcset = serializers.SerializerMethodField()
 
-class AccountSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
-        fields = ("id", "username", "email", "first_name", "last_name", "is_staff")
+        fields = ("id", "username", "email", "first_name", "last_name", "is_staff", "avatar", "avatar_srcset")
+
+    def get_avatar(self, instance):
+        profile = instance.profile
+        return profile.avatar.url if profile.avatar else ""
 
-    def to_representation(self, instance):
-        ret = super().to_representation(instance)
-        profile = Profile.objects.get(user=instance)
-        ret["avatar"] = profile.avatar.url if profile.avatar else ""
-        return ret
+    def get_avatar_srcset(self, instance):
+        return get_avatar_srcset(instance.profile, self.context.get("request"))
 
 
 class ChangePasswordSerializer(serializers.Serializer):
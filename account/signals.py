@@ -0,0 +1,35 @@
+from django.contrib.auth.models import User
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from account.authentication import invalidate_users
+from account.claims import forget_profile_versions
+from users.models import Profile
+from utils.deletes import collect_until_commit, deletes_are_handled
+
+
+@receiver(post_save, sender=User)
+def invalidate_saved_user(sender, instance, created, update_fields=None, **kwargs):
+    # password, is_active and is_staff changes all go through here, logins only write last_login
+    if created or update_fields is not None and set(update_fields) <= {"last_login"}:
+        return
+    invalidate_users([instance.pk])
+
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_user(sender, instance, origin=None, **kwargs):
+    if deletes_are_handled():
+        return
+    if isinstance(origin, QuerySet):
+        # queryset deletes invalidate their users in one go once committed
+        collect_until_commit(origin, invalidate_users, instance.pk)
+    else:
+        invalidate_users([instance.pk])
+
+
+@receiver(post_save, sender=Profile)
+def forget_saved_profile_version(sender, instance, created, **kwargs):
+    # the avatar claims of the tokens are outdated, new profiles have no tokens yet
+    if not created:
+        forget_profile_versions([instance.user_id])
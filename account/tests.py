@@ -1,11 +1,47 @@
+import io
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+
 from rest_framework import status
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
 from django.urls import reverse
 from django.contrib.auth.tokens import default_token_generator
 from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 
-from config.tests import GlobalTestSetup, inject_token, login_url, valid_credentials, invalid_credentials
+from config.tests import (
+    GlobalTestSetup,
+    LocalSMTPServer,
+    inject_token,
+    login_url,
+    valid_credentials,
+    invalid_credentials,
+)
 
+from account import hashing
+from account.authentication import CachedJWTAuthentication, token_cache, user_cache
+from account.models import OutboxEmail, RevokedToken
+from account.outbox import send_outbox
+from account.revocation import is_revoked, revoked_tokens
+from account.throttling import token_buckets
+from users.models import Profile
+from utils.bloom import BloomFilter
+from utils.ratelimit import LocalTokenBuckets, MappedTokenBuckets
 from utils.mail import send_set_password_email
 
 refresh_token_url = reverse("refresh-token")
@@ -14,6 +50,13 @@ get_current_user_url = reverse("me")
 change_password_url = reverse("change-password")
 forgot_password_url = reverse("forgot-password")
 set_password_url = reverse("set-password")
+auth_cache_stats_url = reverse("auth-cache-stats")
+
+
+def saturate_hashing_pool():
+    """Patch the hashing pool to look like every worker and queue slot is taken."""
+    hashing.get_executor()
+    return mock.patch.object(hashing, "_queue_slots", threading.Semaphore(0))
 
 
 class LoginViewTestCase(GlobalTestSetup):
@@ -28,6 +71,42 @@ class LoginViewTestCase(GlobalTestSetup):
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
         self.assertEqual(response.data["detail"], "Invalid credentials!")
 
+    @mock.patch("rest_framework_simplejwt.serializers.api_settings.UPDATE_LAST_LOGIN", True)
+    def test_login_only_updates_last_login(self):
+        updated_at = Profile.objects.get(user=self.user).updated_at
+        # the user, then one UPDATE of last_login
+        with self.assertNumQueries(2):
+            response = self.client.post(login_url, valid_credentials, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Profile.objects.get(user=self.user).updated_at, updated_at)
+
+    def test_login_when_hashing_pool_is_saturated(self):
+        with saturate_hashing_pool():
+            response = self.client.post(login_url, valid_credentials, format="json")
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response["Retry-After"], "1")
+        self.assertEqual(response.data["detail"].code, "hashing_busy")
+
+    def test_authenticate_outside_the_api_when_hashing_pool_is_saturated(self):
+        # Django's own logins, such as the admin's, cannot answer a 503 and hash inline
+        with saturate_hashing_pool():
+            self.assertEqual(authenticate(**valid_credentials), self.user)
+            response = self.client.post(reverse("admin:login"), {**valid_credentials, "next": reverse("admin:index")})
+        self.assertRedirects(response, reverse("admin:index"))
+
+    @override_settings(PASSWORD_HASHING_WORKERS=0)
+    def test_login_with_inline_hashing(self):
+        response = self.client.post(login_url, valid_credentials, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_login_upgrades_outdated_hash(self):
+        User.objects.filter(pk=self.user.pk).update(password=make_password("test_password", hasher="pbkdf2_sha1"))
+        response = self.client.post(login_url, valid_credentials, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith("pbkdf2_sha256$"))
+        self.assertTrue(self.user.check_password("test_password"))
+
 
 class RefreshTokenViewTestCase(GlobalTestSetup):
     def test_refresh_token_with_valid_credentials(self):
@@ -44,6 +123,166 @@ class RefreshTokenViewTestCase(GlobalTestSetup):
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
         self.assertEqual(response.data["detail"], "Token is invalid or expired")
 
+    def refresh(self, refresh_token):
+        return self.client.post(refresh_token_url, {"refresh_token": refresh_token}, format="json")
+
+    def test_refresh_token_is_rotated(self):
+        refresh_token = self.client.post(login_url, valid_credentials, format="json").data["refresh_token"]
+        response = self.refresh(refresh_token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.data["refresh_token"], refresh_token)
+        self.assertEqual(self.refresh(response.data["refresh_token"]).status_code, status.HTTP_200_OK)
+
+    def test_used_refresh_token_is_revoked(self):
+        refresh_token = self.client.post(login_url, valid_credentials, format="json").data["refresh_token"]
+        self.assertEqual(self.refresh(refresh_token).status_code, status.HTTP_200_OK)
+        response = self.refresh(refresh_token)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.data["detail"], "Token is revoked")
+
+    def test_refresh_token_used_in_another_process_is_revoked(self):
+        refresh_token = self.client.post(login_url, valid_credentials, format="json").data["refresh_token"]
+        token = RefreshToken(refresh_token)
+        revoked_tokens.sync()
+        # not synced yet, the unique row still stops the second use
+        RevokedToken.objects.create(jti=token["jti"], expires_at=timezone.now() + timedelta(days=1))
+        with self.assertNumQueries(0):
+            self.assertFalse(is_revoked(token))
+        self.assertEqual(self.refresh(refresh_token).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        revoked_tokens.clear()
+        revoked_tokens.sync()
+        with self.assertNumQueries(0):
+            self.assertTrue(is_revoked(token))
+
+    def test_refresh_checks_revocation_in_memory(self):
+        refresh_token = self.client.post(login_url, valid_credentials, format="json").data["refresh_token"]
+        revoked_tokens.sync()
+        # the insert revoking the used token, in a savepoint
+        with self.assertNumQueries(3):
+            self.assertEqual(self.refresh(refresh_token).status_code, status.HTTP_200_OK)
+
+    def test_expired_tokens_are_purged(self):
+        RevokedToken.objects.create(jti="expired", expires_at=timezone.now() - timedelta(seconds=1))
+        RevokedToken.objects.create(jti="live", expires_at=timezone.now() + timedelta(days=1))
+        revoked_tokens.add("expired", time.time() - 1)
+        revoked_tokens.sync()
+        self.assertEqual(len(revoked_tokens), 1)
+        self.assertEqual(list(RevokedToken.objects.values_list("jti", flat=True)), ["live"])
+
+
+class AuthThrottleTestCase(GlobalTestSetup):
+    rates = {
+        "login_ip": "5/min",
+        "login_account": "2/min",
+        "register_ip": "1/hour",
+        "forgot_password_ip": "5/hour",
+        "forgot_password_account": "1/hour",
+    }
+
+    def setUp(self):
+        super().setUp()
+        settings_override = override_settings(AUTH_THROTTLE_RATES=self.rates)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_login_is_throttled_per_account(self):
+        for _ in range(2):
+            self.assertEqual(self.client.post(login_url, invalid_credentials, format="json").status_code, 401)
+        response = self.client.post(login_url, valid_credentials, format="json")
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response["Retry-After"], "30")
+        other = {"username": "other_user", "password": "password"}
+        self.assertEqual(self.client.post(login_url, other, format="json").status_code, 401)
+
+    def test_login_is_throttled_per_ip(self):
+        for i in range(5):
+            credentials = {"username": f"user_{i}", "password": "password"}
+            self.assertEqual(self.client.post(login_url, credentials, format="json").status_code, 401)
+        response = self.client.post(login_url, valid_credentials, format="json")
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        response = self.client.post(login_url, valid_credentials, format="json", REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_register_is_throttled(self):
+        data = {"username": "new_user", "password": "new_password", "email": "new@new.com"}
+        self.assertEqual(self.client.post(register_url, data, format="json").status_code, 201)
+        data["username"] = "another_user"
+        response = self.client.post(register_url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertFalse(User.objects.filter(username="another_user").exists())
+
+    def test_forgot_password_is_throttled_per_email(self):
+        emails = OutboxEmail.objects.count()
+        data = {"email": "test@test.com"}
+        self.assertEqual(self.client.post(forgot_password_url, data, format="json").status_code, 200)
+        data = {"email": "TEST@test.com "}
+        response = self.client.post(forgot_password_url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(OutboxEmail.objects.count(), emails + 1)
+
+
+class TokenBucketsTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "buckets")
+
+    def test_buckets_refill(self):
+        for buckets in (LocalTokenBuckets(), MappedTokenBuckets(self.path, 64)):
+            with mock.patch("utils.ratelimit.time.time", return_value=1000.0) as now:
+                self.assertEqual(buckets.consume("key", rate=1, capacity=2), 0)
+                self.assertEqual(buckets.consume("key", rate=1, capacity=2), 0)
+                self.assertEqual(buckets.consume("key", rate=1, capacity=2), 1)
+                now.return_value = 1000.5
+                self.assertEqual(buckets.consume("key", rate=1, capacity=2), 0.5)
+                now.return_value = 1001.0
+                self.assertEqual(buckets.consume("key", rate=1, capacity=2), 0)
+                self.assertEqual(buckets.consume("other", rate=1, capacity=2), 0)
+
+    def test_mapped_buckets_are_shared(self):
+        first = MappedTokenBuckets(self.path, 64)
+        second = MappedTokenBuckets(self.path, 64)
+        self.assertEqual(first.consume("key", rate=0.001, capacity=1), 0)
+        self.assertGreater(second.consume("key", rate=0.001, capacity=1), 0)
+        second.clear()
+        self.assertEqual(first.consume("key", rate=0.001, capacity=1), 0)
+
+    def test_mapped_buckets_take_over_slots(self):
+        buckets = MappedTokenBuckets(self.path, 4)
+        for i in range(20):
+            self.assertEqual(buckets.consume(f"key-{i}", rate=0.001, capacity=1), 0)
+        self.assertEqual(os.path.getsize(self.path), 4 * 32)
+
+    def test_mapped_buckets_file_is_private(self):
+        path = os.path.join(os.path.dirname(self.path), "run", "buckets")
+        buckets = MappedTokenBuckets(path, 4)
+        buckets.consume("key", rate=1, capacity=1)
+        buckets.close()
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+        self.assertEqual(os.stat(os.path.dirname(path)).st_mode & 0o777, 0o700)
+
+        # a link planted at the path is not followed
+        os.remove(path)
+        os.symlink(self.path, path)
+        with self.assertRaises(OSError):
+            MappedTokenBuckets(path, 4).consume("key", rate=1, capacity=1)
+
+    def test_tests_use_their_own_buckets(self):
+        self.assertEqual(token_buckets.path, settings.AUTH_THROTTLE_FILE)
+        self.assertTrue(token_buckets.path.startswith(tempfile.gettempdir()))
+
+
+class BloomFilterTestCase(TestCase):
+    def test_membership(self):
+        bloom = BloomFilter(1000, error_rate=0.01)
+        keys = [f"key-{i}" for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+        self.assertTrue(all(key in bloom for key in keys))
+        false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
 
 class RegisterViewTestCase(GlobalTestSetup):
     def setUp(self):
@@ -67,12 +306,83 @@ class RegisterViewTestCase(GlobalTestSetup):
         response = self.client.post(register_url, self.data, format="json")
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(User.objects.count(), 2)
-        self.assertEqual(User.objects.get(username="new_user").username, "new_user")
+        user = User.objects.get(username="new_user")
+        self.assertEqual(user.username, "new_user")
+        self.assertTrue(user.check_password("new_password"))
+
+    def test_register_when_hashing_pool_is_saturated(self):
+        with saturate_hashing_pool():
+            response = self.client.post(register_url, self.data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(User.objects.filter(username="new_user").exists())
 
     def test_register_with_existing_username(self):
+        emails = OutboxEmail.objects.count()
         response = self.client.post(register_url, self.existing_data, format="json")
         self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
         self.assertEqual(response.data["detail"], "User already exists")
+        self.assertEqual(OutboxEmail.objects.count(), emails)
+
+    def test_register_with_blank_username_or_password(self):
+        for field in ("username", "password"):
+            response = self.client.post(register_url, {**self.data, field: ""}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn(field, response.data)
+        self.assertFalse(User.objects.filter(username="").exists())
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_register_with_invalid_username(self):
+        response = self.client.post(register_url, {**self.data, "username": "  bad name!!"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("username", response.data)
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_register_in_one_transaction(self):
+        # the user, profile, search row and outbox email, in a savepoint
+        with self.captureOnCommitCallbacks() as callbacks, CaptureQueriesContext(connection) as queries:
+            response = self.client.post(register_url, self.data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        statements = [query["sql"].split()[0] for query in queries.captured_queries]
+        self.assertEqual(statements.count("SAVEPOINT"), 1)
+        self.assertNotIn("SELECT", statements[: statements.index("SAVEPOINT")])
+        self.assertEqual(len(callbacks), 1)
+        self.assertTrue(Profile.objects.filter(user__username="new_user").exists())
+
+
+# the emails are left in the outbox, sqlite fails senders claiming them while a registration writes
+@override_settings(PASSWORD_HASHING_WORKERS=0, EMAIL_OUTBOX_DELIVERY="command")
+class ConcurrentRegistrationTestCase(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            # writers of a shared in-memory database fail with "table is locked" instead of waiting
+            self.skipTest("needs a database file or server, set DB_TEST_NAME with sqlite")
+        token_buckets.clear()
+
+    def test_parallel_registrations_for_the_same_username(self):
+        attempts = 6
+        barrier = threading.Barrier(attempts)
+        statuses = []
+
+        def register():
+            try:
+                barrier.wait()
+                response = APIClient().post(
+                    register_url, {"username": "racer", "password": "password", "email": "r@r.com"}, format="json"
+                )
+                statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=register) for _ in range(attempts)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(statuses), [201] + [409] * (attempts - 1))
+        self.assertEqual(User.objects.filter(username="racer").count(), 1)
+        self.assertEqual(Profile.objects.filter(user__username="racer").count(), 1)
+        self.assertEqual(OutboxEmail.objects.filter(to=["r@r.com"]).count(), 1)
 
 
 class GetCurrentUserViewTestCase(GlobalTestSetup):
@@ -82,12 +392,161 @@ class GetCurrentUserViewTestCase(GlobalTestSetup):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data["username"], "test_user")
 
+    def test_get_current_user_query_count(self):
+        inject_token(self.client)
+        # the token's user, the profile version and the profile
+        with self.assertNumQueries(3):
+            response = self.client.get(get_current_user_url)
+        self.assertEqual(response.data["avatar"], "")
+
+    def test_get_current_user_with_sparse_fields(self):
+        inject_token(self.client)
+        # the profile is only loaded for the avatar
+        with self.assertNumQueries(2):
+            response = self.client.get(get_current_user_url, {"fields": "id,username"})
+        self.assertEqual(response.data, {"id": self.user.id, "username": "test_user"})
+
+    def test_get_current_user_not_modified(self):
+        inject_token(self.client)
+        etag = self.client.get(get_current_user_url)["ETag"]
+        response = self.client.get(get_current_user_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.user.email = "changed@test.com"
+        self.user.save()
+        response = self.client.get(get_current_user_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["email"], "changed@test.com")
+
     def test_get_current_user_without_authentication(self):
         response = self.client.get(get_current_user_url)
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
         self.assertEqual(response.data["detail"], "Authentication credentials were not provided.")
 
 
+@override_settings(JWT_PROFILE_CLAIMS=True, AUTH_ME_FROM_TOKEN=True)
+class GetCurrentUserFromTokenTestCase(GlobalTestSetup):
+    def test_token_carries_profile_claims(self):
+        access_token = self.client.post(login_url, valid_credentials, format="json").data["access_token"]
+        token = AccessToken(access_token)
+        self.assertEqual(token["username"], "test_user")
+        self.assertEqual(token["email"], "test@test.com")
+        self.assertTrue(token["is_staff"])
+        self.assertEqual(token["profile_version"], Profile.objects.get(user=self.user).updated_at.isoformat())
+
+    def test_get_current_user_without_queries(self):
+        inject_token(self.client)
+        expected = self.client.get(get_current_user_url).data
+        with self.assertNumQueries(0):
+            response = self.client.get(get_current_user_url)
+        self.assertEqual(response.data, expected)
+        with override_settings(AUTH_ME_FROM_TOKEN=False):
+            self.assertEqual(self.client.get(get_current_user_url).data, expected)
+
+    def test_outdated_claims_fall_back_to_the_database(self):
+        inject_token(self.client)
+        self.client.get(get_current_user_url)
+        self.user.first_name = "changed"
+        self.user.save()
+        response = self.client.get(get_current_user_url)
+        self.assertEqual(response.data["first_name"], "changed")
+
+    def test_refresh_updates_the_claims(self):
+        refresh_token = self.client.post(login_url, valid_credentials, format="json").data["refresh_token"]
+        self.user.first_name = "changed"
+        self.user.save()
+        response = self.client.post(refresh_token_url, {"refresh_token": refresh_token}, format="json")
+        self.assertEqual(AccessToken(response.data["access_token"])["first_name"], "changed")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access_token']}")
+        with self.assertNumQueries(2):
+            # the user and the profile version, both cached for the next requests
+            self.assertEqual(self.client.get(get_current_user_url).data["first_name"], "changed")
+
+    @override_settings(JWT_PROFILE_CLAIMS=False)
+    def test_tokens_without_claims(self):
+        inject_token(self.client)
+        response = self.client.get(get_current_user_url)
+        self.assertEqual(response.data["username"], "test_user")
+
+
+class CachedJWTAuthenticationTestCase(GlobalTestSetup):
+    def test_user_is_cached(self):
+        inject_token(self.client)
+        self.client.get(get_current_user_url)
+        # the profile version and the profile
+        with self.assertNumQueries(2):
+            response = self.client.get(get_current_user_url)
+        self.assertEqual(response.data["username"], "test_user")
+        self.assertEqual(user_cache.stats()["hits"], 1)
+        self.assertEqual(token_cache.stats()["hits"], 1)
+
+    def test_deactivated_user_is_rejected(self):
+        inject_token(self.client)
+        self.client.get(get_current_user_url)
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(get_current_user_url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_bulk_update_invalidates_users(self):
+        other = User.objects.create_user(username="other_user", password="test_password", is_staff=True)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(other)}")
+        self.assertEqual(client.get(get_current_user_url).status_code, status.HTTP_200_OK)
+
+        inject_token(self.client)
+        self.client.patch(
+            reverse("user-bulk"), {"ids": [other.profile.id], "changes": {"is_active": False}}, format="json"
+        )
+        self.assertEqual(client.get(get_current_user_url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleted_user_is_rejected(self):
+        inject_token(self.client)
+        self.client.get(get_current_user_url)
+        self.user.delete()
+        response = self.client.get(get_current_user_url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_cached_user_is_a_copy(self):
+        request = mock.Mock(META={"HTTP_AUTHORIZATION": f"Bearer {AccessToken.for_user(self.user)}"})
+        authentication = CachedJWTAuthentication()
+        user, _token = authentication.authenticate(request)
+        user.first_name = "changed"
+        user, _token = authentication.authenticate(request)
+        self.assertEqual(user.first_name, "")
+        self.assertEqual(user_cache.stats()["hits"], 1)
+
+    def test_lost_auth_version_is_not_reused(self):
+        inject_token(self.client)
+        self.client.get(get_current_user_url)
+        # culled from the default cache, the version must not match the cached user again
+        cache.delete(f"auth_version:{self.user.pk}")
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        response = self.client.get(get_current_user_url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(AUTH_USER_CACHE=False)
+    def test_user_cache_disabled(self):
+        inject_token(self.client)
+        self.client.get(get_current_user_url)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        response = self.client.get(get_current_user_url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(user_cache.stats()["hits"], 0)
+
+    def test_cache_stats(self):
+        inject_token(self.client)
+        response = self.client.get(auth_cache_stats_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data), {"users", "tokens", "revoked_tokens"})
+        self.assertIn("hit_rate", response.data["users"])
+
+        self.user.is_staff = False
+        self.user.save()
+        response = self.client.get(auth_cache_stats_url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
 class ChangePasswordViewTestCase(GlobalTestSetup):
     def setUp(self):
         super().setUp()
@@ -98,6 +557,16 @@ class ChangePasswordViewTestCase(GlobalTestSetup):
         response = self.client.patch(change_password_url, self.data, format="json")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data["detail"], "Password changed successfully")
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password("new_password"))
+
+    def test_change_password_leaves_the_profile_alone(self):
+        inject_token(self.client)
+        updated_at = Profile.objects.get(user=self.user).updated_at
+        with mock.patch("users.signals.index_profiles") as index_profiles:
+            self.client.patch(change_password_url, self.data, format="json")
+        index_profiles.assert_not_called()
+        self.assertEqual(Profile.objects.get(user=self.user).updated_at, updated_at)
 
     def test_change_password_with_invalid_old_password(self):
         inject_token(self.client)
@@ -125,6 +594,9 @@ class ForgotPasswordViewTestCase(GlobalTestSetup):
 
     def test_send_set_password_email(self):
         send_set_password_email(self.user)
+        # the email of the setUp user is queued too
+        self.assertEqual(OutboxEmail.objects.count(), 2)
+        send_outbox()
 
         self.assertEqual(len(mail.outbox), 2)
         self.assertEqual(mail.outbox[0].subject, "Set Password")
@@ -152,3 +624,84 @@ class SetPasswordViewTestCase(GlobalTestSetup):
         )
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(response.data["detail"], "Invalid token")
+
+
+@override_settings(
+    EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+    EMAIL_USE_TLS=False,
+    EMAIL_HOST_USER="",
+    EMAIL_HOST_PASSWORD="",
+    EMAIL_OUTBOX_DELIVERY="command",
+)
+class OutboxTestCase(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f"outbox{i}", email=f"outbox{i}@test.com") for i in range(3)]
+
+    def smtp_server(self, **kwargs):
+        server = LocalSMTPServer(**kwargs).__enter__()
+        self.addCleanup(server.__exit__, None, None, None)
+        mail_server_settings = override_settings(EMAIL_HOST=server.host, EMAIL_PORT=server.port)
+        mail_server_settings.enable()
+        self.addCleanup(mail_server_settings.disable)
+        return server
+
+    def test_emails_are_queued_in_the_transaction(self):
+        self.assertEqual(OutboxEmail.objects.count(), 3)
+        with transaction.atomic():
+            send_set_password_email(self.users[0])
+            transaction.set_rollback(True)
+        self.assertEqual(OutboxEmail.objects.count(), 3)
+
+    def test_request_does_not_wait_for_the_mail_server(self):
+        server = self.smtp_server(latency=0.5)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(forgot_password_url, {"email": self.users[0].email})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(server.connections, 0)
+        self.assertEqual(OutboxEmail.objects.filter(status=OutboxEmail.Status.PENDING).count(), 4)
+
+    def test_batches_share_one_connection(self):
+        server = self.smtp_server(latency=0.01)
+        self.assertEqual(send_outbox(batch_size=2), 3)
+        self.assertEqual(server.connections, 2)
+        self.assertEqual(len(server.messages), 3)
+        self.assertIn(b"To: outbox2@test.com", server.messages[2])
+        self.assertEqual(OutboxEmail.objects.filter(status=OutboxEmail.Status.SENT).count(), 3)
+        self.assertEqual(send_outbox(), 0)
+
+    @override_settings(EMAIL_OUTBOX_RETRY_DELAY=10, EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+    def test_failed_emails_are_retried_with_backoff(self):
+        server = self.smtp_server(fail_next=1)
+        send_outbox()
+        email = OutboxEmail.objects.get(to=[self.users[0].email])
+        self.assertEqual(email.status, OutboxEmail.Status.PENDING)
+        self.assertEqual(email.attempts, 1)
+        self.assertIn("451", email.last_error)
+        self.assertGreater(email.send_after, timezone.now() + timedelta(seconds=5))
+        self.assertEqual(len(server.messages), 2)
+
+        # not due yet
+        self.assertEqual(send_outbox(), 0)
+        OutboxEmail.objects.filter(pk=email.pk).update(send_after=timezone.now())
+        send_outbox()
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.Status.SENT)
+        self.assertEqual(len(server.messages), 3)
+
+    @override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=1)
+    def test_gives_up_after_max_attempts(self):
+        self.smtp_server(fail_next=3)
+        send_outbox()
+        self.assertEqual(OutboxEmail.objects.filter(status=OutboxEmail.Status.FAILED).count(), 3)
+
+    def test_unreachable_mail_server(self):
+        with override_settings(EMAIL_HOST="127.0.0.1", EMAIL_PORT=1, EMAIL_TIMEOUT=1):
+            self.assertEqual(send_outbox(), 3)
+        self.assertEqual(set(OutboxEmail.objects.values_list("attempts", flat=True)), {1})
+
+    def test_send_outbox_command(self):
+        server = self.smtp_server()
+        out = io.StringIO()
+        call_command("send_outbox", stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Attempted 3 emails")
+        self.assertEqual(len(server.messages), 3)
@@ -0,0 +1,79 @@
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+from utils.ratelimit import get_token_buckets
+
+token_buckets = get_token_buckets(settings.AUTH_THROTTLE_FILE, settings.AUTH_THROTTLE_SLOTS)
+
+DURATIONS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+
+def parse_rate(rate):
+    """`"5/min"` -> (5 requests, 60 seconds), like DRF throttle rates."""
+    count, period = rate.split("/")
+    return int(count), DURATIONS[period[0]]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Token bucket per `scope` and `get_key()`, holding up to `n` requests of the
+    `AUTH_THROTTLE_RATES[scope]` rate `"n/period"` and refilled continuously at
+    that rate. Buckets live in `token_buckets`, shared by the processes of a host.
+    """
+
+    scope = None
+
+    def __init__(self):
+        self.wait_time = None
+
+    def get_key(self, request, view):
+        raise NotImplementedError(".get_key() must be overridden")
+
+    def allow_request(self, request, view):
+        rate = settings.AUTH_THROTTLE_RATES.get(self.scope)
+        key = self.get_key(request, view)
+        if not rate or not key:
+            return True
+        capacity, duration = parse_rate(rate)
+        self.wait_time = token_buckets.consume(f"{self.scope}:{key}", capacity / duration, capacity)
+        return self.wait_time == 0
+
+    def wait(self):
+        return self.wait_time
+
+
+class IPThrottle(TokenBucketThrottle):
+    def get_key(self, request, view):
+        return self.get_ident(request)
+
+
+class AccountThrottle(TokenBucketThrottle):
+    """Throttles by the account named in the request body, whoever sends it."""
+
+    field = None
+
+    def get_key(self, request, view):
+        value = request.data.get(self.field) if hasattr(request.data, "get") else None
+        return str(value).strip().lower() if value else None
+
+
+class LoginIPThrottle(IPThrottle):
+    scope = "login_ip"
+
+
+class LoginAccountThrottle(AccountThrottle):
+    scope = "login_account"
+    field = "username"
+
+
+class RegisterIPThrottle(IPThrottle):
+    scope = "register_ip"
+
+
+class ForgotPasswordIPThrottle(IPThrottle):
+    scope = "forgot_password_ip"
+
+
+class ForgotPasswordAccountThrottle(AccountThrottle):
+    scope = "forgot_password_account"
+    field = "email"
@@ -8,6 +8,7 @@ from account.views import (
     RefreshTokenView,
     ForgotPasswordView,
     SetPasswordView,
+    AuthCacheStatsView,
 )
 
 urlpatterns = [
@@ -18,4 +19,5 @@ urlpatterns = [
     path("change-password/", ChangePasswordView.as_view(), name="change-password"),
     path("forgot-password/", ForgotPasswordView.as_view(), name="forgot-password"),
     path("set-password/", SetPasswordView.as_view(), name="set-password"),
+    path("cache-stats/", AuthCacheStatsView.as_view(), name="auth-cache-stats"),
 ]
@@ -1,5 +1,10 @@
+from datetime import datetime
+
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.auth.tokens import default_token_generator
+from django.db import IntegrityError
+from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
@@ -15,11 +20,25 @@ from .serializers import (
 )
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
+from account.authentication import get_auth_cache_stats
+from account.claims import get_claims_user, get_profile_version
+from account.hashing import hash_password, set_password, verify_password
+from account.throttling import (
+    ForgotPasswordAccountThrottle,
+    ForgotPasswordIPThrottle,
+    LoginAccountThrottle,
+    LoginIPThrottle,
+    RegisterIPThrottle,
+)
+from users.models import Profile
+from utils.conditional import conditional_get
 from utils.mail import send_set_password_email
+from utils.serializers import sparse_fields_parameters
 
 
 class LoginView(TokenObtainPairView):
     serializer_class = LoginSerializer
+    throttle_classes = [LoginIPThrottle, LoginAccountThrottle]
 
     @swagger_auto_schema(tags=["Auth"], operation_summary="Login a user")
     def post(self, request, *args, **kwargs):
@@ -38,22 +57,26 @@ class RefreshTokenView(TokenRefreshView):
 class RegisterView(generics.CreateAPIView):
     permission_classes = [permissions.AllowAny]
     serializer_class = RegisterSerializer
+    throttle_classes = [RegisterIPThrottle]
 
     @swagger_auto_schema(tags=["Auth"], operation_summary="Register a new user")
     def post(self, request, *args, **kwargs):
-        email = request.data.get("email", "")
-        username = request.data.get("username", "")
-        password = request.data.get("password", "")
-        first_name = request.data.get("first_name", "")
-        last_name = request.data.get("last_name", "")
-
-        if User.objects.filter(username=username).exists():
-            return Response({"detail": "User already exists"}, status=status.HTTP_409_CONFLICT)
-
-        user = User.objects.create_user(
-            username=username, email=email, password=password, first_name=first_name, last_name=last_name, is_staff=True
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        user = User(
+            username=User.normalize_username(data["username"]),
+            email=User.objects.normalize_email(data.get("email", "")),
+            first_name=data.get("first_name", ""),
+            last_name=data.get("last_name", ""),
+            is_staff=True,
         )
-        user.save()
+        user.password = hash_password(data["password"])
+        try:
+            Profile.objects.create_with_user(user)
+        except IntegrityError:
+            return Response({"detail": "User already exists"}, status=status.HTTP_409_CONFLICT)
 
         return Response({"detail": "User created successfully"}, status=status.HTTP_201_CREATED)
 
@@ -61,12 +84,24 @@ class RegisterView(generics.CreateAPIView):
 class GetCurrentUserView(generics.RetrieveAPIView):
     serializer_class = AccountSerializer
 
-    @swagger_auto_schema(tags=["Auth"], operation_summary="Get current user")
+    @swagger_auto_schema(
+        tags=["Auth"], operation_summary="Get current user", manual_parameters=sparse_fields_parameters
+    )
+    @conditional_get
     def get(self, request, *args, **kwargs):
-        user = request.user
-        serializer = self.get_serializer(user)
+        user = None
+        if settings.AUTH_ME_FROM_TOKEN:
+            user = get_claims_user(request.auth)
+        serializer = self.get_serializer(user or request.user)
         return Response(serializer.data)
 
+    def get_version(self, request, *args, **kwargs):
+        if settings.AUTH_ME_FROM_TOKEN:
+            version = get_profile_version(request.user.pk)
+            return (version, datetime.fromisoformat(version)) if version else None
+        updated_at = Profile.objects.filter(user_id=request.user.pk).values_list("updated_at", flat=True).first()
+        return (updated_at.isoformat(), updated_at) if updated_at else None
+
 
 class ChangePasswordView(generics.UpdateAPIView):
     http_method_names = ["patch"]
@@ -77,9 +112,9 @@ class ChangePasswordView(generics.UpdateAPIView):
         old_password = request.data.get("old_password", "")
         new_password = request.data.get("new_password", "")
         user = request.user
-        if user.check_password(old_password):
-            user.set_password(new_password)
-            user.save()
+        if verify_password(user, old_password):
+            set_password(user, new_password)
+            user.save(update_fields=["password"])
             return Response({"detail": "Password changed successfully"}, status=status.HTTP_200_OK)
         return Response({"detail": "Old password is incorrect"}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -87,6 +122,7 @@ class ChangePasswordView(generics.UpdateAPIView):
 class ForgotPasswordView(generics.CreateAPIView):
     permission_classes = [permissions.AllowAny]
     serializer_class = ForgotPasswordSerializer
+    throttle_classes = [ForgotPasswordIPThrottle, ForgotPasswordAccountThrottle]
 
     @swagger_auto_schema(tags=["Auth"], operation_summary="Send set password email")
     def post(self, request, *args, **kwargs):
@@ -110,7 +146,26 @@ class SetPasswordView(generics.UpdateAPIView):
         new_password = request.data.get("new_password", "")
         user = User.objects.filter(email=email).first()
         if user is not None and user.is_active and default_token_generator.check_token(user, token):
-            user.set_password(new_password)
-            user.save()
+            set_password(user, new_password)
+            user.save(update_fields=["password"])
             return Response({"detail": "Password set successfully"}, status=status.HTTP_200_OK)
         return Response({"detail": "Invalid token"}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class AuthCacheStatsView(generics.GenericAPIView):
+    @swagger_auto_schema(
+        tags=["Auth"],
+        operation_summary="Get the authentication cache statistics",
+        responses={
+            200: openapi.Response(
+                "Statistics of the users, tokens and revoked tokens caches",
+                schema=openapi.Schema(type=openapi.TYPE_OBJECT),
+            )
+        },
+    )
+    def get(self, request, *args, **kwargs):
+        if request.user.is_staff:
+            return Response(get_auth_cache_stats(), status=status.HTTP_200_OK)
+        return Response(
+            {"detail": "You do not have permission to perform this action"}, status=status.HTTP_403_FORBIDDEN
+        )
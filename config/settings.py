@@ -99,9 +99,20 @@ else:
             "PASSWORD": env("DB_PASSWORD", default="postgres"),
             "HOST": env("DB_HOST", default="db"),
             "PORT": env("DB_PORT", default="5432"),
+            # sqlite tests run on a file of the test runner unless DB_TEST_NAME names one
+            "TEST": {"NAME": env("DB_TEST_NAME", default=None)},
         }
     }
 
+# The test runner gives sqlite test databases and the throttle buckets files of their
+# own, and processes avatars and sends emails inline
+TEST_RUNNER = "config.tests.TestRunner"
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+
+CACHES = {"default": env.cache("CACHE_URL", default="locmemcache://")}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -120,6 +131,29 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Token buckets of "n/period" requests ("s", "min", "hour" or "day") per client
+# address and per account for the anonymous auth endpoints, an empty rate disables
+# one. They are kept in AUTH_THROTTLE_FILE, memory mapped by every process of the
+# host (an empty path keeps them per process), in a table of AUTH_THROTTLE_SLOTS.
+# The file and its directory are created readable by the app's user only
+AUTH_THROTTLE_RATES = {
+    "login_ip": env("AUTH_THROTTLE_LOGIN_IP", default="30/min"),
+    "login_account": env("AUTH_THROTTLE_LOGIN_ACCOUNT", default="10/min"),
+    "register_ip": env("AUTH_THROTTLE_REGISTER_IP", default="10/hour"),
+    "forgot_password_ip": env("AUTH_THROTTLE_FORGOT_PASSWORD_IP", default="10/hour"),
+    "forgot_password_account": env("AUTH_THROTTLE_FORGOT_PASSWORD_ACCOUNT", default="3/hour"),
+}
+AUTH_THROTTLE_FILE = env("AUTH_THROTTLE_FILE", default=str(BASE_DIR / "run" / "auth-throttle"))
+AUTH_THROTTLE_SLOTS = env.int("AUTH_THROTTLE_SLOTS", default=65536)
+
+# Password hashes of the auth endpoints are computed on a pool of PASSWORD_HASHING_WORKERS
+# threads (0 hashes on the request thread) with up to PASSWORD_HASHING_QUEUE_SIZE waiting.
+# Requests beyond that get a 503 asking to retry after PASSWORD_HASHING_RETRY_AFTER seconds.
+# Keep workers + queue below the request threads of a process to leave room for other requests
+PASSWORD_HASHING_WORKERS = env.int("PASSWORD_HASHING_WORKERS", default=2)
+PASSWORD_HASHING_QUEUE_SIZE = env.int("PASSWORD_HASHING_QUEUE_SIZE", default=2)
+PASSWORD_HASHING_RETRY_AFTER = env.int("PASSWORD_HASHING_RETRY_AFTER", default=1)
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.1/topics/i18n/
 
@@ -149,14 +183,45 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": ("rest_framework.permissions.IsAuthenticated",),
-    "DEFAULT_AUTHENTICATION_CLASSES": ("rest_framework_simplejwt.authentication.JWTAuthentication",),
+    "DEFAULT_AUTHENTICATION_CLASSES": ("account.authentication.CachedJWTAuthentication",),
+    # proxies in front of the app, the client address is taken from X-Forwarded-For
+    "NUM_PROXIES": env.int("NUM_PROXIES", default=0),
 }
 
+# Default and maximum page size (`?page_size=`) of paginated endpoints
+API_PAGE_SIZE = env.int("API_PAGE_SIZE", default=50)
+API_MAX_PAGE_SIZE = env.int("API_MAX_PAGE_SIZE", default=500)
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": datetime.timedelta(hours=1),
     "REFRESH_TOKEN_LIFETIME": datetime.timedelta(days=30),
 }
 
+# JWT_PROFILE_CLAIMS adds the account fields, avatar and profile version to the tokens.
+# With AUTH_ME_FROM_TOKEN as well, /auth/me/ answers from the token as long as its
+# profile version is the current one (cached for AUTH_CACHE_TTL seconds)
+JWT_PROFILE_CLAIMS = env.bool("JWT_PROFILE_CLAIMS", default=False)
+AUTH_ME_FROM_TOKEN = env.bool("AUTH_ME_FROM_TOKEN", default=False)
+
+# Used refresh tokens are revoked in the database and checked against an in-memory
+# Bloom filter and exact set, synced from it every REFRESH_REVOCATION_SYNC_INTERVAL
+# seconds and sized for REFRESH_REVOCATION_CAPACITY tokens at a false positive rate
+# of REFRESH_REVOCATION_ERROR_RATE (it grows when more tokens are revoked)
+REFRESH_REVOCATION_CAPACITY = env.int("REFRESH_REVOCATION_CAPACITY", default=100000)
+REFRESH_REVOCATION_ERROR_RATE = env.float("REFRESH_REVOCATION_ERROR_RATE", default=0.01)
+REFRESH_REVOCATION_SYNC_INTERVAL = env.int("REFRESH_REVOCATION_SYNC_INTERVAL", default=10)
+
+# Verified access tokens and authenticated users are kept in in-process LRU caches
+# of these many entries for up to AUTH_CACHE_TTL seconds. Cached users are checked
+# against auth versions kept in the default cache, which the other processes only
+# see when it is shared, so the user cache is off unless CACHE_URL names a shared
+# backend such as redis or memcached
+_local_cache = CACHES["default"]["BACKEND"].endswith(("LocMemCache", "DummyCache"))
+AUTH_USER_CACHE = env.bool("AUTH_USER_CACHE", default=not _local_cache)
+AUTH_USER_CACHE_SIZE = env.int("AUTH_USER_CACHE_SIZE", default=10000)
+AUTH_TOKEN_CACHE_SIZE = env.int("AUTH_TOKEN_CACHE_SIZE", default=10000)
+AUTH_CACHE_TTL = env.int("AUTH_CACHE_TTL", default=60)
+
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
 # EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend" # uncomment this line to use gmail
 EMAIL_HOST = "smtp.gmail.com"
@@ -170,3 +235,54 @@ FRONTEND_URL = env("FRONTEND_URL", default="http://localhost:3000")
 
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 MEDIA_URL = "/media/"
+
+# Memory budget (in bytes) of the per-process cache of base64 encoded avatars and
+# an optional cache alias (e.g. a redis or memcached CACHE_URL) shared by all workers
+AVATAR_BASE64_CACHE_MAX_BYTES = env.int("AVATAR_BASE64_CACHE_MAX_BYTES", default=32 * 1024 * 1024)
+AVATAR_BASE64_CACHE_ALIAS = env("AVATAR_BASE64_CACHE_ALIAS", default="")
+
+# Rows fetched per round trip by the server-side cursor of the users export
+USERS_EXPORT_CHUNK_SIZE = env.int("USERS_EXPORT_CHUNK_SIZE", default=2000)
+
+# Maximum number of users handled by one request to the bulk users endpoint and
+# number of avatar files removed together after a bulk delete commits
+USERS_BULK_MAX_ITEMS = env.int("USERS_BULK_MAX_ITEMS", default=1000)
+AVATAR_DELETE_BATCH_SIZE = env.int("AVATAR_DELETE_BATCH_SIZE", default=100)
+
+# Avatars are processed on a pool of AVATAR_WORKERS threads, or inline with
+# AVATAR_PROCESSING_SYNC (as the tests do). Uploads beyond AVATAR_QUEUE_SIZE waiting
+# jobs get a 503 asking to retry after AVATAR_RETRY_AFTER seconds.
+AVATAR_WORKERS = env.int("AVATAR_WORKERS", default=2)
+AVATAR_QUEUE_SIZE = env.int("AVATAR_QUEUE_SIZE", default=100)
+AVATAR_RETRY_AFTER = env.int("AVATAR_RETRY_AFTER", default=5)
+AVATAR_PROCESSING_SYNC = env.bool("AVATAR_PROCESSING_SYNC", default=False)
+
+# Uploaded avatars are capped at AVATAR_MAX_SIZE pixels and copied to square
+# AVATAR_SIZES derivatives in each of AVATAR_FORMATS, stored next to the original
+AVATAR_MAX_SIZE = env.int("AVATAR_MAX_SIZE", default=256)
+AVATAR_SIZES = env.list("AVATAR_SIZES", cast=int, default=[32, 64, 128, 256])
+AVATAR_FORMATS = env.list("AVATAR_FORMATS", default=["webp", "jpeg"])
+
+# Uploaded avatars are rejected from their header when they are larger than
+# AVATAR_MAX_UPLOAD_SIZE bytes or AVATAR_MAX_PIXELS pixels or in another format
+AVATAR_MAX_UPLOAD_SIZE = env.int("AVATAR_MAX_UPLOAD_SIZE", default=5 * 1024 * 1024)
+AVATAR_MAX_PIXELS = env.int("AVATAR_MAX_PIXELS", default=4096 * 4096)
+AVATAR_ALLOWED_FORMATS = env.list("AVATAR_ALLOWED_FORMATS", default=["JPEG", "PNG", "WEBP", "GIF"])
+
+# SERVE_MEDIA answers MEDIA_URL from the WSGI application, ahead of the middleware.
+# MEDIA_SENDFILE_HEADER ("X-Accel-Redirect" or "X-Sendfile") leaves the transfer
+# to the front proxy; nginx gets MEDIA_ACCEL_REDIRECT_PREFIX + the file path
+SERVE_MEDIA = env.bool("SERVE_MEDIA", default=False)
+MEDIA_SENDFILE_HEADER = env("MEDIA_SENDFILE_HEADER", default="")
+MEDIA_ACCEL_REDIRECT_PREFIX = env("MEDIA_ACCEL_REDIRECT_PREFIX", default="/protected-media/")
+
+# Emails are written to the account outbox and sent once the transaction commits:
+# "sync" on the committing thread, "thread" by a worker thread of each process, or
+# "command" only by `manage.py send_outbox`. Failed emails are retried after
+# EMAIL_OUTBOX_RETRY_DELAY seconds, doubled each time, up to EMAIL_OUTBOX_MAX_ATTEMPTS
+EMAIL_OUTBOX_DELIVERY = env("EMAIL_OUTBOX_DELIVERY", default="thread")
+EMAIL_OUTBOX_BATCH_SIZE = env.int("EMAIL_OUTBOX_BATCH_SIZE", default=100)
+EMAIL_OUTBOX_MAX_ATTEMPTS = env.int("EMAIL_OUTBOX_MAX_ATTEMPTS", default=5)
+EMAIL_OUTBOX_RETRY_DELAY = env.int("EMAIL_OUTBOX_RETRY_DELAY", default=60)
+EMAIL_OUTBOX_MAX_RETRY_DELAY = env.int("EMAIL_OUTBOX_MAX_RETRY_DELAY", default=60 * 60)
+EMAIL_OUTBOX_LEASE = env.int("EMAIL_OUTBOX_LEASE", default=5 * 60)
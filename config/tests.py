@@ -1,8 +1,22 @@
+import os
+import socketserver
+import tempfile
+import threading
+import time
+
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connections
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.runner import DiscoverRunner
 from rest_framework.test import APIClient
 
+from account.authentication import token_cache, user_cache
+from account.revocation import revoked_tokens
+from account.throttling import token_buckets
+
 login_url = reverse("login")
 
 valid_credentials = {"username": "test_user", "password": "test_password"}
@@ -16,9 +30,16 @@ def inject_token(client):
     client.credentials(HTTP_AUTHORIZATION=f"Bearer {access_token}")
 
 
+# the tests run in one process, whose locmem cache holds every auth version
+@override_settings(AUTH_USER_CACHE=True)
 class GlobalTestSetup(TestCase):
     def setUp(self, url: str = None, url_kwargs: dict = None):
         self.client = APIClient()
+        cache.clear()
+        user_cache.clear()
+        token_cache.clear()
+        revoked_tokens.clear()
+        token_buckets.clear()
 
         self.user = User.objects.create_user(username="test_user", password="test_password", email="test@test.com")
         self.user.is_staff = True
@@ -26,3 +47,111 @@ class GlobalTestSetup(TestCase):
 
         if url:
             self.url = reverse(url, kwargs=url_kwargs)
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Runs the tests with sqlite databases and throttle buckets in files of their
+    own, apart from the app's and other runs', and background jobs done inline
+    so their outcome can be checked right away.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.run_dir = tempfile.TemporaryDirectory()
+        self.test_settings = override_settings(
+            AUTH_THROTTLE_FILE=os.path.join(self.run_dir.name, "auth-throttle"),
+            AVATAR_PROCESSING_SYNC=True,
+            EMAIL_OUTBOX_DELIVERY="sync",
+        )
+        self.test_settings.enable()
+        if hasattr(token_buckets, "path"):
+            # the buckets are mapped on first use, moving them is only a matter of their path
+            token_buckets.close()
+            token_buckets.path = settings.AUTH_THROTTLE_FILE
+
+    def setup_databases(self, **kwargs):
+        for connection in connections.all():
+            test_settings = connection.settings_dict["TEST"]
+            if connection.vendor == "sqlite" and not test_settings["NAME"]:
+                # in a file, writers of a shared in-memory database fail instead of waiting for each other
+                test_settings["NAME"] = os.path.join(self.run_dir.name, f"{connection.alias}.sqlite3")
+        return super().setup_databases(**kwargs)
+
+    def teardown_test_environment(self, **kwargs):
+        if hasattr(token_buckets, "path"):
+            token_buckets.close()
+        self.test_settings.disable()
+        self.run_dir.cleanup()
+        super().teardown_test_environment(**kwargs)
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        time.sleep(self.server.latency)
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply("220 localhost ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip().split(" ", 1)[0].upper()
+            if command in ("EHLO", "HELO"):
+                self.reply("250 localhost")
+            elif command in ("MAIL", "RCPT", "RSET", "NOOP"):
+                self.reply("250 OK")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = b"".join(iter(self.rfile.readline, b".\r\n"))
+                with self.server.lock:
+                    failing = self.server.fail_next > 0
+                    self.server.fail_next -= failing
+                    if not failing:
+                        self.server.messages.append(data)
+                self.reply("451 Try again later" if failing else "250 Queued")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class LocalSMTPServer(socketserver.ThreadingTCPServer):
+    """
+    Minimal SMTP server on localhost for the email outbox tests.
+
+    Every reply is delayed by `latency` seconds to stand in for a slow mail
+    server, and the next `fail_next` messages are refused with a temporary
+    error. Use it as a context manager and point `EMAIL_HOST` / `EMAIL_PORT` at
+    `host` / `port`.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency=0.0, fail_next=0):
+        super().__init__(("127.0.0.1", 0), _SMTPHandler)
+        self.latency = latency
+        self.fail_next = fail_next
+        self.messages = []
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    @property
+    def host(self):
+        return self.server_address[0]
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
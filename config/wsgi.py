@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/4.1/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
 application = get_wsgi_application()
+
+if settings.SERVE_MEDIA:
+    from utils.media import MediaFilesHandler
+
+    # answer media requests before the middleware stack
+    application = MediaFilesHandler(application)
@@ -0,0 +1,271 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image, ImageOps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from account.claims import forget_profile_versions
+from users.models import AvatarFile, Profile
+from utils.b64 import invalidate_base64
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending_jobs = 0
+
+
+class AvatarBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Too many avatars are being processed, try again later."
+    default_code = "avatar_busy"
+
+    def __init__(self, detail=None, code=None):
+        super().__init__(detail, code)
+        # picked up by DRF's exception handler as the Retry-After header
+        self.wait = settings.AVATAR_RETRY_AFTER
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.AVATAR_WORKERS, thread_name_prefix="avatar")
+    return _executor
+
+
+def _run_in_worker(fn, *args):
+    global _pending_jobs
+    try:
+        return fn(*args)
+    except Exception:
+        logger.exception("Avatar job %s failed", fn.__name__)
+    finally:
+        with _executor_lock:
+            _pending_jobs -= 1
+        connections.close_all()
+
+
+def submit(fn, *args):
+    """
+    Run `fn` on the avatar worker pool and return its future. With
+    `AVATAR_PROCESSING_SYNC` the job runs inline and None is returned.
+
+    Jobs of committed changes are always queued, new uploads are turned away
+    beforehand by `check_avatar_queue` instead.
+    """
+    global _pending_jobs
+    if settings.AVATAR_PROCESSING_SYNC:
+        fn(*args)
+        return None
+
+    executor = get_executor()
+    with _executor_lock:
+        _pending_jobs += 1
+    try:
+        return executor.submit(_run_in_worker, fn, *args)
+    except BaseException:
+        with _executor_lock:
+            _pending_jobs -= 1
+        raise
+
+
+def check_avatar_queue(value=None):
+    """
+    Validator of uploaded avatars raising `AvatarBusy`, a 503 with a
+    Retry-After header, while the `AVATAR_WORKERS` are busy and
+    `AVATAR_QUEUE_SIZE` jobs are waiting for them, so a burst of uploads is
+    not processed on the request threads nor queued without bound.
+    """
+    if settings.AVATAR_PROCESSING_SYNC:
+        return
+    with _executor_lock:
+        busy = _pending_jobs >= settings.AVATAR_WORKERS + settings.AVATAR_QUEUE_SIZE
+    if busy:
+        raise AvatarBusy
+
+
+# file extension and the mime type used in `<source type=...>` of each derivative format
+AVATAR_FORMAT_TYPES = {"webp": ("webp", "image/webp"), "jpeg": ("jpg", "image/jpeg"), "png": ("png", "image/png")}
+
+
+def get_avatar_storage():
+    return Profile._meta.get_field("avatar").storage
+
+
+def avatar_derivative_name(name, size, image_format):
+    root, _ext = os.path.splitext(name)
+    return f"{root}_{size}.{AVATAR_FORMAT_TYPES[image_format][0]}"
+
+
+def avatar_derivative_names(name):
+    return [
+        avatar_derivative_name(name, size, image_format)
+        for image_format in settings.AVATAR_FORMATS
+        for size in settings.AVATAR_SIZES
+    ]
+
+
+def resize_avatar(name):
+    """
+    Store a copy of the avatar `name` capped at `AVATAR_MAX_SIZE` pixels and
+    return its name, or None when the avatar is small enough already.
+    """
+    storage = get_avatar_storage()
+    max_size = settings.AVATAR_MAX_SIZE
+    with storage.open(name) as original, Image.open(original) as img:
+        if img.height <= max_size and img.width <= max_size:
+            return None
+        image_format = img.format
+        # thumbnail() lets JPEGs decode at a reduced scale (draft) and reduce() before resampling
+        img.thumbnail((max_size, max_size), reducing_gap=2.0)
+        buffer = BytesIO()
+        img.save(buffer, image_format)
+    return storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def generate_avatar_derivatives(name):
+    """Write every size and format of the avatar `name` next to it, replacing older copies."""
+    storage = get_avatar_storage()
+    largest = max(settings.AVATAR_SIZES)
+    with storage.open(name) as original, Image.open(original) as img:
+        # JPEGs are decoded straight at the smallest scale still covering the largest size
+        img.draft("RGB", (largest, largest))
+        img = ImageOps.exif_transpose(img)
+        side = min(img.size)
+        square = img.crop(
+            ((img.width - side) // 2, (img.height - side) // 2, (img.width + side) // 2, (img.height + side) // 2)
+        )
+        for image_format in settings.AVATAR_FORMATS:
+            converted = square.convert("RGB" if image_format == "jpeg" else "RGBA")
+            for size in settings.AVATAR_SIZES:
+                buffer = BytesIO()
+                resized = converted.resize((size, size), Image.LANCZOS, reducing_gap=2.0)
+                resized.save(buffer, image_format, quality=85)
+                storage.save_as(avatar_derivative_name(name, size, image_format), ContentFile(buffer.getvalue()))
+
+
+def get_avatar_srcset(profile, request=None):
+    """
+    Map each derivative format's mime type to a `srcset` of its URLs, e.g.
+    `{"image/webp": ".../a_32.webp 32w, .../a_64.webp 64w"}`. Empty until the
+    derivatives of the current avatar are ready.
+    """
+    if not profile.avatar or profile.avatar_status != Profile.AvatarStatus.READY:
+        return {}
+
+    storage = get_avatar_storage()
+    srcset = {}
+    for image_format in settings.AVATAR_FORMATS:
+        candidates = []
+        for size in settings.AVATAR_SIZES:
+            url = storage.url(avatar_derivative_name(profile.avatar.name, size, image_format))
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            candidates.append(f"{url} {size}w")
+        srcset[AVATAR_FORMAT_TYPES[image_format][1]] = ", ".join(candidates)
+    return srcset
+
+
+def process_avatar(profile_id):
+    """Resize a newly uploaded avatar, generate its derivatives and record the outcome on its profile."""
+    name, user_id = Profile.objects.filter(pk=profile_id).values_list("avatar", "user_id").first() or ("", None)
+    if not name:
+        return None
+
+    resized = None
+    try:
+        # files are content addressed, so the resized avatar is a new file rather than an overwrite
+        resized = resize_avatar(name)
+        generate_avatar_derivatives(resized or name)
+        avatar_status = Profile.AvatarStatus.READY
+    except (OSError, Image.DecompressionBombError):
+        logger.exception("Could not process the avatar of profile %s", profile_id)
+        avatar_status = Profile.AvatarStatus.FAILED
+
+    with transaction.atomic():
+        if resized and not claim_avatar_file(resized):
+            # removed with an identical resized avatar meanwhile, the original is kept
+            logger.warning("The resized avatar of profile %s was deleted before it was saved", profile_id)
+            resized, avatar_status = None, Profile.AvatarStatus.FAILED
+        # a newer upload may have replaced the avatar in the meantime, it has its own job
+        Profile.objects.filter(pk=profile_id, avatar=name).update(
+            avatar=resized or name, avatar_status=avatar_status, updated_at=timezone.now()
+        )
+    forget_profile_versions([user_id])
+    if resized:
+        # whichever of the two is no longer referenced
+        delete_avatar_files([name, resized])
+    return avatar_status
+
+
+def schedule_avatar_processing(profile):
+    """Process the profile's avatar once the current transaction commits."""
+    if settings.AVATAR_PROCESSING_SYNC:
+        process_avatar(profile.pk)
+        profile.refresh_from_db(fields=["avatar", "avatar_status", "updated_at"])
+    else:
+        transaction.on_commit(lambda: submit(process_avatar, profile.pk))
+
+
+def lock_avatar_files(names):
+    """
+    Lock the `AvatarFile` rows of `names` until the current transaction ends.
+    Deleting a shared file and giving a profile a reference to it both happen
+    under this lock, an identical upload could otherwise be handed a file whose
+    last user is being deleted.
+    """
+    names = sorted(set(names))
+    while True:
+        AvatarFile.objects.bulk_create([AvatarFile(name=name) for name in names], ignore_conflicts=True)
+        locked = AvatarFile.objects.select_for_update().filter(name__in=names).order_by("name")
+        # a deletion may have dropped some of the rows while this waited for them
+        if len(locked.values_list("name", flat=True)) == len(names):
+            return
+
+
+def claim_avatar_file(name, content=None):
+    """
+    Lock the avatar file a profile now references, within the transaction that
+    saves the reference, and return whether it is still stored. A deletion may
+    have removed it since, it is then written again from `content` if given.
+    """
+    lock_avatar_files([name])
+    storage = get_avatar_storage()
+    if storage.exists(name):
+        return True
+    if content is None:
+        return False
+    content.seek(0)
+    storage.save_as(name, content)
+    return True
+
+
+def delete_avatar_files(names):
+    """Delete avatar files and their derivatives, skipping files another profile still uses."""
+    storage = get_avatar_storage()
+    with transaction.atomic():
+        lock_avatar_files(names)
+        referenced = set(Profile.objects.filter(avatar__in=names).values_list("avatar", flat=True))
+        unreferenced = [name for name in names if name not in referenced]
+        for name in unreferenced:
+            invalidate_base64(name)
+            for file_name in [name] + avatar_derivative_names(name):
+                storage.delete(file_name)
+        AvatarFile.objects.filter(name__in=unreferenced).delete()
+
+
+def schedule_avatar_deletion(names):
+    """Remove avatar files in batches on the worker pool once the current transaction commits."""
+    batch_size = settings.AVATAR_DELETE_BATCH_SIZE
+    for start in range(0, len(names), batch_size):
+        batch = names[start : start + batch_size]
+        transaction.on_commit(lambda batch=batch: submit(delete_avatar_files, batch))
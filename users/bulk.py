@@ -0,0 +1,188 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+
+from account.authentication import invalidate_users
+from users.avatars import schedule_avatar_deletion
+from users.models import Profile
+from users.search import SEARCH_FIELDS, index_profiles, unindex_profiles
+from utils.deletes import deletes_handled
+from utils.mail import send_set_password_emails
+
+BULK_PROFILE_FIELDS = ("bio", "location", "birth_date")
+BULK_USER_FIELDS = ("email", "first_name", "last_name", "is_active")
+BULK_FILTERS = {"location": "location", "is_active": "user__is_active", "is_staff": "user__is_staff"}
+
+
+class TooManyUsers(ValueError):
+    pass
+
+
+def bulk_create_users(items):
+    """
+    Create users with their profiles from validated `BulkProfileSerializer`
+    data in one transaction and report the outcome of every item.
+
+    Username conflicts, with existing users or within the batch, are found with
+    a single query. Users and profiles are inserted with `bulk_create`, which
+    skips the per-row signals, and the set password emails are queued in the
+    outbox with one insert.
+    """
+    results = [None] * len(items)
+    for attempt in range(2):
+        usernames = [data["user"]["username"] for data in items]
+        existing = set(User.objects.filter(username__in=usernames).values_list("username", flat=True))
+
+        pending, seen = [], set()
+        for index, data in enumerate(items):
+            username = data["user"]["username"]
+            if username in existing or username in seen:
+                results[index] = {"index": index, "status": status.HTTP_409_CONFLICT, "detail": "User already exists"}
+            else:
+                seen.add(username)
+                pending.append((index, data))
+
+        try:
+            with transaction.atomic():
+                profiles = _create_users(pending)
+        except IntegrityError:
+            # a user was created concurrently after the conflict check
+            if attempt:
+                raise
+            continue
+        break
+
+    for (index, data), profile in zip(pending, profiles):
+        results[index] = {
+            "index": index,
+            "status": status.HTTP_201_CREATED,
+            "id": profile.id,
+            "username": profile.user.username,
+        }
+    return results
+
+
+def _create_users(pending):
+    users = []
+    for _, data in pending:
+        user = User(**data["user"])
+        user.set_unusable_password()
+        users.append(user)
+    users = User.objects.bulk_create(users)
+    if users and users[0].pk is None:
+        # the backend cannot return primary keys from bulk inserts
+        created = User.objects.in_bulk([user.username for user in users], field_name="username")
+        users = [created[user.username] for user in users]
+
+    profiles = Profile.objects.bulk_create(
+        [
+            Profile(user=user, **{key: value for key, value in data.items() if key != "user"})
+            for user, (_, data) in zip(users, pending)
+        ]
+    )
+    if profiles and profiles[0].pk is None:
+        created = Profile.objects.select_related("user").in_bulk([user.pk for user in users], field_name="user_id")
+        profiles = [created[user.pk] for user in users]
+    index_profiles([profile.pk for profile in profiles])
+    send_set_password_emails(users)
+    return profiles
+
+
+def get_bulk_queryset(selection):
+    """Profiles picked by the `ids` and `filter` of a `BulkSelectionSerializer`."""
+    queryset = Profile.objects.all()
+    if selection.get("ids"):
+        queryset = queryset.filter(id__in=selection["ids"])
+    for key, value in selection.get("filter", {}).items():
+        queryset = queryset.filter(**{BULK_FILTERS[key]: value})
+    return queryset
+
+
+def _select_rows(queryset, *fields):
+    """
+    The `fields` of the selected profiles, read with a LIMIT so a broad filter
+    cannot load the whole table. Raises `TooManyUsers` when more than
+    `USERS_BULK_MAX_ITEMS` profiles are selected.
+    """
+    limit = settings.USERS_BULK_MAX_ITEMS
+    rows = list(queryset.order_by("id").values_list(*fields)[: limit + 1])
+    if len(rows) > limit:
+        raise TooManyUsers(limit)
+    return rows
+
+
+def _split_changes(changes):
+    profile_changes = {key: value for key, value in changes.items() if key in BULK_PROFILE_FIELDS}
+    user_changes = {key: value for key, value in changes.items() if key in BULK_USER_FIELDS}
+    return profile_changes, user_changes
+
+
+def bulk_update_users(queryset, changes):
+    """
+    Apply the same changes to every selected user with one UPDATE per table.
+    Raises `TooManyUsers` when the selection is too large for one request.
+    """
+    profile_changes, user_changes = _split_changes(changes)
+    with transaction.atomic():
+        rows = _select_rows(queryset, "id", "user_id")
+        ids = [profile_id for profile_id, _ in rows]
+        # user changes bump the version of their profiles as well
+        Profile.objects.filter(id__in=ids).update(**profile_changes, updated_at=timezone.now())
+        if user_changes:
+            User.objects.filter(profile__id__in=ids).update(**user_changes)
+            invalidate_users([user_id for _, user_id in rows])
+        if any(field in user_changes for field in SEARCH_FIELDS):
+            index_profiles(ids)
+    return ids
+
+
+def bulk_update_items(items):
+    """
+    Apply per user changes with one `bulk_update` per table and return the
+    ids of the profiles that were updated.
+    """
+    profiles = Profile.objects.select_related("user").in_bulk([item["id"] for item in items])
+    profile_fields, user_fields = {"updated_at"}, set()
+    now = timezone.now()
+    for profile in profiles.values():
+        profile.updated_at = now
+    for item in items:
+        profile = profiles.get(item["id"])
+        if profile is None:
+            continue
+        profile_changes, user_changes = _split_changes(item)
+        for key, value in profile_changes.items():
+            setattr(profile, key, value)
+        for key, value in user_changes.items():
+            setattr(profile.user, key, value)
+        profile_fields.update(profile_changes)
+        user_fields.update(user_changes)
+
+    with transaction.atomic():
+        Profile.objects.bulk_update(profiles.values(), profile_fields)
+        if user_fields:
+            User.objects.bulk_update([profile.user for profile in profiles.values()], user_fields)
+            invalidate_users([profile.user_id for profile in profiles.values()])
+        if any(field in user_fields for field in SEARCH_FIELDS):
+            index_profiles(list(profiles))
+    return list(profiles)
+
+
+def bulk_delete_users(queryset):
+    """
+    Delete the selected users and their profiles in one transaction. Their
+    avatar files are removed in batches once the transaction commits. Raises
+    `TooManyUsers` when the selection is too large for one request.
+    """
+    with transaction.atomic():
+        rows = _select_rows(queryset, "id", "user_id", "avatar")
+        user_ids = [user_id for _, user_id, _ in rows]
+        # the per-row signal receivers leave the cleanup below to this function
+        with deletes_handled():
+            User.objects.filter(id__in=user_ids).delete()
+        invalidate_users(user_ids)
+        unindex_profiles([profile_id for profile_id, _, _ in rows])
+        schedule_avatar_deletion([avatar for _, _, avatar in rows if avatar])
+    return len(rows)
@@ -0,0 +1,66 @@
+import csv
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from users.models import Profile
+from users.serializers import ProfileSerializer
+from utils.queries import get_query_plan
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+class _Echo:
+    """File-like object that hands back what is written, for `csv.writer`."""
+
+    def write(self, value):
+        return value
+
+
+def get_export_serializer(include_avatars=False, context=None):
+    # derivative URLs are a rendering concern, exports carry the original avatar
+    exclude = ["avatar_srcset"] if include_avatars else ["avatar_srcset", "avatar_base64"]
+    return ProfileSerializer(exclude=exclude, context=context or {})
+
+
+def get_export_columns(serializer):
+    columns = []
+    for name, field in serializer.fields.items():
+        if name in serializer.Meta.flatten:
+            columns += list(field.fields)
+        else:
+            columns.append(name)
+    return columns
+
+
+def iter_export_rows(serializer, chunk_size=None):
+    """
+    Serialize every profile with a server-side cursor so only `chunk_size`
+    rows are held in memory at a time.
+    """
+    select_related, only = get_query_plan(serializer)
+    queryset = Profile.objects.select_related(*select_related).order_by("id")
+    if only is not None:
+        queryset = queryset.only(*only)
+
+    for profile in queryset.iterator(chunk_size=chunk_size or settings.USERS_EXPORT_CHUNK_SIZE):
+        yield serializer.to_representation(profile)
+
+
+def export_users(export_format="ndjson", include_avatars=False, chunk_size=None, context=None):
+    """Yield the user directory as NDJSON lines or CSV rows."""
+    serializer = get_export_serializer(include_avatars, context)
+    rows = iter_export_rows(serializer, chunk_size)
+
+    if export_format == "csv":
+        writer = csv.DictWriter(_Echo(), fieldnames=get_export_columns(serializer))
+        yield writer.writeheader()
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        for row in rows:
+            yield json.dumps(row, cls=DjangoJSONEncoder) + "\n"
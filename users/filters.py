@@ -0,0 +1,49 @@
+from django.utils.dateparse import parse_date
+from drf_yasg import openapi
+from rest_framework import serializers
+from rest_framework.filters import BaseFilterBackend
+
+from users.search import search_profiles
+
+profile_filter_parameters = [
+    openapi.Parameter(
+        "q", openapi.IN_QUERY, description="Search in username, email and names", type=openapi.TYPE_STRING
+    ),
+    openapi.Parameter("location", openapi.IN_QUERY, type=openapi.TYPE_STRING),
+    openapi.Parameter("birth_date_after", openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE),
+    openapi.Parameter("birth_date_before", openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE),
+    openapi.Parameter("is_staff", openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN),
+]
+
+
+class ProfileFilter(BaseFilterBackend):
+    """Search (`?q=`) and filter profiles by location, birth date range and staff status."""
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+
+        term = params.get("q", "").strip()
+        if term:
+            queryset = search_profiles(queryset, term)
+        if "location" in params:
+            queryset = queryset.filter(location=params["location"])
+        if "birth_date_after" in params:
+            queryset = queryset.filter(birth_date__gte=self.parse_date(params, "birth_date_after"))
+        if "birth_date_before" in params:
+            queryset = queryset.filter(birth_date__lte=self.parse_date(params, "birth_date_before"))
+        if "is_staff" in params:
+            is_staff = params["is_staff"].lower()
+            if is_staff not in ("true", "false", "1", "0"):
+                raise serializers.ValidationError({"is_staff": "Must be a valid boolean."})
+            queryset = queryset.filter(user__is_staff=is_staff in ("true", "1"))
+        return queryset
+
+    @staticmethod
+    def parse_date(params, name):
+        try:
+            value = parse_date(params[name])
+        except ValueError:
+            value = None
+        if value is None:
+            raise serializers.ValidationError({name: "Date has wrong format. Use YYYY-MM-DD."})
+        return value
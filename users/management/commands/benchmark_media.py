@@ -0,0 +1,58 @@
+import time
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+from django.urls import re_path
+from django.views.static import serve
+
+from utils.media import MediaFilesHandler, serve_media
+
+
+class StaticURLConf:
+    # what `static()` serves in development
+    urlpatterns = [re_path(r"^media/(?P<path>.*)$", serve, {"document_root": settings.MEDIA_ROOT})]
+
+
+class MediaURLConf:
+    urlpatterns = [re_path(r"^media/(?P<path>.*)$", serve_media)]
+
+
+class Command(BaseCommand):
+    help = "Compare the requests per second of the media serving paths"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", default="profile_avatars/test_avatar_64.jpg", help="File under MEDIA_ROOT")
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--range", default=None, help='Range header to send, e.g. "bytes=0-1023"')
+
+    def handle(self, *args, **options):
+        headers = {"HTTP_RANGE": options["range"]} if options["range"] else {}
+        environ = RequestFactory().get(f"/media/{options['path']}", **headers).environ
+
+        with override_settings(ALLOWED_HOSTS=["*"], ROOT_URLCONF=StaticURLConf):
+            self.run("django.views.static.serve", WSGIHandler(), environ, options["requests"])
+        with override_settings(ALLOWED_HOSTS=["*"], ROOT_URLCONF=MediaURLConf):
+            self.run("serve_media", WSGIHandler(), environ, options["requests"])
+        with override_settings(ALLOWED_HOSTS=["*"]):
+            self.run("MediaFilesHandler", MediaFilesHandler(WSGIHandler()), environ, options["requests"])
+
+    def run(self, name, handler, environ, requests):
+        statuses = []
+
+        def start_response(status, headers, exc_info=None):
+            statuses.append(status)
+
+        size = 0
+        start = time.perf_counter()
+        for _ in range(requests):
+            response = handler(dict(environ), start_response)
+            size += sum(len(chunk) for chunk in response)
+            response.close()
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            f"{name:<28} {statuses[-1]:<18} {requests / elapsed:>9.0f} req/s "
+            f"{elapsed / requests * 1000:>7.3f} ms/req {size / elapsed / 1024 / 1024:>8.1f} MB/s"
+        )
@@ -0,0 +1,112 @@
+import json
+import tempfile
+from functools import partial
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from users.avatars import generate_avatar_derivatives, get_avatar_storage, resize_avatar
+from users.models import Profile
+from users.seed import render_avatar, seed_row
+from users.serializers import ProfileSerializer
+from utils.b64 import base64_to_file, file_to_base64
+from utils.benchmarks import find_regressions, measure
+
+CASES = (
+    "serialize_profiles",
+    "get_avatar_base64",
+    "file_to_base64",
+    "base64_to_file",
+    "resize_avatar",
+    "generate_avatar_derivatives",
+)
+
+
+def build_profiles(rows, avatar=""):
+    """Unsaved profiles of seeded users, serialized without touching the database."""
+    profiles = []
+    for index in range(rows):
+        user, profile, _ = seed_row(0, index, "!", 0)
+        user.id = profile.id = index + 1
+        profile.user = user
+        if avatar:
+            profile.avatar = avatar
+            profile.avatar_status = Profile.AvatarStatus.READY
+        profiles.append(profile)
+    return profiles
+
+
+def serialize_profiles(profiles):
+    return ProfileSerializer(profiles, many=True).data
+
+
+def get_cases(rows_counts, sizes):
+    """Map each case name to the function it times, given the avatars are stored under a scratch MEDIA_ROOT."""
+    cases = {}
+    for rows in rows_counts:
+        cases[f"serialize_profiles[rows={rows}]"] = partial(serialize_profiles, build_profiles(rows))
+
+    storage = get_avatar_storage()
+    for size in sizes:
+        name = storage.save("profile_avatars/avatar.jpg", ContentFile(render_avatar(0, size, size)))
+        (profile,) = build_profiles(1, avatar=name)
+        data = file_to_base64(profile.avatar)
+        # served from the in-process cache after the first call, as on a busy list
+        cases[f"get_avatar_base64[size={size}]"] = partial(ProfileSerializer().get_avatar_base64, profile)
+        cases[f"file_to_base64[size={size}]"] = partial(file_to_base64, profile.avatar)
+        cases[f"base64_to_file[size={size}]"] = lambda data=data: base64_to_file(data, max_size=len(data)).close()
+        cases[f"resize_avatar[size={size}]"] = partial(resize_avatar, name)
+        cases[f"generate_avatar_derivatives[size={size}]"] = partial(generate_avatar_derivatives, name)
+    return cases
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the per-row hot paths (profile serialization, avatar base64 encoding and decoding, avatar resizing "
+        "and derivatives) at several row counts and avatar sizes, with their memory use, against a baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--cases", nargs="+", choices=CASES, default=list(CASES))
+        parser.add_argument("--rows", nargs="+", type=int, default=[1, 50, 500], help="Profiles serialized at once")
+        parser.add_argument("--sizes", nargs="+", type=int, default=[128, 512, 2048], help="Avatar sides in pixels")
+        parser.add_argument("--repeat", type=int, default=3, help="Timed rounds per case, the best one is kept")
+        parser.add_argument("--min-time", type=float, default=0.2, help="Seconds a timed round lasts at least")
+        parser.add_argument("--output", "-o", default=None, help="File to write the results to as JSON")
+        parser.add_argument("--baseline", default=None, help="Results of an earlier run to compare with")
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.25,
+            help="Fraction a case may get slower, or its peak memory grow, before failing",
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"], encoding="utf-8") as file:
+                baseline = json.load(file)["results"]
+
+        results = {}
+        # avatars and their derivatives are written to a scratch directory
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            for case, fn in get_cases(options["rows"], options["sizes"]).items():
+                if case.partition("[")[0] not in options["cases"]:
+                    continue
+                results[case] = result = measure(fn, options["repeat"], options["min_time"])
+                self.stdout.write(
+                    f"{case:<40} {result['ops_per_sec']:>11.1f} ops/s {result['us_per_op']:>12.1f} us/op "
+                    f"peak {result['peak_kb']:>9.1f} KB retained {result['retained_kb']:>8.1f} KB"
+                )
+
+        if options["output"]:
+            report = {"settings": {key: options[key] for key in ("rows", "sizes", "repeat")}, "results": results}
+            with open(options["output"], "w", encoding="utf-8") as file:
+                json.dump(report, file, indent=2)
+
+        if baseline is not None:
+            regressions = find_regressions(results, baseline, options["tolerance"])
+            if regressions:
+                raise CommandError("Regressions against the baseline:\n" + "\n".join(regressions))
+            self.stdout.write("No regressions against the baseline")
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from users.export import EXPORT_FORMATS, export_users
+
+
+class Command(BaseCommand):
+    help = "Stream the user directory as NDJSON or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="ndjson")
+        parser.add_argument("--avatars", action="store_true", help="Include the base64 encoded avatars")
+        parser.add_argument("--chunk-size", type=int, default=None, help="Rows fetched per database round trip")
+        parser.add_argument("--output", "-o", default="-", help="File to write to, defaults to stdout")
+
+    def handle(self, *args, **options):
+        chunks = export_users(options["format"], options["avatars"], options["chunk_size"])
+        if options["output"] == "-":
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
+            return
+
+        with open(options["output"], "w", newline="", encoding="utf-8") as file:
+            file.writelines(chunks)
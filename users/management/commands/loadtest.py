@@ -0,0 +1,129 @@
+import json
+import logging
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.urls import reverse
+
+from account.serializers import LoginSerializer
+from users.models import Profile
+from users.seed import seed_users
+from utils.loadtest import LoadRequest, find_regressions, run_asgi, run_wsgi, summarize
+
+USERNAME = "loadtest_staff"
+PASSWORD = "loadtest-password"
+INTERFACES = ("wsgi", "asgi")
+ENDPOINTS = ("users", "users-search", "user-detail", "me", "login")
+
+
+def get_applications():
+    # the applications the servers run, with their middleware and media handling
+    from config.asgi import application as asgi_application
+    from config.wsgi import application as wsgi_application
+
+    return {"wsgi": (run_wsgi, wsgi_application), "asgi": (run_asgi, asgi_application)}
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the main endpoints through the WSGI and ASGI applications with concurrent clients, "
+        "report latency percentiles, throughput and SQL queries per request, and compare them with a baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interfaces", nargs="+", choices=INTERFACES, default=list(INTERFACES))
+        parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+        parser.add_argument("--requests", type=int, default=200, help="Measured requests per endpoint")
+        parser.add_argument("--warmup", type=int, default=10, help="Requests per endpoint sent before measuring")
+        parser.add_argument("--clients", type=int, default=4, help="Concurrent clients")
+        parser.add_argument("--users", type=int, default=1000, help="Users the database is seeded up to")
+        parser.add_argument("--output", "-o", default=None, help="File to write the results to as JSON")
+        parser.add_argument("--baseline", default=None, help="Results of an earlier run to compare with")
+        parser.add_argument(
+            "--latency-tolerance",
+            type=float,
+            default=0.5,
+            help="Fraction the p95 latency may exceed the baseline's by before failing",
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"], encoding="utf-8") as file:
+                baseline = json.load(file)["results"]
+
+        existing = Profile.objects.count()
+        if existing < options["users"]:
+            self.stdout.write(f"Seeding {options['users'] - existing} users")
+            try:
+                seed_users(options["users"] - existing, start=existing)
+            except ValueError as e:
+                raise CommandError(f"{e}, seed the database with seed_users first") from e
+
+        User.objects.filter(username=USERNAME).delete()
+        # inserted without the signals, which would send it a set password email
+        (user,) = User.objects.bulk_create([User(username=USERNAME, is_staff=True, password=make_password(PASSWORD))])
+        if user.pk is None:
+            user = User.objects.get(username=USERNAME)
+        Profile.objects.bulk_create([Profile(user=user)])
+        # failed requests would be logged one by one
+        request_logger = logging.getLogger("django.request")
+        log_level = request_logger.level
+        request_logger.setLevel(logging.CRITICAL)
+        try:
+            requests = self.get_requests(user)
+            applications = get_applications()
+            results = {}
+            # the throttles would answer most logins with 429
+            with override_settings(ALLOWED_HOSTS=["*"], AUTH_THROTTLE_RATES={}):
+                for interface in options["interfaces"]:
+                    run, application = applications[interface]
+                    results[interface] = {}
+                    for endpoint in options["endpoints"]:
+                        run(application, requests[endpoint], options["warmup"], options["clients"])
+                        samples, elapsed = run(application, requests[endpoint], options["requests"], options["clients"])
+                        results[interface][endpoint] = summary = summarize(samples, elapsed)
+                        self.write_summary(interface, endpoint, summary)
+        finally:
+            request_logger.setLevel(log_level)
+            User.objects.filter(pk=user.pk).delete()
+
+        if options["output"]:
+            report = {
+                "settings": {key: options[key] for key in ("requests", "warmup", "clients", "users")},
+                "results": results,
+            }
+            with open(options["output"], "w", encoding="utf-8") as file:
+                json.dump(report, file, indent=2)
+
+        if baseline is not None:
+            regressions = find_regressions(results, baseline, options["latency_tolerance"])
+            if regressions:
+                raise CommandError("Regressions against the baseline:\n" + "\n".join(regressions))
+            self.stdout.write("No regressions against the baseline")
+
+    def get_requests(self, user):
+        """Map each endpoint to a function building its i-th request."""
+        headers = {"Authorization": f"Bearer {LoginSerializer.get_token(user).access_token}"}
+        profile_ids = list(Profile.objects.order_by("id").values_list("id", flat=True)[:1000])
+        login = json.dumps({"username": USERNAME, "password": PASSWORD}).encode()
+        return {
+            "users": lambda i: LoadRequest("GET", reverse("user-list"), headers=headers),
+            "users-search": lambda i: LoadRequest("GET", reverse("user-list") + "?q=smith", headers=headers),
+            "user-detail": lambda i: LoadRequest(
+                "GET", reverse("user-detail", kwargs={"pk": profile_ids[i % len(profile_ids)]}), headers=headers
+            ),
+            "me": lambda i: LoadRequest("GET", reverse("me"), headers=headers),
+            "login": lambda i: LoadRequest(
+                "POST", reverse("login"), login, headers={"Content-Type": "application/json"}
+            ),
+        }
+
+    def write_summary(self, interface, endpoint, summary):
+        self.stdout.write(
+            f"{interface:<5} {endpoint:<13} {summary['throughput']:>8.1f} req/s "
+            f"p50 {summary['p50_ms']:>8.1f} ms p95 {summary['p95_ms']:>8.1f} ms p99 {summary['p99_ms']:>8.1f} ms "
+            f"queries {summary['queries_min']}-{summary['queries_max']} {summary['statuses']}"
+        )
@@ -0,0 +1,49 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from users.seed import seed_users
+
+
+class Command(BaseCommand):
+    help = "Insert synthetic users and profiles, optionally with generated avatars, for load testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, required=True, help="Number of users to create")
+        parser.add_argument("--seed", type=int, default=0, help="Runs with the same seed create the same users")
+        parser.add_argument("--start", type=int, default=0, help="Number of the first user, to add to a seeded set")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows inserted per transaction")
+        parser.add_argument("--avatars", action="store_true", help="Generate avatars and their derivatives")
+        parser.add_argument("--avatar-ratio", type=float, default=1.0, help="Share of the users given an avatar")
+        parser.add_argument("--avatar-size", type=int, default=settings.AVATAR_MAX_SIZE, help="Avatar side in pixels")
+        parser.add_argument("--workers", type=int, default=None, help="Avatar processes, all CPUs by default")
+        parser.add_argument("--password", default=None, help="Password of every user, unusable by default")
+
+    def handle(self, *args, **options):
+        if options["count"] < 1 or options["batch_size"] < 1:
+            raise CommandError("--count and --batch-size must be positive")
+        if options["avatar_size"] > settings.AVATAR_MAX_SIZE:
+            raise CommandError(f"--avatar-size is larger than AVATAR_MAX_SIZE ({settings.AVATAR_MAX_SIZE})")
+
+        start = time.perf_counter()
+
+        def progress(done):
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"{done}/{options['count']} users {elapsed:>8.1f}s {done / elapsed:>9.0f} users/s")
+
+        try:
+            seed_users(
+                options["count"],
+                seed=options["seed"],
+                start=options["start"],
+                batch_size=options["batch_size"],
+                avatars=options["avatars"],
+                avatar_ratio=options["avatar_ratio"],
+                avatar_size=options["avatar_size"],
+                password=options["password"],
+                workers=options["workers"],
+                progress=progress if options["verbosity"] > 0 else None,
+            )
+        except ValueError as e:
+            raise CommandError(f"{e}, seed the next users with --start or another database") from e
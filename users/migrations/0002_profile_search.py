@@ -0,0 +1,75 @@
+from django.db import migrations, models
+from django.db.utils import OperationalError
+
+# Postgres answers `icontains` (UPPER(col::text) LIKE UPPER(%s)) from trigram GIN indexes
+# on the same expression, SQLite from an FTS5 shadow table using the trigram tokenizer.
+# The statements are written out so the migration does not change with `users.search`.
+POSTGRES_CREATE_INDEXES = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    'CREATE INDEX IF NOT EXISTS auth_user_username_trgm ON auth_user USING gin (UPPER("username"::text) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS auth_user_email_trgm ON auth_user USING gin (UPPER("email"::text) gin_trgm_ops)',
+    "CREATE INDEX IF NOT EXISTS auth_user_first_name_trgm ON auth_user "
+    'USING gin (UPPER("first_name"::text) gin_trgm_ops)',
+    "CREATE INDEX IF NOT EXISTS auth_user_last_name_trgm ON auth_user "
+    'USING gin (UPPER("last_name"::text) gin_trgm_ops)',
+]
+POSTGRES_DROP_INDEXES = [
+    "DROP INDEX IF EXISTS auth_user_username_trgm",
+    "DROP INDEX IF EXISTS auth_user_email_trgm",
+    "DROP INDEX IF EXISTS auth_user_first_name_trgm",
+    "DROP INDEX IF EXISTS auth_user_last_name_trgm",
+]
+SQLITE_CREATE_TABLE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS users_profile_search "
+    "USING fts5(username, email, first_name, last_name, tokenize='trigram')"
+)
+SQLITE_FILL_TABLE = (
+    "INSERT INTO users_profile_search (rowid, username, email, first_name, last_name) "
+    "SELECT p.id, u.username, u.email, u.first_name, u.last_name "
+    "FROM users_profile p JOIN auth_user u ON u.id = p.user_id"
+)
+SQLITE_DROP_TABLE = "DROP TABLE IF EXISTS users_profile_search"
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "postgresql":
+        for statement in POSTGRES_CREATE_INDEXES:
+            schema_editor.execute(statement)
+    elif connection.vendor == "sqlite":
+        try:
+            schema_editor.execute(SQLITE_CREATE_TABLE)
+        except OperationalError:
+            # SQLite built without FTS5 or older than 3.34, search falls back to LIKE
+            return
+        schema_editor.execute(SQLITE_FILL_TABLE)
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "postgresql":
+        for statement in POSTGRES_DROP_INDEXES:
+            schema_editor.execute(statement)
+    elif connection.vendor == "sqlite":
+        schema_editor.execute(SQLITE_DROP_TABLE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="profile",
+            name="birth_date",
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="profile",
+            name="location",
+            field=models.CharField(blank=True, db_index=True, max_length=30),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.1.5 on 2026-10-18 05:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0003_profile_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="profile",
+            name="avatar_status",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("", "No avatar"),
+                    ("pending", "Pending"),
+                    ("ready", "Ready"),
+                    ("failed", "Failed"),
+                ],
+                max_length=10,
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.1.5 on 2026-10-18 05:47
+
+from django.db import migrations, models
+import utils.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0004_profile_avatar_status"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="profile",
+            name="avatar",
+            field=models.ImageField(
+                blank=True,
+                storage=utils.storage.HashedFileSystemStorage(),
+                upload_to="profile_avatars",
+            ),
+        ),
+    ]
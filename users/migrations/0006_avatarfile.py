@@ -0,0 +1,22 @@
+# Generated by Django 4.1.5 on 2026-10-18 07:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0005_profile_avatar_storage"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AvatarFile",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=100, primary_key=True, serialize=False),
+                ),
+            ],
+        ),
+    ]
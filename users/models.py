@@ -1,28 +1,104 @@
-from PIL import Image
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
+
+from utils.storage import HashedFileSystemStorage
+from utils.tracking import get_changed_fields, remember_fields, track_changes
+
+
+class ProfileQuerySet(models.QuerySet):
+    def touch(self):
+        """Bump `updated_at` of the selected profiles without loading them."""
+        return self.update(updated_at=timezone.now())
+
+    def create_with_user(self, user, **fields):
+        """
+        Insert the unsaved `user` and its profile with `fields` in one transaction
+        and return the profile. The unique username is the only check, so a taken
+        one raises `IntegrityError` and nothing is written.
+        """
+        with transaction.atomic(using=self.db):
+            # picked up by the post_save signal of the user, instead of an empty profile
+            user._new_profile = self.model(user=user, **fields)
+            user.save(using=self.db)
+        return user.profile
 
 
 class Profile(models.Model):
+    class AvatarStatus(models.TextChoices):
+        NONE = "", "No avatar"
+        PENDING = "pending", "Pending"
+        READY = "ready", "Ready"
+        FAILED = "failed", "Failed"
+
     bio = models.TextField(max_length=500, blank=True)
-    location = models.CharField(max_length=30, blank=True)
-    birth_date = models.DateField(null=True, blank=True)
-    avatar = models.ImageField(upload_to='profile_avatars', blank=True)
+    location = models.CharField(max_length=30, blank=True, db_index=True)
+    birth_date = models.DateField(null=True, blank=True, db_index=True)
+    # content addressed, identical uploads share one file
+    avatar = models.ImageField(upload_to='profile_avatars', storage=HashedFileSystemStorage(), blank=True)
+    avatar_status = models.CharField(max_length=10, choices=AvatarStatus.choices, blank=True)
     user = models.OneToOneField(User, on_delete=models.CASCADE)
+    # bumped on every change of the profile or its user, used as the version of both
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = ProfileQuerySet.as_manager()
 
     def __str__(self):
         return self.user.username
 
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using, fields)
+        remember_fields(self, fields)
+
+    def _avatar_name(self):
+        # read the raw value, touching a deferred avatar would cost a query
+        value = self.__dict__.get("avatar")
+        return getattr(value, "name", value) or ""
+
     def save(self, *args, **kwargs):
-        super().save()
+        from users.avatars import claim_avatar_file, schedule_avatar_deletion, schedule_avatar_processing
+
+        changed = get_changed_fields(self)
+        avatar_changed = "avatar" in self.__dict__ and (
+            "avatar" in changed or (self.avatar and not self.avatar._committed)
+        )
+        if avatar_changed:
+            changed.add("avatar")
+            self.avatar_status = self.AvatarStatus.PENDING if self.avatar else self.AvatarStatus.NONE
+            changed.add("avatar_status")
+        if not self._state.adding and not args and kwargs.get("update_fields") is None:
+            # only write what changed, updated_at is bumped in any case
+            kwargs["update_fields"] = changed | {"updated_at"}
+
+        replaced_avatar = self._loaded_values.get("avatar") or ""
+        # kept to write the file again should a deletion of an identical one remove it
+        upload = self.avatar.file if avatar_changed and self.avatar and not self.avatar._committed else None
+        if avatar_changed and self.avatar:
+            with transaction.atomic(using=kwargs.get("using")):
+                super().save(*args, **kwargs)
+                claim_avatar_file(self.avatar.name, upload)
+        else:
+            super().save(*args, **kwargs)
+
+        if avatar_changed:
+            # the old file goes once no other profile shares it
+            if replaced_avatar and replaced_avatar != self._avatar_name():
+                schedule_avatar_deletion([replaced_avatar])
+            # resizing happens off the request on the avatar worker pool
+            if self.avatar:
+                schedule_avatar_processing(self)
+
 
-        if not self.avatar:
-            return
+class AvatarFile(models.Model):
+    """
+    Lock row of a stored avatar file. Deleting the file and adding a reference
+    to it lock this row, so the two cannot interleave.
+    """
 
-        img = Image.open(self.avatar.path)
+    name = models.CharField(max_length=100, primary_key=True)
 
-        if img.height > 100 or img.width > 100:
-            new_img = (100, 100)
-            img.thumbnail(new_img)
-            img.save(self.avatar.path)
 
+# Profile saves write only their changed columns and User saves only touch the
+# profile when a field it shows changed
+track_changes(Profile)
+track_changes(User)
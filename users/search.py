@@ -0,0 +1,67 @@
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+SEARCH_FIELDS = ("username", "email", "first_name", "last_name")
+SEARCH_TABLE = "users_profile_search"
+
+# Postgres answers `icontains` from trigram GIN indexes, SQLite from an FTS5 shadow
+# table using the trigram tokenizer, both created by migration 0002_profile_search.
+
+# trigram matching needs at least three characters, shorter terms fall back to LIKE
+MIN_MATCH_LENGTH = 3
+INDEX_BATCH_SIZE = 500
+
+_search_tables = {}
+
+
+def has_search_table():
+    """Whether the SQLite search table exists, looked up once per database."""
+    if connection.vendor != "sqlite":
+        return False
+    name = connection.settings_dict["NAME"]
+    if name not in _search_tables:
+        _search_tables[name] = SEARCH_TABLE in connection.introspection.table_names()
+    return _search_tables[name]
+
+
+def search_profiles(queryset, term):
+    """Filter a `Profile` queryset to users whose names or email contain `term`."""
+    if len(term) >= MIN_MATCH_LENGTH and has_search_table():
+        match = '"' + term.replace('"', '""') + '"'
+        return queryset.filter(
+            id__in=RawSQL(f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s", [match])
+        )
+
+    condition = Q()
+    for field in SEARCH_FIELDS:
+        condition |= Q(**{f"user__{field}__icontains": term})
+    return queryset.filter(condition)
+
+
+def index_profiles(profile_ids):
+    """(Re)index the given profiles in the SQLite search table."""
+    if not profile_ids or not has_search_table():
+        return
+    profile_ids = list(profile_ids)
+    columns = ", ".join(SEARCH_FIELDS)
+    selected = ", ".join(f"u.{field}" for field in SEARCH_FIELDS)
+    with connection.cursor() as cursor:
+        for start in range(0, len(profile_ids), INDEX_BATCH_SIZE):
+            batch = profile_ids[start : start + INDEX_BATCH_SIZE]
+            cursor.execute(
+                f"INSERT OR REPLACE INTO {SEARCH_TABLE} (rowid, {columns}) "
+                f"SELECT p.id, {selected} FROM users_profile p JOIN auth_user u ON u.id = p.user_id "
+                f"WHERE p.id IN ({', '.join(['%s'] * len(batch))})",
+                batch,
+            )
+
+
+def unindex_profiles(profile_ids):
+    if not profile_ids or not has_search_table():
+        return
+    profile_ids = list(profile_ids)
+    with connection.cursor() as cursor:
+        for start in range(0, len(profile_ids), INDEX_BATCH_SIZE):
+            batch = profile_ids[start : start + INDEX_BATCH_SIZE]
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({', '.join(['%s'] * len(batch))})", batch)
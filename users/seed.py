@@ -0,0 +1,181 @@
+import random
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from io import BytesIO
+
+import django
+from PIL import Image, ImageDraw, ImageOps
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+
+from users.avatars import generate_avatar_derivatives, get_avatar_storage
+from users.models import Profile
+from users.search import index_profiles
+
+# fmt: off
+FIRST_NAMES = (
+    "James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David", "Elizabeth",
+    "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Charles", "Karen",
+    "Ali", "Fatima", "Mohammed", "Aisha", "Wei", "Mei", "Hiroshi", "Yuki", "Carlos", "Sofia",
+    "Luca", "Giulia", "Lukas", "Anna", "Ivan", "Olga", "Arjun", "Priya", "Kwame", "Amara",
+)
+LAST_NAMES = (
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+    "Hernandez", "Lopez", "Wilson", "Anderson", "Taylor", "Moore", "Jackson", "Martin", "Lee", "Thompson",
+    "Khan", "Ahmed", "Wang", "Li", "Zhang", "Tanaka", "Suzuki", "Silva", "Santos", "Rossi",
+    "Ferrari", "Muller", "Schmidt", "Ivanov", "Petrov", "Patel", "Sharma", "Mensah", "Okafor", "Nguyen",
+)
+LOCATIONS = (
+    "London", "New York", "Berlin", "Paris", "Tokyo", "Lagos", "Cairo", "Karachi", "Mumbai", "Shanghai",
+    "Sao Paulo", "Mexico City", "Toronto", "Sydney", "Madrid", "Rome", "Istanbul", "Moscow", "Seoul", "Nairobi",
+)
+BIO_WORDS = (
+    "coffee", "music", "travel", "code", "books", "football", "design", "photography", "hiking", "cooking",
+    "startups", "science", "movies", "gaming", "running", "art", "history", "cats", "dogs", "open source",
+)
+# fmt: on
+EMAIL_DOMAINS = ("example.com", "example.org", "example.net")
+
+# seeded rows are the same whatever day they are generated on
+JOINED_FROM = datetime(2018, 1, 1, tzinfo=dt_timezone.utc)
+JOINED_SPAN = 6 * 365 * 24 * 60 * 60
+BORN_FROM = date(1950, 1, 1)
+BORN_SPAN = 55 * 365
+
+
+def seed_row(seed, index, password, avatar_ratio):
+    """The user, unsaved profile and whether it gets an avatar, derived from `seed` and `index` only."""
+    rng = random.Random(f"{seed}:{index}")
+    first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    # the index keeps usernames unique across batches and seeds
+    username = f"{first_name}.{last_name}.{index}".lower()
+    user = User(
+        username=username,
+        email=f"{username}@{rng.choice(EMAIL_DOMAINS)}",
+        first_name=first_name,
+        last_name=last_name,
+        password=password,
+        is_active=rng.random() < 0.97,
+        date_joined=JOINED_FROM + timedelta(seconds=rng.randrange(JOINED_SPAN)),
+    )
+    words = rng.sample(BIO_WORDS, rng.randint(2, 5))
+    profile = Profile(
+        bio=f"Into {', '.join(words[:-1])} and {words[-1]}." if rng.random() < 0.6 else "",
+        location=rng.choice(LOCATIONS) if rng.random() < 0.85 else "",
+        birth_date=BORN_FROM + timedelta(days=rng.randrange(BORN_SPAN)) if rng.random() < 0.8 else None,
+    )
+    return user, profile, rng.random() < avatar_ratio
+
+
+def render_avatar(seed, index, size):
+    """A `size` pixels JPEG of a gradient and a few discs, the same for the same `seed` and `index`."""
+    rng = random.Random(f"{seed}:avatar:{index}")
+    top, bottom = [tuple(rng.randrange(256) for _ in range(3)) for _ in range(2)]
+    img = ImageOps.colorize(Image.linear_gradient("L").resize((size, size)), top, bottom)
+    draw = ImageDraw.Draw(img)
+    for _ in range(rng.randint(3, 8)):
+        x, y, radius = rng.randrange(size), rng.randrange(size), rng.randint(size // 16, size // 3)
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=tuple(rng.randrange(256) for _ in range(3)))
+    buffer = BytesIO()
+    img.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def seed_avatar(seed, index, size):
+    """Store a rendered avatar with its derivatives, as processing an upload would, and return its name."""
+    name = Profile._meta.get_field("avatar").generate_filename(None, "avatar.jpg")
+    name = get_avatar_storage().save(name, ContentFile(render_avatar(seed, index, size)))
+    generate_avatar_derivatives(name)
+    return name
+
+
+def _start_batch(executor, seed, indexes, password, avatar_ratio, avatar_size):
+    rows = [(index, *seed_row(seed, index, password, avatar_ratio)) for index in indexes]
+    usernames = [user.username for _, user, _, _ in rows]
+    taken = User.objects.filter(username__in=usernames).values_list("username", flat=True).first()
+    if taken is not None:
+        raise ValueError(f"User {taken} already exists")
+
+    avatar_indexes = [index for index, _, _, wants_avatar in rows if wants_avatar]
+    args = ([seed] * len(avatar_indexes), avatar_indexes, [avatar_size] * len(avatar_indexes))
+    avatars = executor.map(seed_avatar, *args) if executor is not None else map(seed_avatar, *args)
+    return rows, avatar_indexes, avatars
+
+
+def _write_batch(rows, avatar_indexes, avatars):
+    names = dict(zip(avatar_indexes, avatars))
+    with transaction.atomic():
+        users = User.objects.bulk_create([user for _, user, _, _ in rows])
+        if users and users[0].pk is None:
+            # the backend cannot return primary keys from bulk inserts
+            created = User.objects.in_bulk([user.username for user in users], field_name="username")
+            users = [created[user.username] for user in users]
+
+        profiles = []
+        for (index, _, profile, _), user in zip(rows, users):
+            profile.user = user
+            if index in names:
+                profile.avatar = names[index]
+                profile.avatar_status = Profile.AvatarStatus.READY
+            profiles.append(profile)
+        profiles = Profile.objects.bulk_create(profiles)
+        if profiles and profiles[0].pk is None:
+            created = Profile.objects.in_bulk([user.pk for user in users], field_name="user_id")
+            profiles = [created[user.pk] for user in users]
+        index_profiles([profile.pk for profile in profiles])
+
+
+def seed_users(
+    count,
+    seed=0,
+    start=0,
+    batch_size=1000,
+    avatars=False,
+    avatar_ratio=1.0,
+    avatar_size=256,
+    password=None,
+    workers=None,
+    progress=None,
+):
+    """
+    Insert `count` synthetic users with their profiles, numbered from `start`.
+
+    Every row, and avatar, is derived from `seed` and its number alone, so runs
+    with the same arguments produce the same data whatever the batch size or
+    worker count. Users and profiles are inserted with `bulk_create` one
+    transaction per batch, which skips the per-row signals: no set password
+    emails are sent and the search rows are written per batch. With `avatars`,
+    `avatar_ratio` of the users get a generated image, rendered with its
+    derivatives on `workers` processes (all CPUs by default, inline with 0).
+    All users share `password`, hashed once, or an unusable one.
+
+    `progress(done)` is called after every batch. Raises ValueError when a
+    seeded username is taken already.
+    """
+    password = make_password(password)
+    avatar_ratio = avatar_ratio if avatars else 0
+    batches = [
+        range(first, min(first + batch_size, start + count)) for first in range(start, start + count, batch_size)
+    ]
+
+    executor = None
+    if avatars and workers != 0:
+        # forked workers must not share the connections of this process
+        connections.close_all()
+        executor = ProcessPoolExecutor(workers, initializer=django.setup)
+    try:
+        done, pending = 0, None
+        for batch in batches + [None]:
+            # the next batch is generated, and its avatars submitted, before the current one is written
+            current = pending
+            pending = _start_batch(executor, seed, batch, password, avatar_ratio, avatar_size) if batch else None
+            if current is not None:
+                _write_batch(*current)
+                done += len(current[0])
+                if progress is not None:
+                    progress(done)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
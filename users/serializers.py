@@ -1,59 +1,73 @@
 import base64
 
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.db import transaction
 from rest_framework import serializers
 
+from users.avatars import check_avatar_queue, get_avatar_srcset
 from users.models import Profile
-from utils.b64 import file_to_base64
+from utils.b64 import cached_file_to_base64
+from utils.images import validate_image
+from utils.serializers import SparseFieldsMixin
+from utils.tracking import get_changed_fields
 
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ["username", "email", "first_name", "last_name"]
+        # taken usernames are reported by the views from the unique constraint
+        extra_kwargs = {"username": {"validators": [UnicodeUsernameValidator()]}}
 
 
-class ProfileSerializer(serializers.ModelSerializer):
+class ProfileSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer()
     # Comment this field if frontend does not need the avatar as base64
     avatar_base64 = serializers.SerializerMethodField()
+    avatar_srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Profile
         fields = "__all__"
+        read_only_fields = ["avatar_status"]
+        extra_kwargs = {"avatar": {"validators": [validate_image, check_avatar_queue]}}
+        method_field_sources = {"avatar_base64": ["avatar"], "avatar_srcset": ["avatar", "avatar_status"]}
+        flatten = ["user"]
 
     # Comment this field if frontend does not need the avatar as base64
     def get_avatar_base64(self, profile):
         # check if file exists
-        return file_to_base64(profile.avatar) if profile.avatar else ""
+        return cached_file_to_base64(profile.avatar) if profile.avatar else ""
+
+    def get_avatar_srcset(self, profile):
+        return get_avatar_srcset(profile, self.context.get("request"))
 
     def to_representation(self, instance):
         # flatten the user object
         ret = super().to_representation(instance)
-        ret.update(ret.pop("user"))
+        ret.update(ret.pop("user", {}))
         return ret
 
     def create(self, validated_data):
-        user_data = validated_data.pop("user")
-        random_password = User.objects.make_random_password()
-        user_data["password"] = random_password
-        user = User.objects.create(**user_data)
-
-        profile = Profile.objects.get(user=user)
-        profile.__dict__.update(validated_data)
-        profile.save()
-
-        return profile
+        user = User(**validated_data.pop("user"))
+        # the password is chosen through the set password email
+        user.set_unusable_password()
+        return Profile.objects.create_with_user(user, **validated_data)
 
     def update(self, instance, validated_data):
-        if "user" in validated_data:
-            user_data = validated_data.pop("user")
-            user = instance.user
-            user.__dict__.update(user_data)
-            user.save()
-
-        instance.__dict__.update(validated_data)
-        instance.save()
+        with transaction.atomic():
+            if "user" in validated_data:
+                user_data = validated_data.pop("user")
+                user = instance.user
+                user.__dict__.update(user_data)
+                changed = get_changed_fields(user)
+                if changed:
+                    user.save(update_fields=changed)
+
+            instance.__dict__.update(validated_data)
+            instance.save()
 
         return instance
 
@@ -61,4 +75,49 @@ class ProfileSerializer(serializers.ModelSerializer):
 class AvatarSerializer(serializers.ModelSerializer):
     class Meta:
         model = Profile
-        fields = ["avatar"]
+        fields = ["avatar", "avatar_status"]
+        read_only_fields = ["avatar_status"]
+        extra_kwargs = {"avatar": {"validators": [validate_image, check_avatar_queue]}}
+
+
+class BulkProfileSerializer(ProfileSerializer):
+    user = UserSerializer()
+
+    class Meta(ProfileSerializer.Meta):
+        fields = ["user", "bio", "location", "birth_date"]
+
+
+class BulkFilterSerializer(serializers.Serializer):
+    location = serializers.CharField(required=False, allow_blank=True)
+    is_active = serializers.BooleanField(required=False)
+    is_staff = serializers.BooleanField(required=False)
+
+
+class BulkSelectionSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False)
+    filter = BulkFilterSerializer(required=False)
+
+    def validate(self, attrs):
+        if not attrs.get("ids") and not attrs.get("filter"):
+            raise serializers.ValidationError("Select the users with a list of ids or a filter")
+        if len(attrs.get("ids", [])) > settings.USERS_BULK_MAX_ITEMS:
+            raise serializers.ValidationError(f"At most {settings.USERS_BULK_MAX_ITEMS} ids can be sent at once")
+        return attrs
+
+
+class BulkChangesSerializer(serializers.Serializer):
+    bio = serializers.CharField(max_length=500, required=False, allow_blank=True)
+    location = serializers.CharField(max_length=30, required=False, allow_blank=True)
+    birth_date = serializers.DateField(required=False, allow_null=True)
+    email = serializers.EmailField(required=False, allow_blank=True)
+    first_name = serializers.CharField(max_length=150, required=False, allow_blank=True)
+    last_name = serializers.CharField(max_length=150, required=False, allow_blank=True)
+    is_active = serializers.BooleanField(required=False)
+
+
+class BulkUpdateSerializer(BulkSelectionSerializer):
+    changes = BulkChangesSerializer()
+
+
+class BulkUpdateItemSerializer(BulkChangesSerializer):
+    id = serializers.IntegerField()
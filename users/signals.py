@@ -1,23 +1,68 @@
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
 from utils.mail import send_set_password_email
+from users.avatars import schedule_avatar_deletion
 from users.models import Profile
+from users.search import SEARCH_FIELDS, index_profiles, unindex_profiles
+from utils.deletes import collect_until_commit, deletes_are_handled
+from utils.tracking import get_saved_changes
+
+# user fields shown with the profile, changing one bumps the profile's version
+PROFILE_USER_FIELDS = {"username", "email", "first_name", "last_name", "is_staff", "is_active"}
 
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
-        Profile.objects.create(user=instance)
+        # `Profile.objects.create_with_user` hands over a profile with its fields set
+        profile = instance.__dict__.pop("_new_profile", None) or Profile(user=instance)
+        profile.save()
+        instance.profile = profile
 
 
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    instance.profile.save()
+def touch_user_profile(sender, instance, created, **kwargs):
+    # logins and password changes leave the profile alone
+    changed = get_saved_changes(instance) & PROFILE_USER_FIELDS
+    if created or not changed:
+        return
+    Profile.objects.filter(user_id=instance.pk).touch()
+    if changed & set(SEARCH_FIELDS):
+        index_profiles(Profile.objects.filter(user_id=instance.pk).values_list("id", flat=True))
 
 
 @receiver(post_save, sender=Profile)
 def send_email_on_profile_creation(sender, instance, created, **kwargs):
     if created:
-        send_set_password_email(instance.user)
\ No newline at end of file
+        send_set_password_email(instance.user)
+
+
+@receiver(post_save, sender=Profile)
+def index_profile_search(sender, instance, created, **kwargs):
+    # only user fields are searched, their changes are indexed by `touch_user_profile`
+    if created:
+        index_profiles([instance.pk])
+
+
+@receiver(post_delete, sender=Profile)
+def unindex_profile_search(sender, instance, origin=None, **kwargs):
+    if deletes_are_handled():
+        return
+    if isinstance(origin, QuerySet):
+        # queryset deletes, such as the admin's, drop their search rows in batches once committed
+        collect_until_commit(origin, unindex_profiles, instance.pk)
+    else:
+        unindex_profiles([instance.pk])
+
+
+@receiver(post_delete, sender=Profile)
+def delete_profile_avatar(sender, instance, origin=None, **kwargs):
+    if not instance.avatar or deletes_are_handled():
+        return
+    if isinstance(origin, QuerySet):
+        collect_until_commit(origin, schedule_avatar_deletion, instance.avatar.name)
+    else:
+        schedule_avatar_deletion([instance.avatar.name])
\ No newline at end of file
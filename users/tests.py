@@ -1,20 +1,57 @@
 import base64
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import tempfile
+import threading
+from unittest import mock
+
+from django.core import mail
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.signals import request_finished
+from django.db import close_old_connections, connection
+from django.conf import settings
+from django.http import Http404
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
 from PIL import Image
 from io import BytesIO
 
+from account.models import OutboxEmail
+from users.avatars import avatar_derivative_names, delete_avatar_files, lock_avatar_files
 from users.models import Profile
+from users.search import SEARCH_TABLE
+from users.seed import seed_users
 from users.serializers import ProfileSerializer
 
 
+def close_response(response):
+    """Close a response served outside the test client without closing the test's database connection with it."""
+    request_finished.disconnect(close_old_connections)
+    try:
+        response.close()
+    finally:
+        request_finished.connect(close_old_connections)
+
+
+def remove_avatar(profile):
+    """Drop the profile's reference to its avatar and delete the file, as a release after commit would."""
+    name = profile.avatar.name
+    Profile.objects.filter(pk=profile.pk).update(avatar="")
+    delete_avatar_files([name])
+
+
 class ProfileModelTests(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(username="test_user", password="test_password", email="test@test.com")
 
     def tearDown(self) -> None:
         profile = Profile.objects.get(user=self.user)
-        profile.avatar.delete(save=False)
+        if profile.avatar:
+            remove_avatar(profile)
         super().tearDown()
 
     def test_user_profile_creation(self):
@@ -42,7 +79,7 @@ class ProfileModelTests(TestCase):
             self.assertEqual(img.size, (50, 50))
 
     def test_save_with_large_avatar(self):
-        img = Image.new("RGB", (200, 200), color="red")
+        img = Image.new("RGB", (400, 400), color="red")
         file = BytesIO()
         img.save(file, "jpeg")
         file.seek(0)
@@ -53,17 +90,189 @@ class ProfileModelTests(TestCase):
 
         # Check that the avatar was resized
         with Image.open(profile.avatar.path) as img:
-            self.assertEqual(img.size, (100, 100))
+            self.assertEqual(img.size, (256, 256))
+        self.assertEqual(profile.avatar_status, Profile.AvatarStatus.READY)
+
+    @override_settings(AVATAR_PROCESSING_SYNC=False)
+    def test_large_avatar_is_resized_after_commit(self):
+        img = Image.new("RGB", (400, 400), color="red")
+        file = BytesIO()
+        img.save(file, "jpeg")
+        file.seek(0)
+
+        profile = Profile.objects.get(user=self.user)
+        with self.captureOnCommitCallbacks() as callbacks:
+            profile.avatar.save("avatar.jpeg", file, save=True)
+
+        # nothing happens on the request itself
+        self.assertEqual(Profile.objects.get(pk=profile.pk).avatar_status, Profile.AvatarStatus.PENDING)
+        with Image.open(profile.avatar.path) as img:
+            self.assertEqual(img.size, (400, 400))
+
+        with mock.patch("users.avatars.submit", side_effect=lambda fn, *args: fn(*args)):
+            for callback in callbacks:
+                callback()
+        original_path = profile.avatar.path
+        profile.refresh_from_db()
+        self.assertEqual(profile.avatar_status, Profile.AvatarStatus.READY)
+        # the resized avatar is stored under its own hash and the original is gone
+        self.assertFalse(os.path.exists(original_path))
+        with Image.open(profile.avatar.path) as img:
+            self.assertEqual(img.size, (256, 256))
+
+    @override_settings(AVATAR_SIZES=[32, 64], AVATAR_FORMATS=["webp", "jpeg"])
+    def test_avatar_derivatives(self):
+        img = Image.new("RGBA", (80, 40), color="red")
+        file = BytesIO()
+        img.save(file, "png")
+        file.seek(0)
+
+        profile = Profile.objects.get(user=self.user)
+        profile.avatar.save("avatar.png", file, save=True)
+
+        root = profile.avatar.path[: -len(".png")]
+        for size in (32, 64):
+            for ext, image_format in (("webp", "WEBP"), ("jpg", "JPEG")):
+                with Image.open(f"{root}_{size}.{ext}") as derivative:
+                    self.assertEqual(derivative.size, (size, size))
+                    self.assertEqual(derivative.format, image_format)
+
+        srcset = ProfileSerializer(profile).data["avatar_srcset"]
+        url = profile.avatar.url[: -len(".png")]
+        self.assertEqual(srcset["image/webp"], f"{url}_32.webp 32w, {url}_64.webp 64w")
+        self.assertEqual(srcset["image/jpeg"], f"{url}_32.jpg 32w, {url}_64.jpg 64w")
+
+        remove_avatar(profile)
+        self.assertFalse(any(os.path.exists(f"{root}_{size}.webp") for size in (32, 64)))
+
+    def test_identical_avatars_share_a_file(self):
+        other = User.objects.create_user(username="other_user", password="test_password").profile
+        content = open("media/profile_avatars/test_avatar_64.jpg", "rb").read()
+        profile = Profile.objects.get(user=self.user)
+        profile.avatar = SimpleUploadedFile(name="first.JPG", content=content)
+        profile.save()
+        other.avatar = SimpleUploadedFile(name="second.jpg", content=content)
+        other.save()
+
+        self.assertRegex(profile.avatar.name, r"^profile_avatars/[0-9a-f]{64}\.jpg$")
+        self.assertEqual(other.avatar.name, profile.avatar.name)
+
+        # still used by the other profile
+        delete_avatar_files([profile.avatar.name])
+        self.assertTrue(os.path.exists(profile.avatar.path))
+        remove_avatar(other)
+        self.assertTrue(os.path.exists(profile.avatar.path))
+        remove_avatar(profile)
+        self.assertFalse(os.path.exists(profile.avatar.path))
+
+    def test_upload_restores_a_file_deleted_meanwhile(self):
+        profile = Profile.objects.get(user=self.user)
+        storage = profile.avatar.storage
+
+        def delete_then_lock(names):
+            # the deletion of an identical avatar ran between storing the upload and referencing it
+            if lock.call_count == 1:
+                for name in names:
+                    storage.delete(name)
+            lock_avatar_files(names)
+
+        with mock.patch("users.avatars.lock_avatar_files", side_effect=delete_then_lock) as lock:
+            profile.avatar = SimpleUploadedFile(
+                name="avatar.jpg", content=open("media/profile_avatars/test_avatar_64.jpg", "rb").read()
+            )
+            profile.save()
+        self.assertEqual(profile.avatar_status, Profile.AvatarStatus.READY)
+        self.assertTrue(os.path.exists(profile.avatar.path))
+
+    def test_hashed_media_is_cached_forever(self):
+        profile = Profile.objects.get(user=self.user)
+        profile.avatar = SimpleUploadedFile(
+            name="avatar.jpg", content=open("media/profile_avatars/test_avatar_64.jpg", "rb").read()
+        )
+        profile.save()
+
+        request = RequestFactory().get(profile.avatar.url)
+        response = serve_media(request, profile.avatar.name, document_root=settings.MEDIA_ROOT)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("immutable", response["Cache-Control"])
+        close_response(response)
+
+        response = serve_media(request, "profile_avatars/test_avatar_64.jpg", document_root=settings.MEDIA_ROOT)
+        self.assertFalse(response.has_header("Cache-Control"))
+        close_response(response)
+
+    def test_pending_avatar_has_no_srcset(self):
+        profile = Profile.objects.get(user=self.user)
+        profile.avatar = "profile_avatars/missing.png"
+        profile.avatar_status = Profile.AvatarStatus.PENDING
+        self.assertEqual(ProfileSerializer(profile, fields=["avatar_srcset"]).data["avatar_srcset"], {})
+
+    def test_save_without_avatar_change_skips_processing(self):
+        profile = Profile.objects.get(user=self.user)
+        with mock.patch("users.avatars.process_avatar") as process_avatar:
+            profile.bio = "bio"
+            profile.save()
+            Profile.objects.only("id").get(pk=profile.pk).save()
+        process_avatar.assert_not_called()
+
+    def test_save_writes_only_changed_fields(self):
+        profile = Profile.objects.get(user=self.user)
+        profile.bio = "bio"
+        with CaptureQueriesContext(connection) as queries:
+            profile.save()
+        update = queries.captured_queries[0]["sql"]
+        self.assertIn('"bio"', update)
+        self.assertIn('"updated_at"', update)
+        self.assertNotIn('"avatar"', update)
+        self.assertNotIn('"location"', update)
+
+    def test_user_save_touches_profile_only_for_shown_fields(self):
+        updated_at = Profile.objects.get(user=self.user).updated_at
+        user = User.objects.get(pk=self.user.pk)
+        with mock.patch("users.signals.index_profiles") as index_profiles:
+            user.last_login = user.date_joined
+            user.save()
+            user.save()
+        index_profiles.assert_not_called()
+        self.assertEqual(Profile.objects.get(user=self.user).updated_at, updated_at)
+
+        with mock.patch("users.signals.index_profiles") as index_profiles:
+            user.first_name = "changed"
+            user.save()
+        index_profiles.assert_called_once()
+        self.assertGreater(Profile.objects.get(user=self.user).updated_at, updated_at)
+
+    @override_settings(AVATAR_PROCESSING_SYNC=False, AVATAR_WORKERS=1, AVATAR_QUEUE_SIZE=0)
+    def test_full_avatar_queue_turns_uploads_away(self):
+        from users import avatars
+
+        with mock.patch.object(avatars, "_executor", None), mock.patch.object(avatars, "_pending_jobs", 0):
+            release = threading.Event()
+            future = avatars.submit(release.wait)
+            try:
+                with self.assertRaises(avatars.AvatarBusy):
+                    avatars.check_avatar_queue()
+                # jobs of committed changes are queued all the same, never run on the caller's thread
+                queued = avatars.submit(threading.current_thread)
+            finally:
+                release.set()
+            self.assertIsNot(queued.result(timeout=5), threading.current_thread())
+            future.result(timeout=5)
+            avatars.check_avatar_queue()
+            avatars._executor.shutdown()
 
 
 from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
 from django.test import Client
 from rest_framework import status
 from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
 
 from config.tests import GlobalTestSetup, inject_token
 
-from utils.b64 import file_to_base64
+from utils.b64 import base64_to_file, file_to_base64, cached_file_to_base64, invalidate_base64, base64_cache
+from utils.cache import LRUCache
+from utils.media import MediaFilesHandler, serve_media
 
 
 class UserListViewTestCase(GlobalTestSetup):
@@ -88,11 +297,117 @@ class UserListViewTestCase(GlobalTestSetup):
         inject_token(self.client)
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]["username"], self.user.username)
-        self.assertEqual(response.data[0]["bio"], self.user.profile.bio)
-        self.assertEqual(response.data[0]["location"], self.user.profile.location)
-        self.assertEqual(response.data[0]["birth_date"], self.user.profile.birth_date)
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(response.data["results"][0]["username"], self.user.username)
+        self.assertEqual(response.data["results"][0]["bio"], self.user.profile.bio)
+        self.assertEqual(response.data["results"][0]["location"], self.user.profile.location)
+        self.assertEqual(response.data["results"][0]["birth_date"], self.user.profile.birth_date)
+        self.assertNotIn("count", response.data)
+
+    def test_list_users_paginated(self):
+        for i in range(4):
+            User.objects.create_user(username=f"paged_user{i}", email=f"paged{i}@test.com")
+        inject_token(self.client)
+
+        usernames = []
+        url = f"{self.url}?page_size=2"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data["results"]), 2)
+            usernames += [row["username"] for row in response.data["results"]]
+            url = response.data["next"]
+
+        self.assertEqual(usernames, list(User.objects.order_by("profile__id").values_list("username", flat=True)))
+
+    def test_list_users_descending(self):
+        User.objects.create_user(username="test_user2", email="test2@test2.com")
+        inject_token(self.client)
+        response = self.client.get(self.url, {"ordering": "-id"})
+        self.assertEqual([row["username"] for row in response.data["results"]], ["test_user2", "test_user"])
+
+        # orderings outside the whitelist fall back to the view's default key
+        response = self.client.get(self.url, {"ordering": "bio"})
+        self.assertEqual([row["username"] for row in response.data["results"]], ["test_user", "test_user2"])
+
+    def test_list_users_with_count(self):
+        User.objects.create_user(username="test_user2", email="test2@test2.com")
+        inject_token(self.client)
+        response = self.client.get(self.url, {"count": "exact", "page_size": 1})
+        self.assertEqual(response.data["count"], 2)
+        self.assertEqual(len(response.data["results"]), 1)
+
+        # the planner estimate is Postgres only, other backends count exactly
+        response = self.client.get(self.url, {"count": "estimate"})
+        self.assertEqual(response.data["count"], 2)
+
+    def test_list_users_query_count(self):
+        inject_token(self.client)
+        # authenticating the token, the list version and the page of profiles joined with their users
+        with self.assertNumQueries(3):
+            self.client.get(self.url)
+
+        for i in range(10):
+            User.objects.create_user(username=f"query_user{i}", email=f"query{i}@test.com")
+        # the authenticated user is cached now
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data["results"]), 11)
+
+    def test_list_users_with_sparse_fields(self):
+        inject_token(self.client)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {"fields": "id,username"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["results"][0], {"id": self.user.profile.id, "username": self.user.username})
+        self.assertNotIn("bio", queries[-1]["sql"])
+        self.assertNotIn("email", queries[-1]["sql"])
+
+    def test_list_users_without_profile_fields(self):
+        inject_token(self.client)
+        response = self.client.get(self.url, {"exclude": "username,email,first_name,last_name"})
+        self.assertNotIn("username", response.data["results"][0])
+        self.assertEqual(response.data["results"][0]["bio"], self.user.profile.bio)
+
+    def test_list_users_not_modified(self):
+        inject_token(self.client)
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        new_user = User.objects.create_user(username="test_user2", email="test2@test2.com")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response["ETag"]
+
+        self.client.patch(
+            reverse("user-bulk"), {"ids": [new_user.profile.id], "changes": {"bio": "Bulk"}}, format="json"
+        )
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response["ETag"]
+
+        new_user.delete()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_list_users_version_reads_only_the_page(self):
+        inject_token(self.client)
+        etag = self.client.get(self.url, {"page_size": 1})["ETag"]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {"page_size": 1}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertFalse([query for query in queries if "COUNT(" in query["sql"].upper()])
+
+        # rows past the page leave it unchanged
+        User.objects.create_user(username="test_user2", email="test2@test2.com")
+        response = self.client.get(self.url, {"page_size": 1}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # while the total may have changed
+        response = self.client.get(self.url, {"page_size": 1, "count": "exact"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 2)
 
     def test_list_users_without_authentication(self):
         response = self.client.get(self.url)
@@ -127,7 +442,7 @@ class UserListViewTestCase(GlobalTestSetup):
 
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data["results"]), 2)
 
     def test_user_creation_with_invalid_data(self):
         inject_token(self.client)
@@ -144,6 +459,89 @@ class UserListViewTestCase(GlobalTestSetup):
         self.assertEqual(response.data["detail"], "User already exists")
 
 
+class UserSearchTestCase(GlobalTestSetup):
+    def setUp(self):
+        super().setUp("user-list")
+        self.alice = User.objects.create_user(
+            username="alice", email="alice@example.com", first_name="Alice", last_name="Liddell"
+        )
+        self.alice.profile.location = "Oxford"
+        self.alice.profile.birth_date = "1990-05-04"
+        self.alice.profile.save()
+        self.bob = User.objects.create_user(username="bob", email="bob@example.org", first_name="Robert")
+        self.bob.profile.location = "Leeds"
+        self.bob.profile.birth_date = "1980-01-01"
+        self.bob.profile.save()
+        inject_token(self.client)
+
+    def search(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [row["username"] for row in response.data["results"]]
+
+    def test_search(self):
+        self.assertEqual(self.search(q="liddell"), ["alice"])
+        self.assertEqual(self.search(q="example"), ["alice", "bob"])
+        self.assertEqual(self.search(q="ROBE"), ["bob"])
+        self.assertEqual(self.search(q="nobody"), [])
+
+    def test_search_short_term(self):
+        self.assertEqual(self.search(q="bo"), ["bob"])
+
+    def test_search_is_kept_in_sync(self):
+        self.bob.first_name = "Bobby"
+        self.bob.save()
+        self.assertEqual(self.search(q="bobby"), ["bob"])
+        self.assertEqual(self.search(q="robert"), [])
+
+        self.bob.delete()
+        self.assertEqual(self.search(q="example"), ["alice"])
+
+    def test_search_after_bulk_changes(self):
+        response = self.client.post(
+            reverse("user-bulk"), [{"user": {"username": "carol", "last_name": "Liddell"}}], format="json"
+        )
+        carol_id = response.data["results"][0]["id"]
+        self.assertEqual(self.search(q="liddell"), ["alice", "carol"])
+
+        self.client.patch(
+            reverse("user-bulk"),
+            {"ids": [self.alice.profile.id], "changes": {"last_name": "Hargreaves"}},
+            format="json",
+        )
+        self.assertEqual(self.search(q="liddell"), ["carol"])
+
+        self.client.delete(reverse("user-bulk"), {"ids": [carol_id]}, format="json")
+        self.assertEqual(self.search(q="liddell"), [])
+        if connection.vendor == "sqlite":
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT count(*) FROM {SEARCH_TABLE}")
+                self.assertEqual(cursor.fetchone()[0], 3)
+
+    def test_search_after_queryset_delete(self):
+        # as the admin's "delete selected" and the init users endpoint do
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.filter(username__in=["alice", "bob"]).delete()
+        self.assertEqual(self.search(q="example"), [])
+        if connection.vendor == "sqlite":
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT count(*) FROM {SEARCH_TABLE}")
+                self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_filters(self):
+        self.assertEqual(self.search(location="Oxford"), ["alice"])
+        self.assertEqual(self.search(birth_date_after="1985-01-01"), ["alice"])
+        self.assertEqual(self.search(birth_date_before="1985-01-01"), ["bob"])
+        self.assertEqual(self.search(is_staff="true"), ["test_user"])
+        self.assertEqual(self.search(is_staff="false", q="example"), ["alice", "bob"])
+
+    def test_invalid_filters(self):
+        response = self.client.get(self.url, {"birth_date_after": "yesterday"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, {"is_staff": "maybe"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
 class UserDetailViewTestCase(GlobalTestSetup):
     def setUp(self):
         super().setUp("user-detail", {"pk": 2})
@@ -168,7 +566,7 @@ class UserDetailViewTestCase(GlobalTestSetup):
         if Profile.objects.filter(user=self.new_user).exists():
             profile = Profile.objects.get(user=self.new_user)
             if profile.avatar:
-                profile.avatar.delete(save=False)
+                remove_avatar(profile)
         super().tearDown()
 
     def test_get_user(self):
@@ -180,6 +578,45 @@ class UserDetailViewTestCase(GlobalTestSetup):
         self.assertEqual(response.data["location"], self.new_user.profile.location)
         self.assertEqual(response.data["birth_date"], self.new_user.profile.birth_date)
 
+    def test_get_user_query_count(self):
+        inject_token(self.client)
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data["username"], self.new_user.username)
+
+    def test_get_user_not_modified(self):
+        inject_token(self.client)
+        response = self.client.get(self.url)
+        etag = response["ETag"]
+        self.assertTrue(response.has_header("Last-Modified"))
+
+        # the version lookup, the user is cached and nothing is serialized
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+
+        # representations with other fields have their own tags
+        response = self.client.get(self.url, {"fields": "id"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_get_user_modified(self):
+        inject_token(self.client)
+        etag = self.client.get(self.url)["ETag"]
+
+        self.new_user.first_name = "Changed"
+        self.new_user.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["first_name"], "Changed")
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_get_user_if_modified_since(self):
+        inject_token(self.client)
+        last_modified = self.client.get(self.url)["Last-Modified"]
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
     def test_check_base64_avatar(self):
         inject_token(self.client)
         self.new_user.profile.avatar = SimpleUploadedFile(
@@ -192,6 +629,14 @@ class UserDetailViewTestCase(GlobalTestSetup):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data["avatar_base64"], file_to_base64(self.new_user.profile.avatar))
 
+    def test_excluded_avatar_is_not_encoded(self):
+        inject_token(self.client)
+        with mock.patch("users.serializers.cached_file_to_base64") as encode:
+            response = self.client.get(self.url, {"exclude": "avatar_base64"})
+        self.assertNotIn("avatar_base64", response.data)
+        self.assertEqual(response.data["username"], self.new_user.username)
+        encode.assert_not_called()
+
     def test_get_user_with_invalid_pk(self):
         inject_token(self.client)
         self.url = reverse("user-detail", kwargs={"pk": 3})
@@ -221,7 +666,22 @@ class UserDetailViewTestCase(GlobalTestSetup):
         self.assertEqual(response.data["bio"], self.update_user_data["bio"])
         self.assertEqual(response.data["location"], self.update_user_data["location"])
         self.assertEqual(response.data["birth_date"], self.update_user_data["birth_date"])
-        self.assertEqual(response.data["avatar"], "http://testserver/media/profile_avatars/reserved_test_avatar_64.png")
+        self.assertRegex(response.data["avatar"], r"^http://testserver/media/profile_avatars/[0-9a-f]{64}\.png$")
+
+    def test_update_user_with_large_base64_avatar(self):
+        inject_token(self.client)
+        self.update_user_data["avatar_base_64"] = "data:reserved_large/png;base64," + "A" * 4000
+        with override_settings(AVATAR_MAX_UPLOAD_SIZE=1000):
+            response = self.client.patch(self.url, self.update_user_data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("avatar_base_64", response.data)
+
+    def test_update_user_with_invalid_base64_avatar(self):
+        inject_token(self.client)
+        self.update_user_data["avatar_base_64"] = "data:reserved_invalid/png;base64,not*base64"
+        response = self.client.patch(self.url, self.update_user_data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("avatar_base_64", response.data)
 
     def test_update_user_with_invalid_pk(self):
         inject_token(self.client)
@@ -272,6 +732,314 @@ class UserDetailViewTestCase(GlobalTestSetup):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
 
+class BulkUserViewTest(GlobalTestSetup):
+    def setUp(self):
+        super().setUp("user-bulk")
+        self.data = [
+            {"user": {"username": f"bulk_user{i}", "email": f"bulk{i}@test.com"}, "location": "Bulk"} for i in range(3)
+        ]
+
+    def test_bulk_create(self):
+        inject_token(self.client)
+        OutboxEmail.objects.all().delete()
+        mail.outbox = []
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, self.data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([result["status"] for result in response.data["results"]], [201, 201, 201])
+
+        profile = Profile.objects.get(pk=response.data["results"][2]["id"])
+        self.assertEqual(profile.user.username, "bulk_user2")
+        self.assertEqual(profile.location, "Bulk")
+        self.assertFalse(profile.user.has_usable_password())
+        self.assertEqual(
+            sorted(email.to[0] for email in mail.outbox), ["bulk0@test.com", "bulk1@test.com", "bulk2@test.com"]
+        )
+
+    def test_bulk_create_query_count(self):
+        inject_token(self.client)
+        # authentication, the conflict check, a savepoint pair, the two inserts, the search index and the outbox
+        with self.assertNumQueries(8):
+            self.client.post(self.url, self.data, format="json")
+        self.data += [{"user": {"username": f"more_user{i}"}} for i in range(20)]
+        # minus the cached authentication
+        with self.assertNumQueries(7):
+            self.client.post(self.url, self.data, format="json")
+
+    def test_bulk_create_reports_every_item(self):
+        inject_token(self.client)
+        self.data[1]["user"]["username"] = self.user.username
+        self.data[2]["user"]["username"] = self.data[0]["user"]["username"]
+        self.data.append({"user": {"username": ""}})
+        response = self.client.post(self.url, self.data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([result["status"] for result in response.data["results"]], [201, 409, 409, 400])
+        self.assertEqual([result["index"] for result in response.data["results"]], [0, 1, 2, 3])
+        self.assertEqual(User.objects.count(), 2)
+
+    def test_bulk_create_with_invalid_payload(self):
+        inject_token(self.client)
+        response = self.client.post(self.url, self.data[0], format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_create_without_authorization(self):
+        inject_token(self.client)
+        self.user.is_staff = False
+        self.user.save()
+        response = self.client.post(self.url, self.data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class BulkUpdateDeleteViewTest(GlobalTestSetup):
+    def setUp(self):
+        super().setUp("user-bulk")
+        self.users = [User.objects.create_user(username=f"bulk_user{i}", email=f"bulk{i}@test.com") for i in range(3)]
+        self.ids = [user.profile.id for user in self.users]
+
+    def test_bulk_update_selection(self):
+        inject_token(self.client)
+        data = {"ids": self.ids[:2], "changes": {"is_active": False, "location": "Gone"}}
+        # authentication, the selection, a savepoint pair and one update per table
+        with self.assertNumQueries(6):
+            response = self.client.patch(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["updated"], 2)
+        self.assertEqual(list(Profile.objects.filter(location="Gone").values_list("id", flat=True)), self.ids[:2])
+        self.assertEqual(User.objects.filter(is_active=False).count(), 2)
+
+    def test_bulk_update_filter(self):
+        inject_token(self.client)
+        data = {"filter": {"is_staff": False}, "changes": {"bio": "Regular"}}
+        response = self.client.patch(self.url, data, format="json")
+        self.assertEqual(response.data["updated"], 3)
+        self.assertEqual(Profile.objects.get(user=self.user).bio, "")
+
+    @override_settings(USERS_BULK_MAX_ITEMS=2)
+    def test_bulk_selection_too_large(self):
+        inject_token(self.client)
+        data = {"filter": {"is_staff": False}, "changes": {"bio": "Regular"}}
+        response = self.client.patch(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["detail"], "At most 2 users can be updated at once")
+        self.assertFalse(Profile.objects.filter(bio="Regular").exists())
+
+        response = self.client.delete(self.url, {"filter": {"is_staff": False}}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(User.objects.count(), 4)
+
+        response = self.client.delete(self.url, {"ids": self.ids}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_update_items(self):
+        inject_token(self.client)
+        data = [{"id": self.ids[0], "first_name": "First"}, {"id": self.ids[1], "bio": "Second"}, {"id": 999}]
+        response = self.client.patch(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["ids"], self.ids[:2])
+        self.assertEqual(User.objects.get(pk=self.users[0].pk).first_name, "First")
+        self.assertEqual(Profile.objects.get(pk=self.ids[1]).bio, "Second")
+
+    def test_bulk_update_without_selection(self):
+        inject_token(self.client)
+        response = self.client.patch(self.url, {"changes": {"bio": "All"}}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_delete(self):
+        inject_token(self.client)
+        profile = self.users[0].profile
+        profile.avatar = SimpleUploadedFile(
+            name="reserved_bulk_avatar.jpg",
+            content=open("media/profile_avatars/test_avatar_64.jpg", "rb").read(),
+            content_type="image/jpg",
+        )
+        profile.save()
+        avatar_path = profile.avatar.path
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.client.delete(self.url, {"ids": self.ids[:2]}, format="json")
+            self.assertTrue(os.path.exists(avatar_path))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["deleted"], 2)
+        # one avatar batch and the auth cache invalidation
+        self.assertEqual(len(callbacks), 2)
+        self.assertFalse(os.path.exists(avatar_path))
+        self.assertEqual(
+            list(User.objects.order_by("id").values_list("username", flat=True)), ["test_user", "bulk_user2"]
+        )
+        self.assertEqual(Profile.objects.count(), 2)
+
+    def test_bulk_delete_myself(self):
+        inject_token(self.client)
+        response = self.client.delete(self.url, {"filter": {"is_active": True}}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["detail"], "You cannot delete yourself")
+        self.assertEqual(User.objects.count(), 4)
+
+    def test_bulk_delete_without_authorization(self):
+        inject_token(self.client)
+        self.user.is_staff = False
+        self.user.save()
+        response = self.client.delete(self.url, {"ids": self.ids}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ExportUsersViewTest(GlobalTestSetup):
+    def setUp(self):
+        super().setUp("export-users")
+        User.objects.create_user(username="test_user2", email="test2@test2.com", first_name="Second")
+
+    def test_export_ndjson(self):
+        inject_token(self.client)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual([row["username"] for row in rows], ["test_user", "test_user2"])
+        self.assertNotIn("avatar_base64", rows[0])
+
+    def test_export_csv_with_avatars(self):
+        inject_token(self.client)
+        response = self.client.get(self.url, {"output": "csv", "avatars": "true"})
+        self.assertEqual(response["Content-Type"], "text/csv")
+        rows = list(csv.DictReader(io.StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1]["first_name"], "Second")
+        self.assertEqual(rows[1]["avatar_base64"], "")
+
+    def test_export_with_invalid_format(self):
+        inject_token(self.client)
+        response = self.client.get(self.url, {"output": "xml"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_without_authorization(self):
+        inject_token(self.client)
+        self.user.is_staff = False
+        self.user.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_export_in_docs(self):
+        with mock.patch("drf_yasg.inspectors.base.logger") as logger:
+            response = self.client.get(reverse("schema-swagger-ui"), {"format": "openapi"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.json()["paths"]["/users/export/"]["get"]["responses"]["200"]["schema"]["type"], "file"
+        )
+        failed_views = [call.args[1] for call in logger.warning.call_args_list]
+        self.assertNotIn("ExportUsersView", failed_views)
+
+    def test_export_command(self):
+        out = io.StringIO()
+        call_command("export_users", "--format", "csv", "--chunk-size", "1", stdout=out)
+        rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+        self.assertEqual([row["username"] for row in rows], ["test_user", "test_user2"])
+
+
+class SeedUsersTest(TestCase):
+    def seeded(self):
+        return list(
+            Profile.objects.order_by("user__username").values_list(
+                "user__username", "user__email", "user__date_joined", "location", "birth_date", "bio"
+            )
+        )
+
+    def test_seed_users_command(self):
+        out = io.StringIO()
+        call_command("seed_users", "--count", "5", "--batch-size", "2", "--password", "secret", stdout=out)
+        self.assertIn("5/5 users", out.getvalue())
+        self.assertEqual(Profile.objects.count(), 5)
+        self.assertEqual(OutboxEmail.objects.count(), 0)
+        user = User.objects.first()
+        self.assertTrue(user.check_password("secret"))
+        if connection.vendor == "sqlite":
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT count(*) FROM {SEARCH_TABLE}")
+                self.assertEqual(cursor.fetchone()[0], 5)
+
+    def test_seeded_users_are_deterministic(self):
+        seed_users(6, seed=7, batch_size=4)
+        seeded = self.seeded()
+        User.objects.all().delete()
+        seed_users(6, seed=7, batch_size=5)
+        self.assertEqual(self.seeded(), seeded)
+        User.objects.all().delete()
+        seed_users(6, seed=8)
+        self.assertNotEqual(self.seeded(), seeded)
+
+    def test_seed_more_users(self):
+        call_command("seed_users", "--count", "3", verbosity=0)
+        with self.assertRaisesMessage(CommandError, "already exists"):
+            call_command("seed_users", "--count", "3", verbosity=0)
+        call_command("seed_users", "--count", "3", "--start", "3", verbosity=0)
+        self.assertEqual(User.objects.count(), 6)
+
+    def test_seed_users_with_avatars(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            seed_users(2, avatars=True, avatar_size=64, workers=0)
+            profiles = list(Profile.objects.all())
+            for profile in profiles:
+                self.assertEqual(profile.avatar_status, Profile.AvatarStatus.READY)
+                for name in [profile.avatar.name] + avatar_derivative_names(profile.avatar.name):
+                    self.assertTrue(os.path.exists(os.path.join(media_root, name)))
+            self.assertNotEqual(profiles[0].avatar.name, profiles[1].avatar.name)
+
+
+class LoadTestCommandTest(TransactionTestCase):
+    def test_loadtest_against_a_baseline(self):
+        out = io.StringIO()
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "results.json")
+            args = ["--requests", "4", "--warmup", "1", "--clients", "2", "--users", "3", "--endpoints", "users", "me"]
+            call_command("loadtest", *args, "--output", output, stdout=out)
+            with open(output) as file:
+                results = json.load(file)["results"]
+            self.assertEqual(set(results), {"wsgi", "asgi"})
+            for interface in results.values():
+                for summary in interface.values():
+                    self.assertEqual(summary["statuses"], {"200": 4})
+                    self.assertGreater(summary["queries_max"], 0)
+            self.assertIn("wsgi  users", out.getvalue())
+            self.assertEqual(Profile.objects.count(), 3)
+
+            call_command("loadtest", *args, "--baseline", output, "--latency-tolerance", "1000", stdout=out)
+            self.assertIn("No regressions", out.getvalue())
+
+            results["asgi"]["me"]["queries_max"] = 0
+            with open(output, "w") as file:
+                json.dump({"results": results}, file)
+            with self.assertRaisesMessage(CommandError, "asgi me: "):
+                call_command("loadtest", *args, "--baseline", output, "--latency-tolerance", "1000", stdout=out)
+
+
+class BenchmarkProfilesCommandTest(TestCase):
+    def test_benchmark_against_a_baseline(self):
+        out = io.StringIO()
+        args = ["--rows", "2", "--sizes", "300", "--repeat", "1", "--min-time", "0"]
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "results.json")
+            call_command("benchmark_profiles", *args, "--output", output, stdout=out)
+            with open(output) as file:
+                results = json.load(file)["results"]
+            self.assertEqual(
+                set(results),
+                {
+                    "serialize_profiles[rows=2]",
+                    "get_avatar_base64[size=300]",
+                    "file_to_base64[size=300]",
+                    "base64_to_file[size=300]",
+                    "resize_avatar[size=300]",
+                    "generate_avatar_derivatives[size=300]",
+                },
+            )
+            self.assertGreater(results["serialize_profiles[rows=2]"]["peak_kb"], 0)
+
+            results["file_to_base64[size=300]"]["ops_per_sec"] *= 1000
+            with open(output, "w") as file:
+                json.dump({"results": results}, file)
+            with self.assertRaisesMessage(CommandError, "file_to_base64[size=300]: "):
+                call_command("benchmark_profiles", *args, "--cases", "file_to_base64", "--baseline", output, stdout=out)
+
+
 class UploadAvatarViewTest(GlobalTestSetup):
     def setUp(self):
         super().setUp(url="upload-avatar", url_kwargs={"pk": 1})
@@ -284,14 +1052,25 @@ class UploadAvatarViewTest(GlobalTestSetup):
     def tearDown(self) -> None:
         profile = Profile.objects.get(user=self.user)
         if profile.avatar:
-            profile.avatar.delete(save=False)
+            remove_avatar(profile)
         super().tearDown()
 
     def test_upload_avatar(self):
         inject_token(self.client)
         response = self.client.patch(self.url, {"avatar": self.avatar}, format="multipart")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data["avatar"], "http://testserver/media/profile_avatars/reserved_test_image.png")
+        self.assertRegex(response.data["avatar"], r"^http://testserver/media/profile_avatars/[0-9a-f]{64}\.png$")
+        self.assertEqual(response.data["avatar_status"], Profile.AvatarStatus.READY)
+
+    @override_settings(AVATAR_PROCESSING_SYNC=False, AVATAR_WORKERS=1, AVATAR_QUEUE_SIZE=0)
+    def test_upload_avatar_when_queue_is_full(self):
+        inject_token(self.client)
+        with mock.patch("users.avatars._pending_jobs", 1):
+            response = self.client.patch(self.url, {"avatar": self.avatar}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response["Retry-After"], "5")
+        self.assertEqual(response.data["detail"].code, "avatar_busy")
+        self.assertFalse(Profile.objects.get(user=self.user).avatar)
 
     def test_upload_avatar_with_invalid_pk(self):
         inject_token(self.client)
@@ -311,7 +1090,193 @@ class UploadAvatarViewTest(GlobalTestSetup):
         response = self.client.patch(self.url, {"avatar": self.avatar}, format="multipart")
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
+    def test_upload_avatar_with_too_many_pixels(self):
+        inject_token(self.client)
+        with override_settings(AVATAR_MAX_PIXELS=50 * 50), mock.patch("users.avatars.process_avatar") as process:
+            response = self.client.patch(self.url, {"avatar": self.avatar}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("pixels", response.data["avatar"][0])
+        process.assert_not_called()
+
+    def test_upload_avatar_with_unsupported_format(self):
+        inject_token(self.client)
+        file = BytesIO()
+        Image.new("RGB", (10, 10)).save(file, "bmp")
+        avatar = SimpleUploadedFile(name="reserved_avatar.bmp", content=file.getvalue(), content_type="image/bmp")
+        response = self.client.patch(self.url, {"avatar": avatar}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_upload_avatar_with_invalid_avatar(self):
         inject_token(self.client)
         response = self.client.patch(self.url, {"avatar": "invalid_avatar"}, format="multipart")
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class Base64ToFileTest(TestCase):
+    def test_decodes_in_chunks_to_a_temporary_file(self):
+        content = os.urandom(3 * 1000)
+        data = "data:reserved_avatar/png;base64," + base64.b64encode(content).decode()
+        with mock.patch("utils.b64.BASE64_CHUNK_SIZE", 400):
+            file = base64_to_file(data)
+        self.assertEqual(file.name, "reserved_avatar.png")
+        self.assertEqual(file.size, len(content))
+        self.assertTrue(os.path.exists(file.temporary_file_path()))
+        self.assertEqual(file.read(), content)
+        file.close()
+
+    def test_rejects_files_over_the_limit(self):
+        data = "data:reserved_avatar/png;base64," + base64.b64encode(b"x" * 30).decode()
+        with self.assertRaises(ValueError):
+            base64_to_file(data, max_size=20)
+
+    def test_rejects_malformed_data(self):
+        with self.assertRaises(ValueError):
+            base64_to_file("reserved_avatar.png")
+
+
+class MediaServingTest(TestCase):
+    path = "profile_avatars/test_avatar_64.jpg"
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        with open(os.path.join(settings.MEDIA_ROOT, self.path), "rb") as file:
+            self.content = file.read()
+
+    def serve(self, **headers):
+        response = serve_media(self.factory.get(f"/media/{self.path}", **headers), self.path)
+        body = b"".join(response.streaming_content) if response.streaming else response.content
+        close_response(response)
+        return response, body
+
+    def test_full_file(self):
+        response, body = self.serve()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+        self.assertEqual(response["Content-Length"], str(len(self.content)))
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+
+    def test_conditional_request(self):
+        etag = self.serve()[0]["ETag"]
+        response, body = self.serve(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_byte_ranges(self):
+        response, body = self.serve(HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.content[10:20])
+        self.assertEqual(response["Content-Length"], "10")
+        self.assertEqual(response["Content-Range"], f"bytes 10-19/{len(self.content)}")
+
+        response, body = self.serve(HTTP_RANGE="bytes=-5")
+        self.assertEqual(body, self.content[-5:])
+
+        response, body = self.serve(HTTP_RANGE=f"bytes={len(self.content)}-")
+        self.assertEqual(response.status_code, 416)
+
+        # a stale If-Range gets the whole file
+        response, body = self.serve(HTTP_RANGE="bytes=10-19", HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+
+    @override_settings(MEDIA_SENDFILE_HEADER="X-Accel-Redirect", MEDIA_ACCEL_REDIRECT_PREFIX="/protected/")
+    def test_accel_redirect(self):
+        response, body = self.serve()
+        self.assertEqual(response["X-Accel-Redirect"], f"/protected/{self.path}")
+        self.assertEqual(body, b"")
+
+    def test_missing_file(self):
+        with self.assertRaises(Http404):
+            serve_media(self.factory.get("/media/../manage.py"), "../manage.py")
+
+    def test_handler_skips_middleware(self):
+        application = mock.Mock()
+        handler = MediaFilesHandler(application)
+        start_response = mock.Mock()
+        with mock.patch("django.middleware.security.SecurityMiddleware.process_request") as middleware:
+            body = b"".join(handler(self.factory.get(f"/media/{self.path}").environ, start_response))
+        self.assertEqual(body, self.content)
+        self.assertTrue(start_response.call_args[0][0].startswith("200"))
+        middleware.assert_not_called()
+        application.assert_not_called()
+
+        handler(self.factory.get("/api/v1/users/").environ, start_response)
+        application.assert_called_once()
+
+    def test_benchmark_command(self):
+        out = io.StringIO()
+        call_command("benchmark_media", "--requests", "2", "--path", self.path, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(
+            [line.split()[0] for line in lines], ["django.views.static.serve", "serve_media", "MediaFilesHandler"]
+        )
+
+
+class AvatarBase64CacheTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="test_user", password="test_password", email="test@test.com")
+        self.profile = self.user.profile
+        self.profile.avatar = SimpleUploadedFile(
+            name="reserved_cache_avatar.jpg",
+            content=open("media/profile_avatars/test_avatar_64.jpg", "rb").read(),
+            content_type="image/jpg",
+        )
+        self.profile.save()
+        base64_cache.clear()
+
+    def tearDown(self) -> None:
+        remove_avatar(self.profile)
+        super().tearDown()
+
+    def test_encoding_is_cached(self):
+        encoded = cached_file_to_base64(self.profile.avatar)
+        self.assertEqual(encoded, file_to_base64(self.profile.avatar))
+        self.assertEqual(cached_file_to_base64(self.profile.avatar), encoded)
+        self.assertEqual(base64_cache.hits, 1)
+        self.assertEqual(base64_cache.misses, 1)
+
+    def test_changed_file_is_reencoded(self):
+        cached_file_to_base64(self.profile.avatar)
+        with open(self.profile.avatar.path, "ab") as file:
+            file.write(b"\0")
+        encoded = cached_file_to_base64(self.profile.avatar)
+        self.assertEqual(encoded, file_to_base64(self.profile.avatar))
+        self.assertEqual(base64_cache.get(self.profile.avatar.name)[1], encoded)
+
+    def test_invalidate(self):
+        cached_file_to_base64(self.profile.avatar)
+        invalidate_base64(self.profile.avatar)
+        self.assertEqual(len(base64_cache), 0)
+
+    def test_removing_avatar_invalidates(self):
+        cached_file_to_base64(self.profile.avatar)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.patch(
+            reverse("user-detail", kwargs={"pk": self.profile.pk}), {"avatar_base_64": ""}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(base64_cache), 0)
+
+
+class LRUCacheTest(TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(10, get_size=len)
+        cache.set("a", "aaaa")
+        cache.set("b", "bbbb")
+        cache.get("a")
+        cache.set("c", "cccc")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "aaaa")
+        self.assertEqual(cache.size, 8)
+
+    def test_skips_values_over_budget(self):
+        cache = LRUCache(3, get_size=len)
+        cache.set("a", "aaaa")
+        self.assertEqual(len(cache), 0)
+
+    def test_ttl(self):
+        cache = LRUCache(10, ttl=-1)
+        cache.set("a", 1)
+        self.assertIsNone(cache.get("a"))
@@ -1,10 +1,19 @@
 from django.urls import path
 
-from users.views import UserListView, UserDetailView, UploadAvatarView, InitializeUsersView
+from users.views import (
+    UserListView,
+    UserDetailView,
+    UploadAvatarView,
+    BulkUserView,
+    ExportUsersView,
+    InitializeUsersView,
+)
 
 urlpatterns = [
     path("", UserListView.as_view(), name="user-list"),
     path("<int:pk>/", UserDetailView.as_view(), name="user-detail"),
     path("<int:pk>/upload-avatar/", UploadAvatarView.as_view(), name="upload-avatar"),
+    path("bulk/", BulkUserView.as_view(), name="user-bulk"),
+    path("export/", ExportUsersView.as_view(), name="export-users"),
     path("initialize-users/", InitializeUsersView.as_view(), name="initialize-users"),
 ]
@@ -1,45 +1,100 @@
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import IntegrityError
+from django.http import StreamingHttpResponse
+from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import generics, status, permissions
 from rest_framework.response import Response
 from init_users import init_users
 
+from users.bulk import (
+    TooManyUsers,
+    bulk_create_users,
+    bulk_delete_users,
+    bulk_update_items,
+    bulk_update_users,
+    get_bulk_queryset,
+)
+from users.export import EXPORT_FORMATS, export_users
+from users.filters import ProfileFilter, profile_filter_parameters
 from users.models import Profile
-from users.serializers import ProfileSerializer, AvatarSerializer
+from users.serializers import (
+    ProfileSerializer,
+    AvatarSerializer,
+    BulkProfileSerializer,
+    BulkSelectionSerializer,
+    BulkUpdateSerializer,
+    BulkUpdateItemSerializer,
+)
 
-from utils.b64 import base64_to_file
+from utils.b64 import base64_to_file, invalidate_base64
+from utils.conditional import conditional_get
+from utils.pagination import KeysetPagination
+from utils.queries import QueryShapingMixin
+from utils.serializers import sparse_fields_parameters
 
 
-class UserListView(generics.ListCreateAPIView):
+class UserListView(QueryShapingMixin, generics.ListCreateAPIView):
     queryset = Profile.objects.all()
     serializer_class = ProfileSerializer
+    pagination_class = KeysetPagination
+    filter_backends = [ProfileFilter]
+    ordering = "id"
+    ordering_fields = ("id",)
 
-    @swagger_auto_schema(tags=["Users"], operation_summary="Get all users")
+    @swagger_auto_schema(
+        tags=["Users"],
+        operation_summary="Get all users",
+        manual_parameters=[
+            openapi.Parameter("ordering", openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=["id", "-id"]),
+            openapi.Parameter("count", openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=["exact", "estimate"]),
+            *profile_filter_parameters,
+            *sparse_fields_parameters,
+        ],
+    )
+    @conditional_get
     def get(self, request, *args, **kwargs):
         return self.list(request, *args, **kwargs)
 
+    def get_version(self, request, *args, **kwargs):
+        if request.query_params.get(self.paginator.count_query_param):
+            # the total changes with rows outside the page, it is computed with the response instead
+            return None
+        # the keys of the requested page only, seeking by the same index the page itself is read with. Its ids
+        # catch deletions and inserts, which the latest change alone would not, so there is no Last-Modified
+        rows = self.paginator.paginate_queryset(
+            self.filter_queryset(self.get_queryset()).values("id", "updated_at"), request, view=self
+        )
+        latest = max((row["updated_at"] for row in rows), default=None)
+        return f"{','.join(str(row['id']) for row in rows)}|{latest}", None
+
     @swagger_auto_schema(tags=["Users"], operation_summary="Create a new user")
     def post(self, request, *args, **kwargs):
         if request.user.is_staff:
-            user = request.data.get("user", {})
-            username = user.get("username", "")
-            if User.objects.filter(username=username).exists():
+            try:
+                return self.create(request, *args, **kwargs)
+            except IntegrityError:
                 return Response({"detail": "User already exists"}, status=status.HTTP_409_CONFLICT)
-            return self.create(request, *args, **kwargs)
         return Response(
             {"detail": "You do not have permission to perform this action"}, status=status.HTTP_403_FORBIDDEN
         )
 
 
-class UserDetailView(generics.RetrieveUpdateDestroyAPIView):
+class UserDetailView(QueryShapingMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Profile.objects.all()
     serializer_class = ProfileSerializer
     http_method_names = ["get", "patch", "delete"]
 
-    @swagger_auto_schema(tags=["Users"], operation_summary="Get a user")
+    @swagger_auto_schema(tags=["Users"], operation_summary="Get a user", manual_parameters=sparse_fields_parameters)
+    @conditional_get
     def get(self, request, *args, **kwargs):
         return self.retrieve(request, *args, **kwargs)
 
+    def get_version(self, request, *args, **kwargs):
+        updated_at = Profile.objects.filter(pk=kwargs["pk"]).values_list("updated_at", flat=True).first()
+        return (updated_at.isoformat(), updated_at) if updated_at else None
+
     @swagger_auto_schema(tags=["Users"], operation_summary="Update a user")
     def patch(self, request, *args, **kwargs):
         user = User.objects.filter(pk=kwargs.get("pk")).first()
@@ -53,13 +108,25 @@ class UserDetailView(generics.RetrieveUpdateDestroyAPIView):
             return Response({"detail": "User does not exist"}, status=status.HTTP_404_NOT_FOUND)
         if request.user.is_staff or request.user == user:
             avatar_base_64 = request.data.get("avatar_base_64", "")
+            avatar = None
             if avatar_base_64 is not None:
+                invalidate_base64(user.profile.avatar)
                 if len(avatar_base_64) == 0:
                     user.profile.avatar = None
-                    user.save()
+                    user.profile.save()
                 else:
-                    request.data["avatar"] = base64_to_file(avatar_base_64)
-            return self.partial_update(request, *args, **kwargs)
+                    try:
+                        avatar = request.data["avatar"] = base64_to_file(avatar_base_64)
+                    except ValueError as e:
+                        return Response({"avatar_base_64": [str(e)]}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                return self.partial_update(request, *args, **kwargs)
+            except IntegrityError:
+                return Response({"detail": "User already exists"}, status=status.HTTP_409_CONFLICT)
+            finally:
+                # the decoded temporary file, like uploaded files, only lives for the request
+                if avatar is not None:
+                    avatar.close()
         return Response(
             {"detail": "You do not have permission to perform this action"}, status=status.HTTP_403_FORBIDDEN
         )
@@ -72,7 +139,6 @@ class UserDetailView(generics.RetrieveUpdateDestroyAPIView):
                 return Response({"detail": "User does not exist"}, status=status.HTTP_404_NOT_FOUND)
             if user == request.user:
                 return Response({"detail": "You cannot delete yourself"}, status=status.HTTP_400_BAD_REQUEST)
-            user.profile.avatar.delete()
             user.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(
@@ -92,12 +158,138 @@ class UploadAvatarView(generics.UpdateAPIView):
             if user is None:
                 return Response({"detail": "User does not exist"}, status=status.HTTP_404_NOT_FOUND)
             if request.user.is_staff or request.user == user:
+                invalidate_base64(user.profile.avatar)
                 return self.partial_update(request, *args, **kwargs)
         return Response(
             {"detail": "You do not have permission to perform this action"}, status=status.HTTP_403_FORBIDDEN
         )
 
 
+class BulkUserView(generics.GenericAPIView):
+    serializer_class = BulkProfileSerializer
+
+    @swagger_auto_schema(
+        tags=["Users"], operation_summary="Create many users", request_body=BulkProfileSerializer(many=True)
+    )
+    def post(self, request, *args, **kwargs):
+        if request.user.is_staff:
+            if not isinstance(request.data, list):
+                return Response({"detail": "Expected a list of users"}, status=status.HTTP_400_BAD_REQUEST)
+            if len(request.data) > settings.USERS_BULK_MAX_ITEMS:
+                return Response(
+                    {"detail": f"At most {settings.USERS_BULK_MAX_ITEMS} users can be created at once"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+            results, valid_items, valid_indexes = [None] * len(request.data), [], []
+            for index, item in enumerate(request.data):
+                serializer = self.get_serializer(data=item)
+                if serializer.is_valid():
+                    valid_items.append(serializer.validated_data)
+                    valid_indexes.append(index)
+                else:
+                    results[index] = {
+                        "index": index,
+                        "status": status.HTTP_400_BAD_REQUEST,
+                        "errors": serializer.errors,
+                    }
+            for index, result in zip(valid_indexes, bulk_create_users(valid_items)):
+                results[index] = {**result, "index": index}
+
+            all_created = all(result["status"] == status.HTTP_201_CREATED for result in results)
+            return Response(
+                {"results": results}, status=status.HTTP_201_CREATED if all_created else status.HTTP_207_MULTI_STATUS
+            )
+        return Response(
+            {"detail": "You do not have permission to perform this action"}, status=status.HTTP_403_FORBIDDEN
+        )
+
+    @swagger_auto_schema(
+        tags=["Users"],
+        operation_summary="Update many users",
+        operation_description="Send the same `changes` for users picked with `ids` or a `filter`, "
+        "or a list of users with their own changes and `id`.",
+        request_body=BulkUpdateSerializer,
+    )
+    def patch(self, request, *args, **kwargs):
+        if request.user.is_staff:
+            if isinstance(request.data, list):
+                if len(request.data) > settings.USERS_BULK_MAX_ITEMS:
+                    return Response(
+                        {"detail": f"At most {settings.USERS_BULK_MAX_ITEMS} users can be updated at once"},
+                        status=status.HTTP_400_BAD_REQUEST,
+                    )
+                serializer = BulkUpdateItemSerializer(data=request.data, many=True)
+                serializer.is_valid(raise_exception=True)
+                ids = bulk_update_items(serializer.validated_data)
+            else:
+                serializer = BulkUpdateSerializer(data=request.data)
+                serializer.is_valid(raise_exception=True)
+                try:
+                    ids = bulk_update_users(
+                        get_bulk_queryset(serializer.validated_data), serializer.validated_data["changes"]
+                    )
+                except TooManyUsers:
+                    return Response(
+                        {"detail": f"At most {settings.USERS_BULK_MAX_ITEMS} users can be updated at once"},
+                        status=status.HTTP_400_BAD_REQUEST,
+                    )
+            return Response({"updated": len(ids), "ids": ids}, status=status.HTTP_200_OK)
+        return Response(
+            {"detail": "You do not have permission to perform this action"}, status=status.HTTP_403_FORBIDDEN
+        )
+
+    @swagger_auto_schema(tags=["Users"], operation_summary="Delete many users", request_body=BulkSelectionSerializer)
+    def delete(self, request, *args, **kwargs):
+        if request.user.is_staff:
+            serializer = BulkSelectionSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            queryset = get_bulk_queryset(serializer.validated_data)
+            if queryset.filter(user=request.user).exists():
+                return Response({"detail": "You cannot delete yourself"}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                deleted = bulk_delete_users(queryset)
+            except TooManyUsers:
+                return Response(
+                    {"detail": f"At most {settings.USERS_BULK_MAX_ITEMS} users can be deleted at once"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            return Response({"deleted": deleted}, status=status.HTTP_200_OK)
+        return Response(
+            {"detail": "You do not have permission to perform this action"}, status=status.HTTP_403_FORBIDDEN
+        )
+
+
+class ExportUsersView(generics.GenericAPIView):
+    @swagger_auto_schema(
+        tags=["Users"],
+        operation_summary="Export all users",
+        manual_parameters=[
+            openapi.Parameter("output", openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=list(EXPORT_FORMATS)),
+            openapi.Parameter("avatars", openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN),
+        ],
+        responses={
+            200: openapi.Response("One user per NDJSON line or CSV row", schema=openapi.Schema(type=openapi.TYPE_FILE))
+        },
+    )
+    def get(self, request, *args, **kwargs):
+        if request.user.is_staff:
+            export_format = request.query_params.get("output", "ndjson")
+            if export_format not in EXPORT_FORMATS:
+                return Response({"detail": "Unsupported export format"}, status=status.HTTP_400_BAD_REQUEST)
+            include_avatars = request.query_params.get("avatars", "").lower() in ("1", "true")
+
+            response = StreamingHttpResponse(
+                export_users(export_format, include_avatars, context={"request": request}),
+                content_type=EXPORT_FORMATS[export_format],
+            )
+            response["Content-Disposition"] = f'attachment; filename="users.{export_format}"'
+            return response
+        return Response(
+            {"detail": "You do not have permission to perform this action"}, status=status.HTTP_403_FORBIDDEN
+        )
+
+
 class InitializeUsersView(generics.GenericAPIView):
     permission_classes = [permissions.AllowAny]
 
@@ -1,14 +1,54 @@
 import base64
+import os
 
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadedfile import TemporaryUploadedFile
 
+from utils.cache import LRUCache
 
-def base64_to_file(data, name=None):
-    _format, _img_str = data.split(";base64,")
-    _name, ext = _format.split("/")
+# Encoded avatars, keyed by storage name and stamped with the file's size and mtime
+base64_cache = LRUCache(settings.AVATAR_BASE64_CACHE_MAX_BYTES, get_size=lambda entry: len(entry[1]))
+
+
+# decoded in slices of this many characters, a multiple of 4 so every slice is valid base64
+BASE64_CHUNK_SIZE = 64 * 1024
+
+
+def base64_to_file(data, name=None, max_size=None):
+    """
+    Decode a `data:<name>/<ext>;base64,...` string into a temporary file.
+
+    The payload is decoded in chunks straight to disk, so no decoded copy of the
+    whole file is held in memory. Raises `ValueError` for malformed data or when
+    the decoded file would be larger than `max_size` bytes
+    (`AVATAR_MAX_UPLOAD_SIZE` by default).
+    """
+    max_size = settings.AVATAR_MAX_UPLOAD_SIZE if max_size is None else max_size
+    start = data.find(";base64,")
+    if start == -1:
+        raise ValueError("Expected a base64 data URI")
+    _name, _sep, ext = data[:start].partition("/")
+    if not ext:
+        raise ValueError("Expected a base64 data URI")
     if not name:
         name = _name.split(":")[-1]
-    return ContentFile(base64.b64decode(_img_str), name=f"{name}.{ext}")
+
+    start += len(";base64,")
+    size = (len(data) - start) // 4 * 3
+    if size > max_size:
+        raise ValueError(f"The file is larger than {max_size} bytes")
+
+    file = TemporaryUploadedFile(f"{name}.{ext}", f"image/{ext}", size, None)
+    try:
+        for offset in range(start, len(data), BASE64_CHUNK_SIZE):
+            file.write(base64.b64decode(data[offset : offset + BASE64_CHUNK_SIZE], validate=True))
+    except ValueError:
+        file.close()
+        raise
+    file.size = file.tell()
+    file.seek(0)
+    return file
 
 
 def file_to_base64(file):
@@ -16,3 +56,46 @@ def file_to_base64(file):
         encoded_string = base64.b64encode(image_file.read()).decode("utf-8")
     encoded_string = f"data:image/{file.name.split('.')[-1]};base64,{encoded_string}"
     return encoded_string
+
+
+def _shared_base64_cache():
+    alias = settings.AVATAR_BASE64_CACHE_ALIAS
+    return caches[alias] if alias else None
+
+
+def cached_file_to_base64(file):
+    """
+    `file_to_base64` behind the in-process LRU and, when
+    `AVATAR_BASE64_CACHE_ALIAS` names a cache, a cache shared by all workers.
+    Entries are only reused while the file's size and mtime are unchanged.
+    """
+    stat = os.stat(file.path)
+    stamp = (stat.st_size, stat.st_mtime_ns)
+
+    entry = base64_cache.get(file.name)
+    if entry is not None and entry[0] == stamp:
+        return entry[1]
+
+    shared_cache = _shared_base64_cache()
+    if shared_cache is not None:
+        entry = shared_cache.get(f"b64:{file.name}")
+        if entry is not None and tuple(entry[0]) == stamp:
+            base64_cache.set(file.name, entry)
+            return entry[1]
+
+    entry = (stamp, file_to_base64(file))
+    base64_cache.set(file.name, entry)
+    if shared_cache is not None:
+        shared_cache.set(f"b64:{file.name}", entry)
+    return entry[1]
+
+
+def invalidate_base64(file):
+    """Drop the cached encoding of a file (or storage name) being replaced or deleted."""
+    name = getattr(file, "name", file)
+    if not name:
+        return
+    base64_cache.delete(name)
+    shared_cache = _shared_base64_cache()
+    if shared_cache is not None:
+        shared_cache.delete(f"b64:{name}")
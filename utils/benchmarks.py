@@ -0,0 +1,68 @@
+import gc
+import time
+import tracemalloc
+
+
+def measure(fn, repeat=3, min_time=0.2):
+    """
+    Time `fn()` and record its memory use.
+
+    The call is looped until a round takes `min_time` seconds and the best of
+    `repeat` rounds is kept. Allocations are traced by `tracemalloc` over one
+    separate call, as tracing slows the code down: `peak_kb` is the most memory
+    the call held at once and `retained_kb` what it left allocated.
+    """
+    fn()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, time.perf_counter() - start)
+
+    # garbage of the timed rounds, and of the traced call, would count as allocations
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        fn()
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "ops_per_sec": round(number / best, 2),
+        "us_per_op": round(best / number * 1000000, 3),
+        "peak_kb": round((peak - before) / 1024, 1),
+        "retained_kb": round((current - before) / 1024, 1),
+    }
+
+
+def find_regressions(results, baseline, tolerance):
+    """
+    Compare `{case: measurement}` results with a stored baseline of the same
+    shape and describe every case that got more than `tolerance` (a fraction)
+    slower or whose peak memory grew by more than that. Cases missing from the
+    baseline are skipped.
+    """
+    regressions = []
+    for case, result in results.items():
+        previous = baseline.get(case)
+        if previous is None:
+            continue
+        if result["ops_per_sec"] < previous["ops_per_sec"] * (1 - tolerance):
+            regressions.append(f"{case}: {result['ops_per_sec']:.1f} ops/s, baseline {previous['ops_per_sec']:.1f}")
+        # a kilobyte of slack, small peaks vary with what the interpreter had cached
+        if result["peak_kb"] > previous["peak_kb"] * (1 + tolerance) + 1:
+            regressions.append(f"{case}: peak {result['peak_kb']:.1f} KB, baseline {previous['peak_kb']:.1f} KB")
+    return regressions
@@ -0,0 +1,41 @@
+import hashlib
+from functools import wraps
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def conditional_get(method):
+    """
+    Decorate a view's `get` to answer `If-None-Match` / `If-Modified-Since`
+    with 304 before any serialization happens.
+
+    The view's `get_version(request, *args, **kwargs)` returns a
+    `(version, last_modified)` pair, where `last_modified` may be None, or None
+    to skip the check (e.g. when the resource does not exist). The strong ETag
+    combines the version with the requested URL and user, since both change
+    the representation.
+    """
+
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        version = self.get_version(request, *args, **kwargs)
+        if version is None:
+            return method(self, request, *args, **kwargs)
+
+        version, last_modified = version
+        etag = quote_etag(
+            hashlib.sha1(f"{request.build_absolute_uri()}|{request.user.pk}|{version}".encode()).hexdigest()
+        )
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = method(self, request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response.headers["ETag"] = etag
+            if timestamp is not None:
+                response.headers["Last-Modified"] = http_date(timestamp)
+        return response
+
+    return wrapper
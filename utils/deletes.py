@@ -0,0 +1,48 @@
+import contextvars
+import weakref
+from contextlib import contextmanager
+
+from django.db import transaction
+
+_handled = contextvars.ContextVar("deletes_handled", default=False)
+
+# origin queryset -> {flush: values gathered from its rows}
+_pending = weakref.WeakKeyDictionary()
+
+
+@contextmanager
+def deletes_handled():
+    """
+    Tell the `post_delete` receivers using `deletes_are_handled` that the caller
+    cleans up after the deletes made in this block itself, as the bulk delete
+    endpoint does in a few statements.
+    """
+    token = _handled.set(True)
+    try:
+        yield
+    finally:
+        _handled.reset(token)
+
+
+def deletes_are_handled():
+    return _handled.get()
+
+
+def collect_until_commit(origin, flush, value):
+    """
+    Gather `value` from every row removed by the queryset delete `origin` and
+    call `flush(values)` once with all of them after the delete commits, instead
+    of once per row. Nothing is flushed when the delete is rolled back.
+    """
+    pending = _pending.setdefault(origin, {})
+    values = pending.get(flush)
+    if values is None:
+        values = pending[flush] = []
+
+        def run():
+            # a later delete of the same queryset gathers its own values
+            _pending.get(origin, {}).pop(flush, None)
+            flush(values)
+
+        transaction.on_commit(run)
+    values.append(value)
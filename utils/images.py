@@ -0,0 +1,31 @@
+from PIL import Image
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+
+def validate_image(file):
+    """
+    Check an uploaded image's format and pixel dimensions from its header.
+
+    Only the header is parsed, so oversized images and decompression bombs are
+    rejected before any pixel data is decoded. The limits are the
+    `AVATAR_ALLOWED_FORMATS`, `AVATAR_MAX_UPLOAD_SIZE` and `AVATAR_MAX_PIXELS`
+    settings.
+    """
+    if file.size is not None and file.size > settings.AVATAR_MAX_UPLOAD_SIZE:
+        raise ValidationError(f"The image is larger than {settings.AVATAR_MAX_UPLOAD_SIZE} bytes.")
+
+    position = file.tell()
+    try:
+        file.seek(0)
+        with Image.open(file) as img:
+            image_format, (width, height) = img.format, img.size
+    except (OSError, Image.DecompressionBombError):
+        raise ValidationError("Upload a valid image.")
+    finally:
+        file.seek(position)
+
+    if image_format not in settings.AVATAR_ALLOWED_FORMATS:
+        raise ValidationError(f"Unsupported image format {image_format}.")
+    if width * height > settings.AVATAR_MAX_PIXELS:
+        raise ValidationError(f"The image is larger than {settings.AVATAR_MAX_PIXELS} pixels.")
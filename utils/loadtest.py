@@ -0,0 +1,205 @@
+import asyncio
+import contextvars
+import math
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import RequestFactory
+
+# queries of the request running in this context, a one item list shared with the
+# threads `sync_to_async` runs views on
+_query_count = contextvars.ContextVar("loadtest_query_count", default=None)
+
+
+@dataclass
+class LoadRequest:
+    method: str
+    path: str
+    body: bytes = b""
+    headers: dict = field(default_factory=dict)
+
+
+def _count_queries(execute, sql, params, many, context):
+    count = _query_count.get()
+    if count is not None:
+        count[0] += 1
+    return execute(sql, params, many, context)
+
+
+def _install_query_counter(connection, **kwargs):
+    if _count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_queries)
+
+
+# connections of request threads are opened after the counter is first needed
+connection_created.connect(_install_query_counter, dispatch_uid="loadtest_query_counter")
+
+
+def wsgi_environ(request):
+    headers = {"HTTP_" + name.upper().replace("-", "_"): value for name, value in request.headers.items()}
+    content_type = headers.pop("HTTP_CONTENT_TYPE", "application/octet-stream")
+    return RequestFactory().generic(request.method, request.path, request.body, content_type, **headers).environ
+
+
+def asgi_scope(request):
+    url = urlsplit(request.path)
+    headers = [(b"host", b"testserver")]
+    headers += [(name.lower().encode(), value.encode()) for name, value in request.headers.items()]
+    headers.append((b"content-length", str(len(request.body)).encode()))
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": request.method,
+        "scheme": "http",
+        "path": url.path,
+        "raw_path": url.path.encode(),
+        "query_string": url.query.encode(),
+        "root_path": "",
+        "headers": headers,
+        "client": ("127.0.0.1", 0),
+        "server": ("testserver", 80),
+    }
+
+
+def call_wsgi(application, request):
+    """Send `request` through a WSGI application and return its status code and the queries it ran."""
+    statuses = []
+    count = [0]
+    token = _query_count.set(count)
+    try:
+        response = application(wsgi_environ(request), lambda status, headers, exc_info=None: statuses.append(status))
+        for _chunk in response:
+            pass
+        response.close()
+    finally:
+        _query_count.reset(token)
+    return int(statuses[0].split()[0]), count[0]
+
+
+async def call_asgi(application, request):
+    """Send `request` through an ASGI application and return its status code and the queries it ran."""
+    response = {}
+    done = asyncio.Event()
+    count = [0]
+    _query_count.set(count)
+    body_sent = False
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": request.body, "more_body": False}
+        # the client stays connected until the whole response is sent
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body" and not message.get("more_body"):
+            done.set()
+
+    await application(asgi_scope(request), receive, send)
+    return response["status"], count[0]
+
+
+@dataclass
+class Sample:
+    status: int
+    seconds: float
+    queries: int
+
+
+def _install_counters():
+    for connection in connections.all():
+        _install_query_counter(connection)
+
+
+def run_wsgi(application, make_request, requests, clients):
+    """
+    Send `requests` requests, `make_request(i)` for the i-th, from `clients`
+    threads and return their samples and the wall clock seconds taken.
+    """
+    _install_counters()
+
+    def timed(index):
+        request = make_request(index)
+        start = time.perf_counter()
+        status, queries = call_wsgi(application, request)
+        return Sample(status, time.perf_counter() - start, queries)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        samples = list(pool.map(timed, range(requests)))
+    return samples, time.perf_counter() - start
+
+
+def run_asgi(application, make_request, requests, clients):
+    """Like `run_wsgi`, with `clients` concurrent connections to one event loop."""
+    _install_counters()
+
+    async def timed(index, slots):
+        async with slots:
+            request = make_request(index)
+            start = time.perf_counter()
+            status, queries = await call_asgi(application, request)
+            return Sample(status, time.perf_counter() - start, queries)
+
+    async def main():
+        slots = asyncio.Semaphore(clients)
+        return await asyncio.gather(*(timed(index, slots) for index in range(requests)))
+
+    start = time.perf_counter()
+    samples = asyncio.run(main())
+    return samples, time.perf_counter() - start
+
+
+def percentile(values, p):
+    """Nearest rank percentile of sorted `values`."""
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(sample.seconds * 1000 for sample in samples)
+    queries = [sample.queries for sample in samples]
+    return {
+        "requests": len(samples),
+        "statuses": {str(code): count for code, count in sorted(Counter(s.status for s in samples).items())},
+        "throughput": round(len(samples) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "queries_min": min(queries),
+        "queries_max": max(queries),
+        "queries_mean": round(sum(queries) / len(queries), 2),
+    }
+
+
+def find_regressions(results, baseline, latency_tolerance):
+    """
+    Compare `{interface: {endpoint: summary}}` results with a stored baseline of
+    the same shape and describe every regression: more queries per request than
+    the baseline's maximum, or a p95 latency more than `latency_tolerance`
+    (a fraction) above its p95. Endpoints missing from the baseline are skipped.
+    """
+    regressions = []
+    for interface, endpoints in results.items():
+        for endpoint, summary in endpoints.items():
+            budget = baseline.get(interface, {}).get(endpoint)
+            if budget is None:
+                continue
+            name = f"{interface} {endpoint}"
+            if summary["queries_max"] > budget["queries_max"]:
+                regressions.append(
+                    f"{name}: {summary['queries_max']} queries per request, budget {budget['queries_max']}"
+                )
+            limit = budget["p95_ms"] * (1 + latency_tolerance)
+            if summary["p95_ms"] > limit:
+                regressions.append(f"{name}: p95 {summary['p95_ms']:.1f} ms, threshold {limit:.1f} ms")
+    return regressions
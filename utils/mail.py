@@ -2,10 +2,11 @@ from django.contrib.auth.tokens import default_token_generator
 from django.core.mail import send_mail, EmailMessage
 from django.template.loader import render_to_string
 
+from account.outbox import queue_emails
 from config import settings
 
 
-def send_set_password_email(user):
+def build_set_password_email(user):
     token = default_token_generator.make_token(user)
     set_password_url = settings.FRONTEND_URL + "?token=" + token + "&email=" + user.email
     context = {
@@ -21,4 +22,13 @@ def send_set_password_email(user):
         to=[user.email],
     )
     email.content_subtype = "html"
-    email.send()
+    return email
+
+
+def send_set_password_email(user):
+    queue_emails([build_set_password_email(user)])
+
+
+def send_set_password_emails(users):
+    """Queue the set password emails of many users with a single insert."""
+    queue_emails([build_set_password_email(user) for user in users])
@@ -0,0 +1,183 @@
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.contrib.staticfiles.handlers import StaticFilesHandler
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotAllowed
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from utils.storage import HashedFileSystemStorage
+
+# content addressed files never change, so they can be cached for a year
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+# servers without sendfile stream the file in blocks of this size
+BLOCK_SIZE = 256 * 1024
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+class FileRange:
+    """
+    A window of `length` bytes of an open file starting at `start`.
+
+    It keeps `fileno()` and `tell()` so WSGI servers with a `wsgi.file_wrapper`
+    (e.g. gunicorn) can still hand the range to `os.sendfile` bounded by
+    `Content-Length`, while everyone else reads it block by block.
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.name = file.name
+        self.remaining = length
+        file.seek(start)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+def parse_byte_range(header, size):
+    """
+    Return the inclusive `(start, end)` of a single `Range: bytes=...` header,
+    or None when the header should be ignored (missing, malformed or several
+    ranges, which are served as the full file).
+    """
+    match = RANGE_RE.match(header or "")
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # suffix range, the last `last` bytes
+        if int(last) == 0:
+            raise RangeNotSatisfiable
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable
+    return start, end
+
+
+def get_file_etag(path, stat):
+    name = os.path.basename(path)
+    if HashedFileSystemStorage.is_immutable(name):
+        return quote_etag(os.path.splitext(name)[0])
+    return quote_etag(f"{stat.st_size:x}-{stat.st_mtime_ns:x}")
+
+
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if not if_range:
+        return True
+    if if_range.startswith(('"', "W/")):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """
+    Serve a media file with ETag / Last-Modified validation and single byte
+    ranges.
+
+    Files are sent as `FileResponse`s, which WSGI servers providing
+    `wsgi.file_wrapper` transfer with `os.sendfile`. With
+    `MEDIA_SENDFILE_HEADER` set to `X-Accel-Redirect` (nginx) or `X-Sendfile`
+    (apache, lighttpd) only the headers are produced and the front proxy sends
+    the file itself. `show_indexes` is accepted for `static()` but not supported.
+    """
+    if request.method not in ("GET", "HEAD"):
+        return HttpResponseNotAllowed(["GET", "HEAD"])
+
+    path = posixpath.normpath(path).lstrip("/")
+    try:
+        full_path = safe_join(document_root or settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404("File does not exist")
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404("File does not exist")
+    if not os.path.isfile(full_path):
+        raise Http404("File does not exist")
+
+    etag = get_file_etag(full_path, stat)
+    last_modified = int(stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+    if response is None:
+        content_type, encoding = mimetypes.guess_type(full_path)
+        content_type = content_type or "application/octet-stream"
+        sendfile_header = settings.MEDIA_SENDFILE_HEADER
+        if sendfile_header:
+            response = HttpResponse(content_type=content_type)
+            if sendfile_header == "X-Accel-Redirect":
+                response[sendfile_header] = quote(settings.MEDIA_ACCEL_REDIRECT_PREFIX + path)
+            else:
+                response[sendfile_header] = full_path
+        else:
+            try:
+                byte_range = parse_byte_range(request.META.get("HTTP_RANGE"), stat.st_size)
+            except RangeNotSatisfiable:
+                response = HttpResponse(status=416)
+                response["Content-Range"] = f"bytes */{stat.st_size}"
+                return response
+            if byte_range is not None and not _if_range_matches(request, etag, last_modified):
+                byte_range = None
+
+            file = open(full_path, "rb")
+            if byte_range is None:
+                response = FileResponse(file, content_type=content_type)
+            else:
+                start, end = byte_range
+                response = FileResponse(FileRange(file, start, end - start + 1), content_type=content_type)
+                response.status_code = 206
+                response["Content-Length"] = end - start + 1
+                response["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+            response.block_size = BLOCK_SIZE
+            response["Accept-Ranges"] = "bytes"
+        if encoding:
+            response["Content-Encoding"] = encoding
+
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    if HashedFileSystemStorage.is_immutable(path):
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    return response
+
+
+class MediaFilesHandler(StaticFilesHandler):
+    """
+    WSGI middleware answering requests under `MEDIA_URL` with `serve_media`
+    before they reach Django's middleware stack and URL resolver. Everything
+    else is passed on to the wrapped application.
+    """
+
+    def get_base_url(self):
+        return settings.MEDIA_URL
+
+    def serve(self, request):
+        return serve_media(request, self.file_path(request.path))
@@ -0,0 +1,74 @@
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+
+
+def get_query_plan(serializer, model=None):
+    """
+    Walk the fields a serializer will render and return the `select_related`
+    and `only()` lookups needed to render them without extra queries.
+
+    Nested serializers backed by a forward relation are joined, plain fields
+    are loaded by their source and a `SerializerMethodField` declares what it
+    reads in `Meta.method_field_sources`. `only` is None when a field cannot be
+    mapped to columns, in which case nothing should be deferred.
+    """
+    serializer = getattr(serializer, "child", serializer)
+    model = model or serializer.Meta.model
+    method_field_sources = getattr(serializer.Meta, "method_field_sources", {})
+
+    select_related, only = [], {model._meta.pk.name}
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+
+        if isinstance(field, serializers.SerializerMethodField):
+            sources = method_field_sources.get(name)
+        elif field.source != "*":
+            sources = [field.source.replace(".", "__")]
+        else:
+            sources = None
+        if sources is None:
+            only = None
+            continue
+
+        for source in sources:
+            lookup, *path = source.split("__")
+            try:
+                model_field = model._meta.get_field(lookup)
+            except FieldDoesNotExist:
+                model_field = None
+            if model_field is None or not model_field.concrete:
+                # properties and reverse relations, we cannot tell what they read
+                only = None
+                continue
+
+            if isinstance(field, serializers.BaseSerializer) and model_field.is_relation:
+                related_select, related_only = get_query_plan(field, model_field.related_model)
+                select_related += [lookup, *(f"{lookup}__{related}" for related in related_select)]
+                if only is not None and related_only is not None:
+                    only |= {f"{lookup}__{related}" for related in related_only}
+            elif path and model_field.is_relation:
+                select_related.append("__".join([lookup, *path[:-1]]))
+                if only is not None:
+                    only.add(source)
+
+            if only is not None:
+                only.add(lookup)
+
+    return select_related, only
+
+
+class QueryShapingMixin:
+    """
+    Shape the view's queryset after the serializer that renders it so the
+    number of queries stays the same however many rows are returned.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        select_related, only = get_query_plan(self.get_serializer())
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if only is not None and self.request.method in ("GET", "HEAD"):
+            queryset = queryset.only(*only)
+        return queryset
@@ -0,0 +1,157 @@
+import hashlib
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+    import mmap
+except ImportError:  # pragma: no cover - windows
+    fcntl = None
+
+# key hash, tokens left, last update and the time the bucket is full again
+SLOT = struct.Struct("<Qddd")
+# slots looked at from the home slot of a key before the oldest one is taken over
+PROBES = 8
+# full buckets are dropped from `LocalTokenBuckets` once it holds this many
+LOCAL_MAX_BUCKETS = 100000
+
+
+def _key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+
+
+def _refill(tokens, updated, now, rate, capacity):
+    return min(capacity, tokens + (now - updated) * rate)
+
+
+def _take(tokens, now, rate, capacity, cost):
+    """Return the tokens left, the seconds to wait (0 when allowed) and the time the bucket is full again."""
+    if tokens >= cost:
+        tokens -= cost
+        wait = 0.0
+    else:
+        wait = (cost - tokens) / rate
+    return tokens, wait, now + (capacity - tokens) / rate
+
+
+class LocalTokenBuckets:
+    """Token buckets in a dict, for one process. Used where `MappedTokenBuckets` cannot be."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def consume(self, key, rate, capacity, cost=1):
+        now = time.time()
+        with self._lock:
+            tokens, updated, _full_at = self._buckets.get(key, (capacity, now, now))
+            tokens, wait, full_at = _take(_refill(tokens, updated, now, rate, capacity), now, rate, capacity, cost)
+            if full_at > now:
+                self._buckets[key] = (tokens, now, full_at)
+            else:
+                self._buckets.pop(key, None)
+            if len(self._buckets) > LOCAL_MAX_BUCKETS:
+                self._buckets = {k: v for k, v in self._buckets.items() if v[2] > now}
+        return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class MappedTokenBuckets:
+    """
+    Token buckets in a fixed size hash table of `slots` entries, memory mapped
+    from `path` so every process on the host shares them.
+
+    Updates hold an `flock` on the file, so a check costs a few microseconds and
+    no round trip. A full bucket carries no information, so its slot is reused
+    by other keys; when every probed slot is busy the one closest to full is
+    taken over, which only ever lets a client through early.
+    """
+
+    def __init__(self, path, slots):
+        self.path = path
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._pid = None
+        self._file = None
+        self._map = None
+
+    def _open(self):
+        # a forked worker needs its own file description, or its flock would be shared
+        if self._pid == os.getpid():
+            return
+        size = self.slots * SLOT.size
+        # other users must not read or reset the buckets, nor point the path elsewhere
+        os.makedirs(os.path.dirname(self.path) or ".", mode=0o700, exist_ok=True)
+        file = os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600), "r+b")
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            if os.fstat(file.fileno()).st_size != size:
+                file.truncate(0)
+                file.truncate(size)
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+        self._map = mmap.mmap(file.fileno(), size)
+        self._file = file
+        self._pid = os.getpid()
+
+    def _find_slot(self, key_hash, now):
+        home = key_hash % self.slots
+        free = None
+        oldest = None
+        for i in range(PROBES):
+            index = (home + i) % self.slots
+            slot_hash, tokens, updated, full_at = SLOT.unpack_from(self._map, index * SLOT.size)
+            if slot_hash == key_hash:
+                return index, (tokens, updated, full_at)
+            if free is None and (slot_hash == 0 or full_at <= now):
+                free = index
+            if oldest is None or full_at < oldest[1]:
+                oldest = (index, full_at)
+        return (free if free is not None else oldest[0]), None
+
+    def consume(self, key, rate, capacity, cost=1):
+        """Take `cost` tokens from the bucket of `key` and return the seconds to wait, 0 when allowed."""
+        key_hash = _key_hash(key)
+        with self._lock:
+            self._open()
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                index, bucket = self._find_slot(key_hash, now)
+                tokens = capacity
+                if bucket is not None and bucket[2] > now:
+                    tokens = _refill(bucket[0], bucket[1], now, rate, capacity)
+                tokens, wait, full_at = _take(tokens, now, rate, capacity, cost)
+                SLOT.pack_into(self._map, index * SLOT.size, key_hash, tokens, now, full_at)
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+        return wait
+
+    def close(self):
+        """Unmap the file, it is mapped again from `path` on the next use."""
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._file.close()
+            self._pid = self._file = self._map = None
+
+    def clear(self):
+        with self._lock:
+            self._open()
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                self._map[:] = bytes(len(self._map))
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+
+
+def get_token_buckets(path, slots):
+    """Buckets shared through `path` where possible, else buckets of this process."""
+    if fcntl is None or not path:
+        return LocalTokenBuckets()
+    return MappedTokenBuckets(path, slots)
@@ -0,0 +1,60 @@
+from drf_yasg import openapi
+
+sparse_fields_parameters = [
+    openapi.Parameter(
+        "fields", openapi.IN_QUERY, description="Comma separated fields to return", type=openapi.TYPE_STRING
+    ),
+    openapi.Parameter(
+        "exclude", openapi.IN_QUERY, description="Comma separated fields to leave out", type=openapi.TYPE_STRING
+    ),
+]
+
+
+def _parse_field_names(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.split(",")
+    return {name.strip() for name in value if name.strip()}
+
+
+class SparseFieldsMixin:
+    """
+    Render only the fields picked with `?fields=` / `?exclude=` on safe requests
+    or with the `fields` / `exclude` keyword arguments.
+
+    Left out fields are dropped before they are bound, so their values are never
+    computed and querysets shaped after the serializer do not load them. Fields
+    of the nested serializers listed in `Meta.flatten` are addressed by their
+    own names, the way the serializer renders them.
+    """
+
+    def __init__(self, *args, fields=None, exclude=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get("request")
+        if request is not None and request.method in ("GET", "HEAD"):
+            fields = fields if fields is not None else request.query_params.get("fields")
+            exclude = exclude if exclude is not None else request.query_params.get("exclude")
+        self.sparse_fields = _parse_field_names(fields)
+        self.sparse_exclude = _parse_field_names(exclude) or set()
+
+    def is_field_wanted(self, name):
+        return (self.sparse_fields is None or name in self.sparse_fields) and name not in self.sparse_exclude
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.sparse_fields is None and not self.sparse_exclude:
+            return fields
+
+        flatten = getattr(self.Meta, "flatten", ())
+        for name in list(fields):
+            if name in flatten:
+                nested = fields[name]
+                for nested_name in list(nested.fields):
+                    if not self.is_field_wanted(nested_name):
+                        del nested.fields[nested_name]
+                if not nested.fields:
+                    del fields[name]
+            elif not self.is_field_wanted(name):
+                del fields[name]
+        return fields
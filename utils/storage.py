@@ -0,0 +1,43 @@
+import hashlib
+import os
+import re
+
+from django.core.files.storage import FileSystemStorage
+
+# <sha256>.<ext>, or a derivative of it such as <sha256>_64.webp
+HASHED_NAME_RE = re.compile(r"(^|/)[0-9a-f]{64}(_\w+)?\.\w+$")
+
+
+class HashedFileSystemStorage(FileSystemStorage):
+    """
+    File system storage naming files after the sha256 of their content.
+
+    Saving content that is already stored returns the existing name instead of
+    writing a copy, so identical uploads share one file. Callers must check that
+    no one else references a file before deleting it. Since a name always
+    refers to the same content, hashed files can be cached forever.
+    """
+
+    def _save(self, name, content):
+        name = self.get_hashed_name(name, content)
+        if self.exists(name):
+            return name
+        return super()._save(name, content)
+
+    def get_hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        dir_name, file_name = os.path.split(name)
+        _root, ext = os.path.splitext(file_name)
+        return os.path.join(dir_name, f"{digest.hexdigest()}{ext.lower()}")
+
+    def save_as(self, name, content):
+        """Store `content` under exactly `name`, for files derived from a hashed original."""
+        self.delete(name)
+        return super()._save(name, content)
+
+    @staticmethod
+    def is_immutable(name):
+        return HASHED_NAME_RE.search(name) is not None
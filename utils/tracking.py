@@ -0,0 +1,63 @@
+from django.db.models import FileField
+from django.db.models.signals import post_init, post_save, pre_save
+
+
+def _value(field, value):
+    # files are compared by name, their objects are updated in place when saved
+    return (getattr(value, "name", value) or "") if isinstance(field, FileField) else value
+
+
+def remember_fields(instance, fields=None):
+    """Take the current values of the loaded `fields` (all by default) as the unchanged ones."""
+    # a new dict, copies of the instance (`copy.copy`) share the old one
+    loaded = dict(instance.__dict__.get("_loaded_values", {}))
+    for field in instance._meta.concrete_fields:
+        if (fields is None or field.name in fields or field.attname in fields) and field.attname in instance.__dict__:
+            loaded[field.attname] = _value(field, instance.__dict__[field.attname])
+    instance._loaded_values = loaded
+
+
+def get_changed_fields(instance):
+    """
+    Names of the concrete fields of a tracked `instance` assigned a different
+    value since it was loaded or last saved. Deferred fields that were never
+    assigned are left out without being loaded.
+    """
+    loaded = instance.__dict__.get("_loaded_values", {})
+    changed = set()
+    for field in instance._meta.concrete_fields:
+        if field.attname not in instance.__dict__:
+            continue
+        if field.attname not in loaded or _value(field, instance.__dict__[field.attname]) != loaded[field.attname]:
+            changed.add(field.name)
+    return changed
+
+
+def get_saved_changes(instance):
+    """In a `post_save` receiver, the fields `get_changed_fields` returned just before the save."""
+    return instance.__dict__.get("_saved_changes", set())
+
+
+def _on_init(sender, instance, **kwargs):
+    remember_fields(instance)
+
+
+def _on_pre_save(sender, instance, update_fields=None, **kwargs):
+    changed = get_changed_fields(instance)
+    instance._saved_changes = changed if update_fields is None else changed & set(update_fields)
+
+
+def _on_post_save(sender, instance, update_fields=None, **kwargs):
+    remember_fields(instance, update_fields)
+
+
+def track_changes(model):
+    """
+    Record which fields of `model` instances change between loading and saving,
+    see `get_changed_fields` and `get_saved_changes`. Works for models of other
+    apps, such as `User`, as it only relies on signals.
+    """
+    uid = f"track_changes:{model._meta.label}"
+    post_init.connect(_on_init, sender=model, dispatch_uid=uid)
+    pre_save.connect(_on_pre_save, sender=model, dispatch_uid=uid)
+    post_save.connect(_on_post_save, sender=model, dispatch_uid=uid)